@@ -1 +1,125 @@
+"""
+UEP-TTS 命令列入口
+各子命令讀取 training_configs/ 中的設定作為預設值，重量級的套件（torch / transformers / peft / trl / outetts）
+只在子命令真正需要時才 import，--help、資料準備與檢查不必等框架載入。
 
+    python UEP_TTS.py prepare --check              # 只檢查資料集與 token store
+    python UEP_TTS.py prepare                      # 預先編碼 codec token
+    python UEP_TTS.py train --resume               # 訓練 LoRA（參數見 training_configs/config_sft.yaml）
+    python UEP_TTS.py merge --streaming            # 合併 adapter 到 base model
+    python UEP_TTS.py generate --text "Hello!" --speaker uep_speaker --adapter outputs/lora_model
+    python UEP_TTS.py bench --speaker uep_speaker  # 速度基準測試
+
+prepare / preprocess / train / merge / bench 之後的參數會原樣交給對應的 src/ 腳本（可用 <子命令> --help 查看），
+由設定檔推得的預設值放在最前面，命令列上指定的同名參數會覆蓋它們。
+"""
+import os
+import sys
+import argparse
+import importlib
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(base_dir, "src"))
+
+from train_outetts import DEFAULT_SFT_CONFIG, DEFAULT_LORA_CONFIG, load_training_config
+
+# 子命令 -> (模組, 說明)
+FORWARDED = {
+    "prepare": ("prepare_data", "預先編碼訓練音檔為 codec token（--check 只檢查資料）"),
+    "preprocess": ("preprocess_audio", "驗證並把原始音檔正規化成 24 kHz"),
+    "train": ("train_outetts", "訓練 LoRA adapter"),
+    "merge": ("merge_lora", "把 LoRA adapter 合併到 base model"),
+    "bench": ("benchmark_tts", "TTS 速度基準測試"),
+}
+
+
+def config_defaults(command, config, args):
+    """由設定檔推得各子命令的預設參數"""
+    if command == "prepare":
+        return ["--dataset", config["dataset"], "--store", config["token_store"]]
+    if command == "train":
+        return ["--config", args.config, "--lora-config", args.lora_config]
+    if command == "merge":
+        return ["--base", config["model_dir"], "--lora", config["output_dir"]]
+    if command == "bench":
+        return ["--model", config["model_dir"]]
+    return []
+
+
+def generate(args, config):
+    """以常駐引擎生成一段語音並寫檔（格式依副檔名決定）"""
+    from tts_engine import TTSEngine
+    from audio_sink import write_audio, to_samples
+
+    engine = TTSEngine(args.model or config["model_dir"], backend=args.backend, device=args.device,
+                       length_guard=not args.no_length_guard)
+    adapter = None
+    if args.adapter:
+        from adapters import AdapterManager, parse_adapter_args
+
+        (adapter, path), = parse_adapter_args([args.adapter]).items()
+        AdapterManager(engine).load(adapter, path)
+
+    if not args.trace:
+        output = engine.generate(args.text, speaker=args.speaker, adapter=adapter)
+        path = write_audio(to_samples(output.audio), output.sr, args.output)
+        print(f"💾 已保存: {path}")
+        return
+
+    # 分段量測：文字處理、prompt、prefill / decode、codec 解碼與寫檔
+    from synthesis_trace import Tracer, instrument
+
+    tracer = Tracer(per_token=args.per_token)
+    instrument(engine.interface, tracer)
+    with tracer.span("synthesize", text=args.text):
+        output = engine.generate(args.text, speaker=args.speaker, adapter=adapter)
+    with tracer.span("write", path=args.output):
+        path = write_audio(to_samples(output.audio), output.sr, args.output)
+    print(f"💾 已保存: {path}")
+    tracer.print_summary()
+    print(f"📈 trace 已保存: {tracer.save(args.trace)}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="UEP_TTS.py", description="UEP-TTS 訓練與生成工具")
+    parser.add_argument("--config", default=DEFAULT_SFT_CONFIG, help="訓練設定（YAML）")
+    parser.add_argument("--lora-config", default=DEFAULT_LORA_CONFIG, help="LoRA 設定（JSON）")
+    subparsers = parser.add_subparsers(dest="command", metavar="<子命令>")
+    subparsers.required = True
+
+    for command, (_, help_text) in FORWARDED.items():
+        # --help 也交給對應的腳本處理
+        subparsers.add_parser(command, help=help_text, add_help=False)
+
+    gen = subparsers.add_parser("generate", help="生成一段語音")
+    gen.add_argument("--text", required=True)
+    gen.add_argument("--speaker", default=None, help="speaker 名稱或 profile 路徑")
+    gen.add_argument("--adapter", default=None, help="LoRA adapter（name=path 或目錄）")
+    gen.add_argument("--model", default=None, help="模型目錄，預設為設定檔中的 model_dir")
+    gen.add_argument("--backend", default="hf", help="hf / hf-int8 / llamacpp")
+    gen.add_argument("--device", default=None)
+    gen.add_argument("--output", default=os.path.join(base_dir, "outputs", "samples", "output.wav"),
+                     help="輸出檔（wav / flac / ogg / opus / pcm）")
+    gen.add_argument("--trace", default=None, help="記錄各階段耗時：.json 為 Chrome trace，.jsonl 為結構化紀錄")
+    gen.add_argument("--per-token", action="store_true", help="trace 中另外記錄每個 decode 步驟")
+    gen.add_argument("--no-length-guard", action="store_true", help="不依文字長度限制生成長度、不偵測失控")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    if args.command == "generate" and rest:
+        parser.error(f"無法辨識的參數: {' '.join(rest)}")
+
+    config, _ = load_training_config(args.config, args.lora_config)
+    if args.command == "generate":
+        return generate(args, config)
+
+    module_name = FORWARDED[args.command][0]
+    module = importlib.import_module(module_name)
+    return module.main(config_defaults(args.command, config, args) + rest)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,36 @@
 import outetts
 import os
+import sys
+import argparse
 from outetts import GenerationConfig, SamplerConfig, ModelConfig, Interface, Backend, GenerationType
 
 # 使用絕對路徑
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 model_dir = os.path.join(base_dir, "models", "Llama-OuteTTS-1.0-1B")
+sys.path.insert(0, os.path.join(base_dir, "src"))
+
+from tts_engine import create_interface, BACKENDS
+from generation_budget import guard
+
+# 選擇 backend：hf（預設）/ hf-int8（CPU int8 量化）/ llamacpp（GGUF，--model 指向 .gguf 檔）
+parser = argparse.ArgumentParser()
+parser.add_argument("--backend", default="hf", choices=BACKENDS)
+parser.add_argument("--model", default=model_dir)
+args = parser.parse_args()
 
 # 嘗試使用本地模式
-interface = outetts.Interface(
-    config=outetts.ModelConfig(
-    model_path=model_dir,  # 只指定模型目錄，不包括具體的.safetensors文件
+interface = create_interface(
+    model_path=args.model,  # 只指定模型目錄，不包括具體的.safetensors文件
     tokenizer_path=model_dir,
-    interface_version=outetts.InterfaceVersion.V3,
-    backend=outetts.Backend.HF,
+    backend=args.backend,
     n_gpu_layers=99
-    )
 )
 
+# 依文字長度限制生成長度，長時間靜音或重複迴圈時提前結束
+guard(interface)
+
 # 建立 speaker profile（只需大約 10 秒左右的參考音檔）
+# 一次建立多個 speaker 請使用: python src/build_speakers.py <音檔目錄> --workers 4
 speaker = interface.create_speaker("../data/my_reference.mp3")
 interface.save_speaker(speaker, "../speaker/bernie_speaker.json")
 
@@ -1,9 +1,16 @@
 import outetts
 import os
+import sys
+import argparse
+import contextlib
 from outetts import GenerationConfig, SamplerConfig, ModelConfig, Interface, Backend, GenerationType
 
-def test_lora_model():
-    """測試訓練好的LoRA模型效果"""
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from audio_sink import AudioSink
+from generation_budget import guard
+
+def test_lora_model(trace_path=None, per_token=False):
+    """測試訓練好的LoRA模型效果；trace_path 指定時記錄每個階段的時間與記憶體"""
     
     # 使用絕對路徑
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -43,6 +50,18 @@ def test_lora_model():
         )
         
         print("✅ 模型載入成功")
+        # 依文字長度限制生成長度，長時間靜音或重複迴圈時提前結束
+        guard(interface)
+
+        # 分段量測（--trace）：文字處理、prompt、prefill / decode、codec 解碼與寫檔
+        tracer = None
+        if trace_path:
+            from synthesis_trace import Tracer, instrument
+            tracer = Tracer(per_token=per_token)
+            instrument(interface, tracer)
+
+        def traced(text):
+            return tracer.span("synthesize", text=text) if tracer else contextlib.nullcontext()
         
         # 測試文本列表（包含你訓練數據中的類型）
         test_texts = [
@@ -73,74 +92,86 @@ def test_lora_model():
         # 生成測試語音
         print("🎙️ 開始生成測試語音...")
         
-        for i, text in enumerate(test_texts):
-            try:
-                print(f"  生成 {i+1}/{len(test_texts)}: {text[:50]}...")
+        # 寫檔交給背景執行緒，與下一句的生成重疊；離開 with 時等待全部寫完
+        with AudioSink(tracer=tracer) as sink:
+            for i, text in enumerate(test_texts):
+                try:
+                    print(f"  生成 {i+1}/{len(test_texts)}: {text[:50]}...")
+                
+                    with traced(text):
+                        output = interface.generate(
+                            config=GenerationConfig(
+                                text=text,
+                                generation_type=GenerationType.CHUNKED,
+                                speaker=speaker,
+                                sampler_config=SamplerConfig(
+                                    temperature=0.8,
+                                    repetition_penalty=1.1,
+                                    repetition_range=64,  # 重要：限制在64-token避免破音
+                                    top_k=40,
+                                    top_p=0.9,
+                                    min_p=0.05
+                                ),
+                            )
+                        )
                 
-                output = interface.generate(
+                    # 保存音頻
+                    output_file = os.path.join(output_dir, f"lora_test_{i+1:02d}.wav")
+                    sink.submit(output, output_file)
+                    print(f"    ✅ 排入寫檔: {output_file}")
+                
+                except Exception as e:
+                    print(f"    ❌ 生成失敗 {i+1}: {e}")
+        
+            print(f"\n🎉 測試完成！音頻文件保存在: {output_dir}")
+            print("\n📋 評估建議:")
+            print("  1. 聽取生成的音頻，評估音質和自然度")
+            print("  2. 比較不同文本長度的效果")
+            print("  3. 檢查是否有破音或不自然的地方")
+            print("  4. 與原始模型對比效果差異")
+        
+            # 生成對比測試（原始模型）
+            print("\n🔄 生成原始模型對比...")
+            interface_original = outetts.Interface(
+                config=outetts.ModelConfig(
+                    model_path=model_dir,
+                    tokenizer_path=model_dir,
+                    interface_version=outetts.InterfaceVersion.V3,
+                    backend=outetts.Backend.HF,
+                    n_gpu_layers=99
+                )
+            )
+        
+            guard(interface_original)
+            if tracer:
+                instrument(interface_original, tracer)
+
+            # 生成一個對比樣本
+            compare_text = "Hello, this is a comparison between the original and fine-tuned model."
+            with traced(compare_text):
+                original_output = interface_original.generate(
                     config=GenerationConfig(
-                        text=text,
+                        text=compare_text,
                         generation_type=GenerationType.CHUNKED,
                         speaker=speaker,
                         sampler_config=SamplerConfig(
-                            temperature=0.8,
+                            temperature=0.4,
                             repetition_penalty=1.1,
-                            repetition_range=64,  # 重要：限制在64-token避免破音
+                            repetition_range=64,
                             top_k=40,
                             top_p=0.9,
                             min_p=0.05
                         ),
                     )
                 )
-                
-                # 保存音頻
-                output_file = os.path.join(output_dir, f"lora_test_{i+1:02d}.wav")
-                output.save(output_file)
-                print(f"    ✅ 保存: {output_file}")
-                
-            except Exception as e:
-                print(f"    ❌ 生成失敗 {i+1}: {e}")
-        
-        print(f"\n🎉 測試完成！音頻文件保存在: {output_dir}")
-        print("\n📋 評估建議:")
-        print("  1. 聽取生成的音頻，評估音質和自然度")
-        print("  2. 比較不同文本長度的效果")
-        print("  3. 檢查是否有破音或不自然的地方")
-        print("  4. 與原始模型對比效果差異")
         
-        # 生成對比測試（原始模型）
-        print("\n🔄 生成原始模型對比...")
-        interface_original = outetts.Interface(
-            config=outetts.ModelConfig(
-                model_path=model_dir,
-                tokenizer_path=model_dir,
-                interface_version=outetts.InterfaceVersion.V3,
-                backend=outetts.Backend.HF,
-                n_gpu_layers=99
-            )
-        )
-        
-        # 生成一個對比樣本
-        compare_text = "Hello, this is a comparison between the original and fine-tuned model."
-        original_output = interface_original.generate(
-            config=GenerationConfig(
-                text=compare_text,
-                generation_type=GenerationType.CHUNKED,
-                speaker=speaker,
-                sampler_config=SamplerConfig(
-                    temperature=0.4,
-                    repetition_penalty=1.1,
-                    repetition_range=64,
-                    top_k=40,
-                    top_p=0.9,
-                    min_p=0.05
-                ),
-            )
-        )
-        
-        original_file = os.path.join(output_dir, "original_comparison.wav")
-        original_output.save(original_file)
+            original_file = os.path.join(output_dir, "original_comparison.wav")
+            sink.submit(original_output, original_file)
         print(f"✅ 原始模型對比: {original_file}")
+
+        if tracer:
+            tracer.print_summary()
+            print(f"📈 trace 已保存: {tracer.save(trace_path)}")
         
     except Exception as e:
         print(f"❌ 測試過程中發生錯誤: {e}")
@@ -150,4 +181,8 @@ def test_lora_model():
         print("  - API參數不正確")
 
 if __name__ == "__main__":
-    test_lora_model()
+    parser = argparse.ArgumentParser(description="測試訓練好的LoRA模型")
+    parser.add_argument("--trace", default=None, help="記錄各階段耗時：.json 為 Chrome trace，.jsonl 為結構化紀錄")
+    parser.add_argument("--per-token", action="store_true", help="trace 中另外記錄每個 decode 步驟")
+    args = parser.parse_args()
+    test_lora_model(args.trace, args.per_token)
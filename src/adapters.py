@@ -0,0 +1,104 @@
+"""
+LoRA adapter 熱切換
+base model 只載入一次，adapter 以 PEFT 掛在記憶體中的模型上，可同時常駐多個並依請求切換，
+不需要 merge_and_unload() 再把整個 1B 模型寫到磁碟、重新載入。
+
+    manager = AdapterManager(engine)
+    manager.load("uep", "outputs/lora_model")
+    engine.generate("Hello!", adapter="uep")     # 使用 adapter
+    engine.generate("Hello!")                    # 原始 base model
+
+切換與生成都在 engine.lock 內進行，同一時間只會有一個 adapter 生效。
+"""
+import os
+import time
+import contextlib
+
+
+class AdapterManager:
+    """管理掛在 TTSEngine 上的 PEFT adapter（只支援 HF backend）"""
+
+    def __init__(self, engine):
+        import outetts
+
+        if engine.interface.config.backend != outetts.Backend.HF:
+            raise ValueError("adapter 熱切換目前只支援 HF backend")
+
+        self.engine = engine
+        self.base_model = engine.interface.model.model
+        self.peft_model = None
+        self.paths = {}
+        engine.adapters = self
+
+    def loaded(self):
+        return sorted(self.paths)
+
+    def path(self, name):
+        return self.paths.get(name)
+
+    def load(self, name, path):
+        """載入 adapter；同名 adapter 已存在時先卸載再重新載入"""
+        from peft import PeftModel
+
+        if not os.path.exists(os.path.join(path, "adapter_config.json")):
+            raise FileNotFoundError(f"找不到 adapter_config.json: {path}")
+
+        start = time.perf_counter()
+        with self.engine.lock:
+            if name in self.paths:
+                self._delete(name)
+            if self.peft_model is None:
+                self.peft_model = PeftModel.from_pretrained(
+                    self.base_model, path, adapter_name=name, is_trainable=False
+                )
+                self.peft_model.eval()
+                self.engine.interface.model.model = self.peft_model
+            else:
+                self.peft_model.load_adapter(path, adapter_name=name, is_trainable=False)
+            self.paths[name] = path
+        self.engine.adapter_changed(name)
+        return time.perf_counter() - start
+
+    def unload(self, name):
+        """卸載 adapter；最後一個 adapter 卸載後還原成原本的 base model"""
+        if name not in self.paths:
+            raise KeyError(f"adapter 未載入: {name}")
+        with self.engine.lock:
+            self._delete(name)
+        self.engine.adapter_changed(name)
+
+    def _delete(self, name):
+        del self.paths[name]
+        if not self.paths:
+            self.base_model = self.peft_model.unload()
+            self.engine.interface.model.model = self.base_model
+            self.peft_model = None
+            return
+        if name in self.peft_model.active_adapters:
+            self.peft_model.set_adapter(next(iter(self.paths)))
+        self.peft_model.delete_adapter(name)
+
+    def activate(self, name=None):
+        """
+        回傳讓指定 adapter 生效的 context manager，name 為 None 時暫時停用所有 adapter
+        呼叫端需持有 engine.lock
+        """
+        if name is None:
+            if self.peft_model is None:
+                return contextlib.nullcontext()
+            return self.peft_model.disable_adapter()
+        if name not in self.paths:
+            raise KeyError(f"adapter 未載入: {name}")
+        self.peft_model.set_adapter(name)
+        return contextlib.nullcontext()
+
+
+def parse_adapter_args(values):
+    """把 CLI 的 name=path 清單轉成 dict；只給路徑時以資料夾名稱當作 adapter 名稱"""
+    adapters = {}
+    for value in values:
+        name, sep, path = value.partition("=")
+        if not sep:
+            name, path = os.path.basename(os.path.normpath(value)), value
+        adapters[name] = path
+    return adapters
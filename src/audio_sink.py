@@ -0,0 +1,152 @@
+"""
+非同步的音訊輸出
+生成迴圈原本在每一句結束後同步呼叫 output.save(path)，寫檔與編碼的時間直接加在下一句的生成之前。
+AudioSink 把完成的音訊交給背景的寫檔執行緒池，主執行緒立刻開始下一句：
+
+    with AudioSink(workers=2, max_pending=8) as sink:
+        for i, text in enumerate(texts):
+            output = engine.generate(text)
+            sink.submit(output, f"outputs/samples/{i}.flac")
+    # 離開 with 時等待所有檔案寫完
+
+支援的格式依副檔名決定（或以 fmt 指定）：
+- wav：16-bit PCM（標準函式庫 wave，不需額外套件）
+- flac / ogg（Vorbis）/ opus：透過 soundfile（libsndfile）；opus 只接受 8/12/16/24/48 kHz，必要時重採樣成 48 kHz
+- pcm / raw：little-endian 16-bit mono，無標頭
+
+待寫入的工作數有上限（max_pending），佇列滿時 submit 會阻塞，避免生成速度大於寫檔速度時記憶體無限成長。
+"""
+import os
+import wave
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+FORMATS = ("wav", "flac", "ogg", "opus", "pcm", "raw")
+SOUNDFILE_FORMATS = {"flac": ("FLAC", "PCM_16"), "ogg": ("OGG", "VORBIS"), "opus": ("OGG", "OPUS")}
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+
+def to_samples(audio):
+    """把 tensor / ndarray 轉成 1D float32 ndarray（在呼叫端執行，之後 GPU 上的原值可以被釋放或覆寫）"""
+    if hasattr(audio, "detach"):
+        audio = audio.detach().flatten().float().cpu().numpy()
+    return np.ascontiguousarray(np.asarray(audio, dtype=np.float32).reshape(-1))
+
+
+def to_pcm16(samples):
+    return (np.clip(samples, -1.0, 1.0) * 32767.0).round().astype("<i2")
+
+
+def resample(samples, sr, target_sr):
+    if sr == target_sr:
+        return samples
+    import torch
+    import torchaudio
+
+    return torchaudio.functional.resample(torch.from_numpy(samples), sr, target_sr).numpy()
+
+
+def detect_format(path, fmt=None):
+    fmt = (fmt or os.path.splitext(path)[1].lstrip(".") or "wav").lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"不支援的輸出格式: {fmt}，可用: {', '.join(FORMATS)}")
+    return fmt
+
+
+def write_audio(samples, sr, path, fmt=None):
+    """同步寫出一段音訊（背景執行緒中執行），回傳實際寫入的路徑"""
+    fmt = detect_format(path, fmt)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # 先寫暫存檔再取代，讀取端不會看到寫到一半的檔案
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+
+    if fmt == "wav":
+        with wave.open(tmp_path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(sr)
+            f.writeframes(to_pcm16(samples).tobytes())
+    elif fmt in ("pcm", "raw"):
+        with open(tmp_path, "wb") as f:
+            f.write(to_pcm16(samples).tobytes())
+    else:
+        import soundfile as sf
+
+        container, subtype = SOUNDFILE_FORMATS[fmt]
+        if fmt == "opus" and sr not in OPUS_RATES:
+            samples, sr = resample(samples, sr, 48000), 48000
+        sf.write(tmp_path, samples, sr, format=container, subtype=subtype)
+
+    os.replace(tmp_path, path)
+    return path
+
+
+class AudioSink:
+    """
+    背景寫檔池
+    submit 回傳 concurrent.futures.Future（結果為寫入的路徑）；寫檔失敗不會中斷生成迴圈，
+    錯誤會記錄在 errors 中，並由 on_error 回呼（預設印出訊息）
+    """
+
+    def __init__(self, workers=2, max_pending=8, default_format=None, on_error=None, tracer=None):
+        self.default_format = default_format
+        # synthesis_trace.Tracer：每次寫檔記錄一個 write span
+        self.tracer = tracer
+        self.on_error = on_error or (lambda path, e: print(f"    ❌ 寫入失敗 {path}: {e}"))
+        self.errors = []
+        self.written = 0
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="audio-sink")
+
+    def submit(self, audio, path, sr=None, fmt=None):
+        """
+        audio 可以是 outetts 的 ModelOutput（使用其 .sr）或 tensor / ndarray（需指定 sr）
+        佇列已滿時阻塞到有工作完成為止
+        """
+        if sr is None:
+            sr = getattr(audio, "sr", None)
+            if sr is None:
+                raise ValueError("傳入 tensor / ndarray 時需要指定 sr")
+        samples = to_samples(getattr(audio, "audio", audio))
+        fmt = detect_format(path, fmt or self.default_format)
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._write, samples, sr, path, fmt)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._done(f, path))
+        return future
+
+    def _write(self, samples, sr, path, fmt):
+        if self.tracer is None:
+            return write_audio(samples, sr, path, fmt)
+        with self.tracer.span("write", path=path, format=fmt, audio_seconds=len(samples) / sr):
+            return write_audio(samples, sr, path, fmt)
+
+    def _done(self, future, path):
+        self._slots.release()
+        error = future.exception()
+        with self._lock:
+            if error is None:
+                self.written += 1
+            else:
+                self.errors.append((path, error))
+        if error is not None:
+            self.on_error(path, error)
+
+    def close(self, wait=True):
+        """等待（或放棄）尚未完成的寫檔並結束執行緒池"""
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
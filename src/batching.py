@@ -0,0 +1,294 @@
+"""
+動態批次排程
+在短時間窗內收集同時到達的生成請求，把各自的 prompt 左側補齊後堆成一個 batch，
+以單次自回歸解碼同時生成；每條序列有自己的 sampler 設定與停止條件。
+長文字（chunked）會先切段，每一段都是 batch 中的一條序列，最後再依序拼回各請求。
+目前只支援 HF backend。
+"""
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+import torch
+
+from tts_engine import prompt_safe_speaker
+
+
+class SynthesisRequest:
+    def __init__(self, text, speaker=None, generation_type="chunked", sampler=None, max_length=8192,
+                 adapter=None):
+        self.text = text
+        self.speaker = speaker
+        self.generation_type = generation_type
+        self.sampler = sampler
+        self.max_length = max_length
+        self.adapter = adapter
+        self.cache_key = None
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.started_at = None
+
+
+def apply_repetition_penalty(logits, history, penalty, window):
+    """與 outetts 的 patch 相同：只對最近 window 個 token 套用 repetition penalty"""
+    if penalty == 1.0 or window <= 0 or not history:
+        return logits
+    idx = torch.tensor(sorted(set(history[-window:])), device=logits.device)
+    idx = idx[idx < logits.shape[-1]]
+    values = logits[idx]
+    logits[idx] = torch.where(values > 0, values / penalty, values * penalty)
+    return logits
+
+
+def sample_next(logits, history, sampler, generator=None):
+    """對單一序列的 logits 依序套用 repetition penalty、temperature、top-k、top-p、min-p 後取樣"""
+    logits = apply_repetition_penalty(logits, history, sampler.repetition_penalty, sampler.repetition_range)
+    if sampler.temperature <= 0:
+        return int(torch.argmax(logits))
+
+    logits = logits / sampler.temperature
+    if sampler.top_k > 0:
+        kth = torch.topk(logits, min(sampler.top_k, logits.shape[-1])).values[-1]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+
+    probs = torch.softmax(logits, dim=-1)
+    if sampler.top_p < 1.0:
+        sorted_probs, sorted_idx = torch.sort(probs, descending=True)
+        remove = torch.cumsum(sorted_probs, dim=-1) - sorted_probs > sampler.top_p
+        probs[sorted_idx[remove]] = 0.0
+    if sampler.min_p > 0.0:
+        probs = probs.masked_fill(probs < sampler.min_p * probs.max(), 0.0)
+
+    return int(torch.multinomial(probs / probs.sum(), 1, generator=generator))
+
+
+def select_cache_rows(past, index):
+    """從 KV cache 中只保留 index 指定的序列"""
+    if hasattr(past, "batch_select_indices"):
+        past.batch_select_indices(index)
+        return past
+    return tuple(tuple(t.index_select(0, index) for t in layer) for layer in past)
+
+
+@torch.no_grad()
+def batched_decode(model, prompts, samplers, max_new_tokens, stop_ids, pad_id, detectors=None):
+    """
+    prompts: 每條序列的 prompt token list
+    samplers: 每條序列的 SamplerConfig
+    max_new_tokens: 每條序列的生成上限
+    detectors: 每條序列的 generation_budget.RunawayDetector（可省略），失控時該序列提前結束並去掉尾巴
+    回傳每條序列生成的 token list（不含停止 token）
+    """
+    device = model.device
+    n = len(prompts)
+    width = max(len(p) for p in prompts)
+
+    input_ids = torch.full((n, width), pad_id, dtype=torch.long, device=device)
+    attention_mask = torch.zeros((n, width), dtype=torch.long, device=device)
+    for i, prompt in enumerate(prompts):
+        input_ids[i, width - len(prompt):] = torch.tensor(prompt, dtype=torch.long, device=device)
+        attention_mask[i, width - len(prompt):] = 1
+    position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+    histories = [list(p) for p in prompts]
+    outputs = [[] for _ in range(n)]
+    # active[row] = 目前 batch 第 row 列對應的原始序列編號
+    active = list(range(n))
+    past = None
+    step_ids = input_ids
+
+    while active:
+        out = model(
+            input_ids=step_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=past,
+            use_cache=True,
+        )
+        past = out.past_key_values
+        logits = out.logits[:, -1, :].float()
+
+        next_tokens, keep = [], []
+        for row, seq in enumerate(active):
+            token = sample_next(logits[row], histories[seq], samplers[seq])
+            histories[seq].append(token)
+            next_tokens.append(token)
+            if token in stop_ids:
+                continue
+            outputs[seq].append(token)
+            if detectors is not None and detectors[seq].feed(token):
+                outputs[seq] = detectors[seq].trim(outputs[seq])
+                continue
+            if len(outputs[seq]) < max_new_tokens[seq]:
+                keep.append(row)
+
+        if not keep:
+            break
+        if len(keep) < len(active):
+            # 已結束的序列直接從 batch 與 KV cache 中移除，後續步驟不再為它們計算
+            index = torch.tensor(keep, dtype=torch.long, device=device)
+            past = select_cache_rows(past, index)
+            attention_mask = attention_mask.index_select(0, index)
+            position_ids = position_ids.index_select(0, index)
+            active = [active[row] for row in keep]
+            next_tokens = [next_tokens[row] for row in keep]
+
+        step_ids = torch.tensor(next_tokens, dtype=torch.long, device=device).unsqueeze(1)
+        attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(active), 1))], dim=1)
+        position_ids = position_ids[:, -1:] + 1
+
+    return outputs
+
+
+class BatchScheduler:
+    """收集時間窗內的請求並批次生成"""
+
+    def __init__(self, engine, max_batch_size=8, window_ms=20, max_queue=64):
+        import outetts
+
+        if engine.interface.config.backend != outetts.Backend.HF:
+            raise ValueError("批次排程目前只支援 HF backend")
+
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000.0
+        self.requests = queue.Queue(maxsize=max_queue)
+
+        interface = engine.interface
+        tokenizer = interface.prompt_processor.tokenizer
+        special = interface.prompt_processor.special_tokens
+        self.stop_ids = {
+            tokenizer.encode(special.audio_end, add_special_tokens=False)[0],
+            tokenizer.encode(special.eos, add_special_tokens=False)[0],
+        }
+        if tokenizer.eos_token_id is not None:
+            self.stop_ids.add(tokenizer.eos_token_id)
+        self.pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+
+        self._thread = threading.Thread(target=self._run, name="tts-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text, speaker=None, generation_type="chunked", sampler=None, max_length=8192, adapter=None):
+        """
+        送出請求，回傳 SynthesisRequest；request.future 的結果為 outetts 的 ModelOutput
+        佇列滿時丟出 queue.Full
+        """
+        request = SynthesisRequest(text, speaker, generation_type, sampler, max_length, adapter)
+        # 語音快取命中時直接完成，不進入佇列
+        request.cache_key, cached = self.engine.cache_lookup(text, speaker, generation_type, sampler, adapter)
+        if cached is not None:
+            request.future.set_result(cached)
+            return request
+        self.requests.put_nowait(request)
+        return request
+
+    def pending(self):
+        return self.requests.qsize()
+
+    def _collect(self):
+        """阻塞等待第一個請求，之後在時間窗內盡量多收集幾個"""
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _prepare(self, request):
+        """把請求切成一或多條序列，回傳 [(prompt ids, SamplerConfig, max_new_tokens)]"""
+        config = self.engine.make_config(
+            request.text, request.speaker, request.generation_type, request.sampler, request.max_length
+        )
+        sequences = []
+        for text in self.engine.split_text(config):
+            prompt = self.engine.interface.prepare_prompt(text, prompt_safe_speaker(config.speaker))
+            prompt = prompt[0].tolist()
+            budget = config.max_length - len(prompt)
+            if budget <= 0:
+                raise ValueError(f"prompt 長度 ({len(prompt)}) 已超過 max_length ({config.max_length})")
+            if self.engine.guard is not None:
+                budget = min(budget, self.engine.guard.max_new_tokens(text, config.speaker))
+            sequences.append((prompt, config.sampler_config, budget))
+        return sequences
+
+    def _run_batch(self, batch):
+        from outetts.version.playback import ModelOutput
+
+        interface = self.engine.interface
+        sequences, owners = [], []
+        for i, request in enumerate(batch):
+            # 呼叫端已逾時或取消的請求不再生成；其餘的請求標記為執行中，之後就無法再被取消，
+            # 生成完成時的 set_result 不會和呼叫端的 cancel() 互相競爭
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            request.started_at = time.perf_counter()
+            try:
+                for seq in self._prepare(request):
+                    sequences.append(seq)
+                    owners.append(i)
+            except Exception as e:
+                if not request.future.done():
+                    request.future.set_exception(e)
+
+        # 同一個 batch 只能套用一個 adapter，依 adapter 分組後各自批次生成
+        groups = {}
+        for index, owner in enumerate(owners):
+            groups.setdefault(batch[owner].adapter, []).append(index)
+
+        outputs = [None] * len(sequences)
+        guard = self.engine.guard
+        with self.engine.lock:
+            for adapter, indices in groups.items():
+                try:
+                    with self.engine.use_adapter(adapter):
+                        for start in range(0, len(indices), self.max_batch_size):
+                            part = indices[start:start + self.max_batch_size]
+                            results = batched_decode(
+                                interface.model.model,
+                                prompts=[sequences[i][0] for i in part],
+                                samplers=[sequences[i][1] for i in part],
+                                max_new_tokens=[sequences[i][2] for i in part],
+                                stop_ids=self.stop_ids,
+                                pad_id=self.pad_id,
+                                detectors=[guard.new_detector() for _ in part] if guard is not None else None,
+                            )
+                            for i, output in zip(part, results):
+                                outputs[i] = output
+                except Exception as e:
+                    for i in indices:
+                        if not batch[owners[i]].future.done():
+                            batch[owners[i]].future.set_exception(e)
+
+        tokens = [[] for _ in batch]
+        for owner, output in zip(owners, outputs):
+            if output is not None:
+                tokens[owner].extend(output)
+
+        for request, request_tokens in zip(batch, tokens):
+            if request.future.done():
+                continue
+            try:
+                audio = interface.get_audio(request_tokens)
+                if audio is None:
+                    raise RuntimeError("No audio tokens found in the output")
+                output = ModelOutput(audio, interface.audio_codec.sr)
+                self.engine.cache_store(request.cache_key, output)
+                request.future.set_result(output)
+            except Exception as e:
+                request.future.set_exception(e)
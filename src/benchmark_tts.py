@@ -0,0 +1,295 @@
+"""
+TTS 速度基準測試
+以固定的文字集（短句感嘆詞 / 中等長度句子 / 需要切段的長段落）測試指定的模型、adapter、speaker 與 sampler，
+量測模型載入時間、time-to-first-audio、tokens/sec、real-time factor、延遲百分位數與峰值記憶體，
+結果寫成 JSON，可與之前的結果比較以抓出效能退化。
+
+用法:
+    python src/benchmark_tts.py --backend hf --speaker uep_speaker --output outputs/benchmarks/base.json
+    python src/benchmark_tts.py --adapter uep=outputs/lora_model --compare outputs/benchmarks/base.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT_DIR = os.path.join(base_dir, "outputs", "benchmarks")
+
+DEFAULT_CORPUS = {
+    "short": [
+        "Wow!",
+        "I see.",
+        "Okay!",
+        "Hmm.",
+        "Alright!",
+    ],
+    "medium": [
+        "Hello there, how are you doing today?",
+        "The weather is beautiful today, isn't it?",
+        "I hope this training has improved the voice quality.",
+        "Testing the trained voice model with a longer sentence to see how well it performs.",
+    ],
+    "long": [
+        "Oh my gosh, stories are just the best! They whisk you away to different worlds and introduce you "
+        "to amazing characters. The emotions, the adventures... I just love getting lost in them! "
+        "Sometimes I stay up way too late because I simply have to know what happens next.",
+        "Good morning! Today we are going to walk through the whole setup step by step. First, make sure "
+        "the model is downloaded. Then prepare the speaker profile from a short reference clip. "
+        "Finally, run the generation script and listen to the result carefully.",
+    ],
+}
+
+# 與基準比較時，這些指標越小越好
+REGRESSION_METRICS = ("rtf_mean", "latency_p50", "latency_p95", "ttfa_p50")
+
+
+def peak_rss_mb():
+    """目前行程的峰值常駐記憶體（MB）；無法取得時回傳 None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 單位為 KB，macOS 為 bytes
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1024 / 1024
+    except ImportError:
+        return None
+
+
+def peak_gpu_mb():
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return torch.cuda.max_memory_allocated() / 1024 / 1024
+    except ImportError:
+        pass
+    return None
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "mean": float(values.mean()),
+    }
+
+
+def run_once(engine, text, speaker=None, sampler=None, adapter=None):
+    """以串流方式生成一次，回傳該次的各項量測值"""
+    from streaming import stream_generate
+
+    start = time.perf_counter()
+    ttfa = None
+    num_tokens = 0
+    num_samples = 0
+    sample_rate = None
+    for frame in stream_generate(engine, text, speaker=speaker, sampler=sampler, adapter=adapter):
+        if ttfa is None:
+            ttfa = frame.elapsed
+        num_tokens += frame.num_tokens
+        num_samples += len(frame.samples)
+        sample_rate = frame.sample_rate
+    latency = time.perf_counter() - start
+
+    audio_seconds = num_samples / sample_rate if sample_rate else 0.0
+    return {
+        "chars": len(text),
+        "latency": latency,
+        "ttfa": ttfa,
+        "tokens": num_tokens,
+        "tokens_per_second": num_tokens / latency if latency > 0 else 0.0,
+        "audio_seconds": audio_seconds,
+        "rtf": latency / audio_seconds if audio_seconds > 0 else None,
+    }
+
+
+def summarize(runs):
+    latencies = [r["latency"] for r in runs]
+    ttfas = [r["ttfa"] for r in runs if r["ttfa"] is not None]
+    rtfs = [r["rtf"] for r in runs if r["rtf"] is not None]
+    total_tokens = sum(r["tokens"] for r in runs)
+    latency = percentiles(latencies)
+    ttfa = percentiles(ttfas)
+    return {
+        "runs": len(runs),
+        "latency_p50": latency.get("p50"),
+        "latency_p95": latency.get("p95"),
+        "latency_p99": latency.get("p99"),
+        "ttfa_p50": ttfa.get("p50"),
+        "ttfa_p95": ttfa.get("p95"),
+        "ttfa_p99": ttfa.get("p99"),
+        "tokens_per_second": total_tokens / sum(latencies) if latencies else None,
+        "rtf_mean": float(np.mean(rtfs)) if rtfs else None,
+        "audio_seconds": sum(r["audio_seconds"] for r in runs),
+    }
+
+
+def run_benchmark(args, corpus):
+    from tts_engine import TTSEngine
+
+    start = time.perf_counter()
+    engine = TTSEngine(
+        model_path=args.model,
+        tokenizer_path=args.tokenizer,
+        backend=args.backend,
+        device=args.device,
+        speaker_dir=args.speaker_dir,
+        prefix_cache_mb=args.prefix_cache_mb,
+    )
+    load_seconds = time.perf_counter() - start
+    print(f"✅ 模型載入: {load_seconds:.1f}s")
+
+    adapter = None
+    if args.adapter:
+        from adapters import AdapterManager, parse_adapter_args
+
+        manager = AdapterManager(engine)
+        for adapter, path in parse_adapter_args([args.adapter]).items():
+            print(f"🔧 載入 adapter {adapter}: {manager.load(adapter, path):.1f}s")
+
+    sampler = json.loads(args.sampler) if args.sampler else None
+    engine.get_speaker(args.speaker)
+
+    for _ in range(args.warmup):
+        run_once(engine, DEFAULT_CORPUS["medium"][0], args.speaker, sampler, adapter)
+
+    runs, categories = [], {}
+    for category, texts in corpus.items():
+        category_runs = []
+        for text in texts:
+            for _ in range(args.repeats):
+                result = run_once(engine, text, args.speaker, sampler, adapter)
+                result["category"] = category
+                category_runs.append(result)
+                rtf = f"{result['rtf']:.2f}" if result["rtf"] is not None else "-"
+                print(f"  [{category}] {result['latency']:.2f}s  TTFA {result['ttfa'] or 0:.2f}s  "
+                      f"RTF {rtf}  {text[:40]}")
+        categories[category] = summarize(category_runs)
+        runs.extend(category_runs)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "model": args.model,
+            "backend": args.backend,
+            "adapter": args.adapter,
+            "speaker": args.speaker,
+            "sampler": sampler,
+            "device": args.device,
+            "prefix_cache_mb": args.prefix_cache_mb,
+            "repeats": args.repeats,
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+        },
+        "load_seconds": load_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_gpu_mb": peak_gpu_mb(),
+        "overall": summarize(runs),
+        "categories": categories,
+        "runs": runs,
+    }
+
+
+def compare(result, baseline, threshold):
+    """印出與基準的差異，回傳退化超過 threshold 的指標"""
+    regressions = []
+    print("\n📊 與基準比較")
+    for scope in ["overall"] + sorted(result["categories"]):
+        current = result["overall"] if scope == "overall" else result["categories"][scope]
+        previous = baseline["overall"] if scope == "overall" else baseline.get("categories", {}).get(scope)
+        if not previous:
+            continue
+        for metric in REGRESSION_METRICS:
+            new, old = current.get(metric), previous.get(metric)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            mark = "⚠️" if change > threshold else "  "
+            print(f"  {mark} {scope:<8}{metric:<14}{old:>9.3f} -> {new:>9.3f} ({change:+.1%})")
+            if change > threshold:
+                regressions.append((scope, metric, change))
+    return regressions
+
+
+def main(argv=None):
+    from tts_engine import DEFAULT_MODEL_DIR, DEFAULT_SPEAKER_DIR
+
+    parser = argparse.ArgumentParser(description="TTS 速度基準測試")
+    parser.add_argument("--model", default=DEFAULT_MODEL_DIR)
+    parser.add_argument("--tokenizer", default=None)
+    parser.add_argument("--backend", default="hf", help="hf / hf-int8 / llamacpp")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--adapter", default=None, help="LoRA adapter（name=path）")
+    parser.add_argument("--speaker-dir", default=DEFAULT_SPEAKER_DIR)
+    parser.add_argument("--speaker", default=None)
+    parser.add_argument("--sampler", default=None, help='SamplerConfig 參數（JSON），例如 \'{"temperature": 0.4}\'')
+    parser.add_argument("--prefix-cache-mb", type=float, default=0)
+    parser.add_argument("--corpus", default=None, help="自訂文字集 JSON：{分類: [文字, ...]}")
+    parser.add_argument("--categories", nargs="*", default=None, help="只跑指定的分類")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--output", default=None, help="結果 JSON，預設寫到 outputs/benchmarks/")
+    parser.add_argument("--compare", default=None, help="作為基準的舊結果 JSON")
+    parser.add_argument("--threshold", type=float, default=0.1, help="視為退化的變化比例")
+    args = parser.parse_args(argv)
+
+    corpus = DEFAULT_CORPUS
+    if args.corpus:
+        with open(args.corpus, "r", encoding="utf-8") as f:
+            corpus = json.load(f)
+    if args.categories:
+        corpus = {k: v for k, v in corpus.items() if k in args.categories}
+
+    print("=" * 60)
+    print(f"⏱️ TTS 基準測試: {args.model} ({args.backend})")
+    print("=" * 60)
+    result = run_benchmark(args, corpus)
+
+    overall = result["overall"]
+    print("\n" + "-" * 60)
+    print(f"載入時間       {result['load_seconds']:.2f}s")
+    print(f"延遲 p50/p95/p99 {overall['latency_p50']:.2f} / {overall['latency_p95']:.2f} / {overall['latency_p99']:.2f}s")
+    print(f"TTFA p50        {overall['ttfa_p50'] or 0:.2f}s")
+    print(f"tokens/sec      {overall['tokens_per_second'] or 0:.1f}")
+    print(f"RTF 平均        {overall['rtf_mean'] or 0:.3f}")
+    if result["peak_rss_mb"] is not None:
+        print(f"峰值 RSS        {result['peak_rss_mb']:.0f} MB")
+
+    output = args.output
+    if output is None:
+        os.makedirs(DEFAULT_OUTPUT_DIR, exist_ok=True)
+        output = os.path.join(DEFAULT_OUTPUT_DIR, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    elif os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"💾 已保存: {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} 項指標退化超過 {args.threshold:.0%}")
+            sys.exit(1)
+        print("✅ 沒有明顯的效能退化")
+
+
+if __name__ == "__main__":
+    main()
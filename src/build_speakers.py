@@ -0,0 +1,268 @@
+"""
+批次建立 speaker profile
+interface.create_speaker 一次只處理一個檔案，而且每次都重新載入 whisper。
+這裡把一整批參考音檔分成兩個階段，各自以行程池平行處理，每個 worker 只載入一次模型：
+
+1. 轉錄：whisper 取得文字與逐字時間
+2. 編碼：DAC codec 產生 c1/c2 token 並計算特徵
+
+兩個階段分開執行，同一時間只會有一種模型佔用記憶體。最後一次寫出所有 profile（JSON / .uepspk），
+並列出每個 speaker 的各階段耗時。
+
+輸入可以是目錄（每個音檔一個 speaker，名稱取檔名）或清單：
+- .json / .jsonl：[{"name": "...", "audio": "..."}]，audio 可使用 '...' 佔位符
+- .csv：name,audio
+
+    python src/build_speakers.py data/voices --workers 4 --format both
+    python src/build_speakers.py data/voices.jsonl --output speaker
+"""
+import os
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from dataset_stream import iter_raw_items, resolve_audio_path
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL_DIR = os.path.join(base_dir, "models", "Llama-OuteTTS-1.0-1B")
+DEFAULT_OUTPUT_DIR = os.path.join(base_dir, "speaker")
+
+AUDIO_EXTS = (".wav", ".mp3", ".flac", ".ogg", ".m4a")
+MAX_SECONDS = 20
+
+# 每個 worker 行程各自持有的模型
+_worker = {}
+
+
+def collect_clips(source):
+    """回傳 [(name, audio_path)]"""
+    if os.path.isdir(source):
+        clips = []
+        for filename in sorted(os.listdir(source)):
+            if filename.lower().endswith(AUDIO_EXTS):
+                clips.append((os.path.splitext(filename)[0], os.path.join(source, filename)))
+        return clips
+
+    root = os.path.dirname(os.path.abspath(source))
+    if source.lower().endswith(".csv"):
+        with open(source, "r", encoding="utf-8-sig", newline="") as f:
+            rows = [(row["name"], row["audio"]) for row in csv.DictReader(f)]
+    else:
+        rows = [(item["name"], item["audio"]) for item in iter_raw_items(source)]
+
+    clips = []
+    for name, audio in rows:
+        audio = resolve_audio_path(audio)
+        if not os.path.isabs(audio):
+            audio = os.path.join(root, audio)
+        clips.append((name, audio))
+    return clips
+
+
+# ---------- 階段 1：轉錄 ----------
+
+def _init_whisper(whisper_model, device):
+    import whisper
+
+    _worker["whisper"] = whisper.load_model(whisper_model, device=device)
+
+
+def _transcribe(job):
+    """(name, audio_path) -> (name, {"text", "words"} 或 None, 音檔秒數, 耗時, 錯誤訊息)"""
+    import whisper
+    from outetts.utils.preprocessing import text_normalizations
+
+    name, audio_path = job
+    start = time.perf_counter()
+    seconds = None
+    try:
+        audio = whisper.load_audio(audio_path)
+        seconds = len(audio) / whisper.audio.SAMPLE_RATE
+        if seconds > MAX_SECONDS:
+            raise ValueError(f"音檔長度 {seconds:.1f}s 超過 {MAX_SECONDS}s")
+        result = _worker["whisper"].transcribe(audio, word_timestamps=True)
+        words = []
+        for segment in result["segments"]:
+            words.extend({"word": w["word"].strip(), "start": float(w["start"]), "end": float(w["end"])}
+                         for w in segment.get("words", []))
+        if not words:
+            raise ValueError("whisper 沒有辨識到任何字")
+        data = {"text": text_normalizations(result["text"]), "words": words}
+        return name, data, seconds, time.perf_counter() - start, None
+    except Exception as e:
+        return name, None, seconds, time.perf_counter() - start, str(e)
+
+
+# ---------- 階段 2：編碼 ----------
+
+def _init_codec(model_dir, device):
+    import outetts
+    from outetts.version.v3.audio_processor import AudioProcessor
+
+    config = outetts.ModelConfig(
+        model_path=model_dir,
+        tokenizer_path=model_dir,
+        interface_version=outetts.InterfaceVersion.V3,
+        backend=outetts.Backend.HF,
+        device=device,
+    )
+    _worker["audio_processor"] = AudioProcessor(config)
+
+
+def _encode(job):
+    """(name, audio_path, transcription) -> (name, speaker 或 None, 秒數, 錯誤訊息)"""
+    name, audio_path, transcription = job
+    start = time.perf_counter()
+    try:
+        with open(audio_path, "rb") as f:
+            audio_bytes = f.read()
+        speaker = _worker["audio_processor"].create_speaker_from_dict({"audio": {"bytes": audio_bytes}, **transcription})
+        speaker["interface_version"] = 3
+        return name, speaker, time.perf_counter() - start, None
+    except Exception as e:
+        return name, None, time.perf_counter() - start, str(e)
+
+
+def _run_stage(fn, jobs, workers, initializer, initargs, chunksize):
+    """在 spawn 的行程池中執行一個階段（CUDA 不能在 fork 出來的行程中使用）"""
+    if workers <= 1:
+        initializer(*initargs)
+        return [fn(job) for job in jobs]
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=initializer, initargs=initargs) as pool:
+        return list(pool.map(fn, jobs, chunksize=chunksize))
+
+
+def build_speakers(clips, output_dir=DEFAULT_OUTPUT_DIR, model_dir=DEFAULT_MODEL_DIR, whisper_model="turbo",
+                   device=None, workers=None, output_format="json", overwrite=False, chunksize=1):
+    """
+    建立所有 speaker profile，回傳每個 speaker 的結果
+    [{"name", "audio", "status", "seconds", "transcribe_seconds", "encode_seconds", "write_seconds", "error"}]
+    """
+    from speaker_format import write_binary, BINARY_EXT
+
+    if workers is None:
+        try:
+            import torch
+            # 每個 GPU worker 都會載入一份模型，預設只開一個
+            workers = 1 if torch.cuda.is_available() and device != "cpu" else max(1, (os.cpu_count() or 2) // 2)
+        except ImportError:
+            workers = 1
+    if len(set(name for name, _ in clips)) != len(clips):
+        raise ValueError("speaker 名稱重複")
+    os.makedirs(output_dir, exist_ok=True)
+
+    results = {}
+    jobs = []
+    for name, audio_path in clips:
+        result = {"name": name, "audio": audio_path, "status": "ok", "error": None, "seconds": None,
+                  "transcribe_seconds": 0.0, "encode_seconds": 0.0, "write_seconds": 0.0}
+        results[name] = result
+        exts = {"json": [".json"], "bin": [BINARY_EXT], "both": [".json", BINARY_EXT]}[output_format]
+        if not overwrite and all(os.path.exists(os.path.join(output_dir, name + ext)) for ext in exts):
+            result["status"] = "skipped"
+            continue
+        if not os.path.exists(audio_path):
+            result.update(status="failed", error="找不到音檔")
+            continue
+        jobs.append((name, audio_path))
+
+    if not jobs:
+        return list(results.values())
+    workers = min(workers, len(jobs))
+
+    print(f"🎙️ 階段 1/2：轉錄 {len(jobs)} 個音檔（{workers} 個行程）")
+    stage_start = time.perf_counter()
+    transcriptions = {}
+    for name, data, audio_seconds, seconds, error in _run_stage(
+            _transcribe, jobs, workers, _init_whisper, (whisper_model, device), chunksize):
+        results[name].update(seconds=audio_seconds, transcribe_seconds=seconds)
+        if error:
+            results[name].update(status="failed", error=f"轉錄失敗: {error}")
+        else:
+            transcriptions[name] = data
+    print(f"  ✅ {len(transcriptions)}/{len(jobs)} ({time.perf_counter() - stage_start:.1f}s)")
+
+    encode_jobs = [(name, path, transcriptions[name]) for name, path in jobs if name in transcriptions]
+    print(f"🔄 階段 2/2：codec 編碼 {len(encode_jobs)} 個音檔")
+    stage_start = time.perf_counter()
+    speakers = {}
+    if encode_jobs:
+        for name, speaker, seconds, error in _run_stage(
+                _encode, encode_jobs, min(workers, len(encode_jobs)), _init_codec, (model_dir, device), chunksize):
+            results[name]["encode_seconds"] = seconds
+            if error:
+                results[name].update(status="failed", error=f"編碼失敗: {error}")
+            else:
+                speakers[name] = speaker
+    print(f"  ✅ {len(speakers)}/{len(encode_jobs)} ({time.perf_counter() - stage_start:.1f}s)")
+
+    for name, speaker in speakers.items():
+        start = time.perf_counter()
+        if output_format in ("json", "both"):
+            path = os.path.join(output_dir, name + ".json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(speaker, f, indent=2)
+        if output_format in ("bin", "both"):
+            write_binary(speaker, os.path.join(output_dir, name + BINARY_EXT))
+        results[name]["write_seconds"] = time.perf_counter() - start
+
+    return list(results.values())
+
+
+def print_summary(results):
+    print("\n" + "=" * 72)
+    print(f"{'speaker':<24}{'狀態':<10}{'音檔(s)':>9}{'轉錄(s)':>9}{'編碼(s)':>9}{'寫出(s)':>9}")
+    for r in results:
+        print(f"{r['name'][:23]:<24}{r['status']:<10}{r['seconds'] or 0:>9.1f}"
+              f"{r['transcribe_seconds']:>9.2f}{r['encode_seconds']:>9.2f}{r['write_seconds']:>9.3f}")
+        if r["error"]:
+            print(f"  ❌ {r['error']}")
+    done = [r for r in results if r["status"] == "ok"]
+    print(f"\n✅ 成功 {len(done)}，略過 {sum(r['status'] == 'skipped' for r in results)}，"
+          f"失敗 {sum(r['status'] == 'failed' for r in results)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次建立 speaker profile")
+    parser.add_argument("input", help="參考音檔目錄，或 .json / .jsonl / .csv 清單")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_DIR, help="speaker 輸出目錄")
+    parser.add_argument("--model", default=DEFAULT_MODEL_DIR, help="提供 codec 設定的模型目錄")
+    parser.add_argument("--whisper-model", default="turbo")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--workers", type=int, default=None, help="行程數，GPU 上預設 1，CPU 上為核心數的一半")
+    parser.add_argument("--chunksize", type=int, default=1, help="每次分派給 worker 的音檔數")
+    parser.add_argument("--format", default="json", choices=["json", "bin", "both"], help="輸出 JSON 或 .uepspk")
+    parser.add_argument("--overwrite", action="store_true", help="覆寫已存在的 speaker")
+    parser.add_argument("--summary", default=None, help="把每個 speaker 的耗時寫成 JSON")
+    args = parser.parse_args()
+
+    clips = collect_clips(args.input)
+    print(f"📁 {len(clips)} 個參考音檔 -> {args.output}")
+    start = time.perf_counter()
+    results = build_speakers(
+        clips,
+        output_dir=args.output,
+        model_dir=args.model,
+        whisper_model=args.whisper_model,
+        device=args.device,
+        workers=args.workers,
+        output_format=args.format,
+        overwrite=args.overwrite,
+        chunksize=args.chunksize,
+    )
+    print_summary(results)
+    print(f"⏱️ 總耗時: {time.perf_counter() - start:.1f}s")
+
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 已保存: {args.summary}")
+
+
+if __name__ == "__main__":
+    main()
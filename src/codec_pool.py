@@ -0,0 +1,278 @@
+"""
+codec 解碼行程池
+LM 輸出 c1/c2 audio token 之後，原本在同一個執行緒上等 DAC 把 token 還原成波形，這段時間 LM 閒置。
+CodecDecodePool 啟動數個各自載入一份 codec 的行程；CodecPipeline 的 LM 迴圈每生成完一段，
+就把該段的 codes 交給行程池，接著生成下一段（或下一個請求），解碼結果依原順序組回。
+
+    engine = TTSEngine()
+    with CodecPipeline(engine, workers=3) as pipeline:
+        output = pipeline.generate("A long paragraph ...", speaker="uep_speaker")
+        for output in pipeline.generate_many(texts):
+            ...
+
+codec 行程預設放在 CPU（GPU 留給 LM）；每個行程的 torch 執行緒數為「CPU 核心數 / 行程數」，避免互搶核心。
+每段各自解碼後直接串接，和 streaming.stream_generate 的逐段輸出相同。
+引擎啟用語音快取時，命中的請求直接回傳快取的音訊，不經過 LM 與行程池；生成完成的請求會存入快取。
+
+    python src/codec_pool.py --text "..." --codec-workers 3 --compare
+"""
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from streaming import AudioFrame
+
+# 每個 worker 行程各自持有的 codec
+_worker = {}
+
+
+def _init_codec(codec_class, codec_path, device, num_threads):
+    import torch
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    _worker["codec"] = codec_class(device, codec_path)
+
+
+def _decode(codes):
+    """[c1 codes, c2 codes] -> float32 波形（在 worker 行程中執行）"""
+    import torch
+
+    codec = _worker["codec"]
+    audio = codec.decode(torch.tensor([codes], dtype=torch.int64).to(codec.device))
+    return audio.detach().flatten().float().cpu().numpy()
+
+
+class CodecDecodePool:
+    """
+    在 spawn 的行程池中解碼 audio codes（CUDA 不能在 fork 出來的行程中使用）
+    workers=0 時在呼叫端的執行緒上直接用 engine 的 codec 解碼，方便比較
+    """
+
+    def __init__(self, engine, workers=None, device="cpu", threads_per_worker=None):
+        interface = engine.interface
+        self.engine = engine
+        self.sample_rate = interface.audio_codec.sr
+        self.workers = max(1, (os.cpu_count() or 2) // 2) if workers is None else workers
+        self._pool = None
+        if self.workers > 0:
+            if threads_per_worker is None:
+                threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+            codec_path = getattr(interface.config, "audio_codec_path", None)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_codec,
+                initargs=(type(interface.audio_codec), codec_path, device, threads_per_worker),
+            )
+
+    def extract_codes(self, tokens):
+        """LM 輸出的 token -> [c1 codes, c2 codes]（在主行程中做，只有對照表查詢）"""
+        return self.engine.interface.prompt_processor.extract_audio_from_tokens(tokens)
+
+    def submit(self, tokens):
+        """回傳結果為 float32 波形（沒有 audio token 時為 None）的 Future"""
+        codes = self.extract_codes(tokens)
+        if not codes or not codes[0]:
+            future = Future()
+            future.set_result(None)
+            return future
+        if self._pool is None:
+            future = Future()
+            try:
+                audio = self.engine.decode_tokens(tokens)
+                future.set_result(audio.detach().flatten().float().cpu().numpy() if audio is not None else None)
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self._pool.submit(_decode, codes)
+
+    def warmup(self):
+        """讓每個行程先載入 codec，第一個請求不必等模型載入"""
+        if self._pool is not None:
+            list(self._pool.map(_decode, [[[0] * 4, [0] * 4]] * self.workers))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CodecPipeline:
+    """
+    LM 生成（生產者）與 codec 解碼（消費者）重疊的合成流程
+    LM 在背景執行緒上逐段生成，每段的 codes 立即交給 CodecDecodePool；
+    max_pending 限制已生成但尚未取走的段數，避免 LM 遠快於解碼時佔用過多記憶體
+    """
+
+    def __init__(self, engine, workers=None, device="cpu", threads_per_worker=None, max_pending=16):
+        self.engine = engine
+        self.pool = CodecDecodePool(engine, workers, device, threads_per_worker)
+        self.max_pending = max_pending
+
+    def _produce(self, jobs, out, stop):
+        """
+        jobs: [(request_index, text, speaker, sampler, max_length, adapter, generation_type)]
+        輸出 (request_index, Future, token 數, None)，每個請求最後一筆為 (request_index, None, 0, 快取鍵)
+        """
+        def put(item):
+            # 取用端提前結束時不要永遠卡在已滿的佇列上
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for index, text, speaker, sampler, max_length, adapter, generation_type in jobs:
+                key, cached = self.engine.cache_lookup(text, speaker, generation_type, sampler, adapter)
+                if cached is not None:
+                    # 快取命中：不經過 LM 與 codec 行程池，結束時也不必再存入快取
+                    future = Future()
+                    future.set_result(cached.audio.detach().flatten().float().cpu().numpy())
+                    if not put((index, future, 0, None)) or not put((index, None, 0, None)):
+                        return
+                    continue
+                config = self.engine.make_config(text, speaker, generation_type, sampler, max_length)
+                for tokens in self.engine.iter_chunk_tokens(config, adapter):
+                    if not put((index, self.pool.submit(tokens), len(tokens), None)):
+                        return
+                if not put((index, None, 0, key)):
+                    return
+        except Exception as e:
+            put(e)
+
+    def _run(self, jobs):
+        """依序產生 (request_index, Future 或 None（該請求結束）, token 數, 快取鍵)"""
+        out = queue.Queue(self.max_pending)
+        stop = threading.Event()
+        threading.Thread(target=self._produce, args=(jobs, out, stop), name="tts-lm", daemon=True).start()
+        remaining = len(jobs)
+        try:
+            while remaining:
+                item = out.get()
+                if isinstance(item, Exception):
+                    raise item
+                if item[1] is None:
+                    remaining -= 1
+                yield item
+        finally:
+            stop.set()
+
+    def _to_output(self, parts):
+        """把一個請求的各段波形串接成 ModelOutput"""
+        import torch
+        from outetts.version.playback import ModelOutput
+
+        samples = np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+        return ModelOutput(torch.from_numpy(samples).view(1, 1, -1), self.pool.sample_rate)
+
+    def stream(self, text, speaker=None, generation_type="chunked", sampler=None, max_length=8192, adapter=None):
+        """逐段 yield AudioFrame（依原順序），LM 已經在生成後面的段落"""
+        start = time.perf_counter()
+        index = 0
+        parts = []
+        jobs = [(0, text, speaker, sampler, max_length, adapter, generation_type)]
+        for _, future, num_tokens, key in self._run(jobs):
+            if future is None:
+                # 完整生成後才存入快取（中途停止的串流不存）
+                if key is not None and parts:
+                    self.engine.cache_store(key, self._to_output(parts))
+                continue
+            samples = future.result()
+            if samples is None:
+                continue
+            parts.append(samples)
+            yield AudioFrame(index, samples, self.pool.sample_rate, time.perf_counter() - start, num_tokens)
+            index += 1
+
+    def generate_many(self, texts, speaker=None, generation_type="chunked", sampler=None, max_length=8192,
+                      adapter=None):
+        """依序 yield 每段文字的 ModelOutput；取用前一個結果時 LM 已經在生成下一個"""
+        jobs = [(i, text, speaker, sampler, max_length, adapter, generation_type) for i, text in enumerate(texts)]
+        segments = []
+        for _, future, _, key in self._run(jobs):
+            if future is not None:
+                segments.append(future)
+                continue
+            # 一個請求的所有段落都已送出：依序等待並串接
+            parts = [s for s in (f.result() for f in segments) if s is not None]
+            segments = []
+            output = self._to_output(parts)
+            if key is not None and parts:
+                self.engine.cache_store(key, output)
+            yield output
+
+    def generate(self, text, speaker=None, generation_type="chunked", sampler=None, max_length=8192, adapter=None):
+        return next(self.generate_many([text], speaker, generation_type, sampler, max_length, adapter))
+
+    def close(self):
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    from tts_engine import TTSEngine, DEFAULT_MODEL_DIR, DEFAULT_SPEAKER_DIR
+
+    parser = argparse.ArgumentParser(description="LM 生成與 codec 解碼重疊的合成")
+    parser.add_argument("--text", action="append", required=True, help="可重複指定，依序生成")
+    parser.add_argument("--model", default=DEFAULT_MODEL_DIR)
+    parser.add_argument("--tokenizer", default=None)
+    parser.add_argument("--backend", default="hf", help="hf / hf-int8 / llamacpp")
+    parser.add_argument("--device", default=None, help="LM 的裝置")
+    parser.add_argument("--speaker-dir", default=DEFAULT_SPEAKER_DIR)
+    parser.add_argument("--speaker", default=None)
+    parser.add_argument("--codec-workers", type=int, default=None, help="codec 行程數，預設為 CPU 核心數的一半")
+    parser.add_argument("--codec-device", default="cpu")
+    parser.add_argument("--compare", action="store_true", help="另外以原本的循序方式生成一次並比較耗時")
+    parser.add_argument("--output-dir", default="codec_pool_output")
+    args = parser.parse_args()
+
+    engine = TTSEngine(args.model, tokenizer_path=args.tokenizer, backend=args.backend, device=args.device,
+                       speaker_dir=args.speaker_dir)
+    engine.get_speaker(args.speaker)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    with CodecPipeline(engine, workers=args.codec_workers, device=args.codec_device) as pipeline:
+        print(f"🔄 啟動 {pipeline.pool.workers} 個 codec 行程")
+        pipeline.pool.warmup()
+
+        start = time.perf_counter()
+        duration = 0.0
+        for i, output in enumerate(pipeline.generate_many(args.text, speaker=args.speaker)):
+            output.save(os.path.join(args.output_dir, f"{i + 1:02d}.wav"))
+            duration += output.audio.shape[-1] / output.sr
+        elapsed = time.perf_counter() - start
+        print(f"✅ 重疊解碼: {elapsed:.1f}s（{duration:.1f}s 音訊，RTF {elapsed / max(duration, 1e-6):.2f}）")
+
+    if args.compare:
+        start = time.perf_counter()
+        for text in args.text:
+            engine.generate(text, speaker=args.speaker)
+        sequential = time.perf_counter() - start
+        print(f"⏱️ 循序解碼: {sequential:.1f}s（加速 {sequential / max(elapsed, 1e-6):.2f}x）")
+
+
+if __name__ == "__main__":
+    main()
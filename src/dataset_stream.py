@@ -0,0 +1,98 @@
+"""
+串流讀取資料集
+資料集會從數百筆成長到數十萬筆，不再一次 json.load 整個 dataset.json：
+- .jsonl / .ndjson 逐行讀取
+- .json（頂層為陣列）有安裝 ijson 時用 ijson，否則以 JSONDecoder.raw_decode 逐筆解析
+讀取時即時把 '...' 佔位符換成專案根目錄；prepare_data / preprocess_audio 逐筆取用，
+訓練時的串流則由 training_prompts.stream_training_dataset 從 token store 產生。
+"""
+import os
+import json
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+JSONL_EXTS = (".jsonl", ".ndjson")
+
+
+def resolve_audio_path(path):
+    """把 dataset.json 中的 '...' 佔位符換成專案根目錄"""
+    path = path.replace("...", base_dir.replace("\\", "/"))
+    return os.path.normpath(path)
+
+
+def iter_json_array(fileobj, chunk_size=1 << 16):
+    """逐筆 yield 頂層 JSON 陣列中的元素，記憶體只保留目前的緩衝區"""
+    decoder = json.JSONDecoder()
+    buffer, pos = "", 0
+    started = eof = False
+
+    while True:
+        # 跳過空白、BOM 與分隔符
+        while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == "\ufeff"
+                                     or (started and buffer[pos] == ",")):
+            pos += 1
+
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("頂層必須是 JSON 陣列")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # 緩衝區結尾的數字可能還沒讀完整，確保後面還有其他字元
+                if end < len(buffer) or eof:
+                    yield item
+                    pos = end
+                    continue
+
+        if eof:
+            if started:
+                raise ValueError("JSON 陣列沒有正確結束")
+            return
+        chunk = fileobj.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+def iter_raw_items(path):
+    """依副檔名逐筆讀取原始 JSON 物件"""
+    if path.lower().endswith(JSONL_EXTS):
+        with open(path, "r", encoding="utf-8-sig") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        return
+
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+
+    if ijson is not None:
+        with open(path, "rb") as f:
+            head = f.read(3)
+            if head != b"\xef\xbb\xbf":
+                f.seek(0)
+            yield from ijson.items(f, "item", use_float=True)
+    else:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            yield from iter_json_array(f)
+
+
+def iter_records(path):
+    """逐筆 yield {"audio", "text"}，audio 已解析為絕對路徑"""
+    for item in iter_raw_items(path):
+        text = item.get("transcript", item.get("text"))
+        if text is None or "audio" not in item:
+            continue
+        yield {"audio": resolve_audio_path(item["audio"]), "text": text}
@@ -1,6 +1,288 @@
-class my_class(object):
-    pass
+"""
+基礎模型 vs. LoRA adapter 的 A/B 評估
+模型只載入一次，adapter 掛在同一份模型上（adapter=None 即為基礎模型），
+同一組「文字 × speaker」同時以兩種設定生成，由多個 worker 平行處理：
+- --workers N：N 個引擎各自載入一份模型與 adapter，以執行緒池分派
+- --batched：只載入一份模型，所有請求交給 BatchScheduler（同一 batch 內依 adapter 分組）
 
+輸出到 outputs/eval/<時間>/：
+- base/、<adapter>/：成對的音檔（由 AudioSink 在背景寫出）
+- report.json：每一對的生成時間、排隊時間、RTF 與客觀指標（長度比、靜音比例、響度、峰值），以及各設定的平均值
 
+    python src/evaluate_audio.py --adapter uep=outputs/lora_model --speaker uep_speaker --workers 2
+"""
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT_DIR = os.path.join(base_dir, "outputs", "eval")
+
+DEFAULT_TEXTS = [
+    "Hello! This is a test of our fine-tuned TTS model.",
+    "The weather is beautiful today, isn't it?",
+    "I hope this training has improved the voice quality.",
+    "Wow! I see. Okay! Hmm. Alright!",
+    "Oh my gosh, stories are just the best! They whisk you away to different worlds and introduce you to amazing characters.",
+]
+DEFAULT_SAMPLER = {"temperature": 0.4, "repetition_penalty": 1.1, "top_k": 40, "top_p": 0.9}
+
+BASE = "base"
+
+
+def audio_metrics(samples, sr, silence_db=-40.0, frame_ms=20):
+    """長度、靜音比例（frame RMS 低於 silence_db dBFS 的比例）、響度與峰值"""
+    from preprocess_audio import measure_loudness
+
+    samples = np.asarray(samples, dtype=np.float64).reshape(-1)
+    if len(samples) == 0:
+        return {"seconds": 0.0, "silence_ratio": 1.0, "loudness": None, "loudness_unit": None, "peak_db": None}
+
+    frame = max(1, int(sr * frame_ms / 1000))
+    num_frames = max(1, len(samples) // frame)
+    frames = samples[:num_frames * frame].reshape(num_frames, -1) if len(samples) >= frame else samples[None, :]
+    rms_db = 20 * np.log10(np.maximum(np.sqrt(np.mean(frames ** 2, axis=1)), 1e-10))
+    loudness, unit = measure_loudness(samples, sr)
+    return {
+        "seconds": len(samples) / sr,
+        "silence_ratio": float(np.mean(rms_db < silence_db)),
+        "loudness": loudness,
+        "loudness_unit": unit,
+        "peak_db": float(20 * np.log10(max(np.max(np.abs(samples)), 1e-10))),
+    }
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return float(np.mean(values)) if values else None
+
+
+class ABEvaluator:
+    """
+    把 (文字, speaker, 設定) 的組合分派給 engines（各自同時只處理一個請求）或 scheduler
+    adapter 必須已由 AdapterManager 載入到每個引擎上
+    """
+
+    def __init__(self, adapter, engines=None, scheduler=None, sampler=None, max_length=8192):
+        if bool(engines) == (scheduler is not None):
+            raise ValueError("engines 與 scheduler 必須擇一指定")
+        self.adapter = adapter
+        self.engines = list(engines or [])
+        self.scheduler = scheduler
+        self.sampler = sampler
+        self.max_length = max_length
+
+        self._idle = queue.Queue()
+        for engine in self.engines:
+            self._idle.put(engine)
+        self._pool = ThreadPoolExecutor(len(self.engines), "tts-eval") if self.engines else None
+
+    def _generate_on_engine(self, text, speaker, adapter, submitted):
+        engine = self._idle.get()
+        try:
+            start = time.perf_counter()
+            output = engine.generate(text, speaker, "chunked", self.sampler, self.max_length, adapter)
+            return output, time.perf_counter() - start, start - submitted
+        finally:
+            self._idle.put(engine)
+
+    def _submit(self, text, speaker, adapter):
+        """
+        回傳取得 (ModelOutput, 生成秒數, 排隊秒數) 的函式
+        生成秒數從開始生成算到完成的那一刻（不含排隊，也不含 run() 處理前面結果的時間），兩種模式可直接比較
+        """
+        if self.scheduler is not None:
+            request = self.scheduler.submit(text, speaker, "chunked", self.sampler, self.max_length, adapter)
+            finished = []
+            recorded = threading.Event()
+
+            def on_done(future):
+                finished.append(time.perf_counter())
+                recorded.set()
+
+            request.future.add_done_callback(on_done)
+
+            def result():
+                output = request.future.result()
+                # result() 可能在 callback 執行前就返回
+                recorded.wait()
+                # 語音快取命中時沒有經過 batch，started_at 為 None
+                started = request.started_at or request.enqueued_at
+                return output, finished[0] - started, started - request.enqueued_at
+            return result
+        future = self._pool.submit(self._generate_on_engine, text, speaker, adapter, time.perf_counter())
+        return future.result
+
+    def run(self, texts, speakers, output_dir, sink):
+        """所有組合一次送出，依完成順序寫出音檔，回傳每一對的結果"""
+        variants = [(BASE, None), (self.adapter, self.adapter)]
+        jobs = []
+        for speaker in speakers:
+            for i, text in enumerate(texts):
+                for label, adapter in variants:
+                    jobs.append((i, text, speaker, label, self._submit(text, speaker, adapter)))
+
+        pairs = {}
+        for i, text, speaker, label, result in jobs:
+            key = (speaker, i)
+            pair = pairs.setdefault(key, {"index": i, "text": text, "speaker": speaker})
+            try:
+                output, seconds, queue_seconds = result()
+            except Exception as e:
+                print(f"  ❌ [{label}] {speaker or 'default'} #{i + 1}: {e}")
+                pair[label] = {"error": str(e)}
+                continue
+
+            samples = output.audio.detach().flatten().float().cpu().numpy()
+            path = os.path.join(output_dir, label, f"{speaker or 'default'}_{i + 1:02d}.wav")
+            sink.submit(samples, path, sr=output.sr)
+            metrics = audio_metrics(samples, output.sr)
+            metrics.update(
+                path=os.path.relpath(path, output_dir),
+                generate_seconds=seconds,
+                queue_seconds=queue_seconds,
+                rtf=seconds / metrics["seconds"] if metrics["seconds"] else None,
+            )
+            pair[label] = metrics
+            print(f"  ✅ [{label}] {speaker or 'default'} #{i + 1}: {seconds:.2f}s，"
+                  f"音訊 {metrics['seconds']:.2f}s，靜音 {metrics['silence_ratio']:.0%}")
+
+        results = []
+        for pair in pairs.values():
+            base, adapted = pair.get(BASE, {}), pair.get(self.adapter, {})
+            if base.get("seconds") and adapted.get("seconds"):
+                pair["duration_ratio"] = adapted["seconds"] / base["seconds"]
+            results.append(pair)
+        return results
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+
+def summarize(pairs, labels):
+    summary = {}
+    for label in labels:
+        runs = [p[label] for p in pairs if label in p and "error" not in p[label]]
+        summary[label] = {
+            "runs": len(runs),
+            "errors": sum(1 for p in pairs if "error" in p.get(label, {})),
+            "generate_seconds": _mean([r["generate_seconds"] for r in runs]),
+            "queue_seconds": _mean([r["queue_seconds"] for r in runs]),
+            "rtf": _mean([r["rtf"] for r in runs]),
+            "seconds": _mean([r["seconds"] for r in runs]),
+            "silence_ratio": _mean([r["silence_ratio"] for r in runs]),
+            "loudness": _mean([r["loudness"] for r in runs]),
+            "peak_db": _mean([r["peak_db"] for r in runs]),
+        }
+    summary["duration_ratio"] = _mean([p.get("duration_ratio") for p in pairs])
+    return summary
+
+
+def print_summary(summary, labels):
+    print("\n" + "=" * 60)
+    print(f"{'':<14}" + "".join(f"{label[:14]:>16}" for label in labels))
+    for metric in ("generate_seconds", "queue_seconds", "rtf", "seconds", "silence_ratio", "loudness", "peak_db"):
+        row = [summary[label][metric] for label in labels]
+        print(f"{metric:<14}" + "".join(f"{v:>16.3f}" if v is not None else f"{'-':>16}" for v in row))
+    ratio = summary["duration_ratio"]
+    print(f"長度比（adapter / base）: {ratio:.3f}" if ratio is not None else "長度比: -")
+
+
+def main():
+    from tts_engine import TTSEngine, DEFAULT_MODEL_DIR, DEFAULT_SPEAKER_DIR
+    from adapters import AdapterManager, parse_adapter_args
+    from audio_sink import AudioSink
+
+    parser = argparse.ArgumentParser(description="基礎模型 vs. LoRA adapter 的 A/B 評估")
+    parser.add_argument("--adapter", required=True, help="name=path，例如 uep=outputs/lora_model")
+    parser.add_argument("--model", default=DEFAULT_MODEL_DIR)
+    parser.add_argument("--tokenizer", default=None)
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--speaker-dir", default=DEFAULT_SPEAKER_DIR)
+    parser.add_argument("--speaker", action="append", default=None, help="可重複指定多個 speaker")
+    parser.add_argument("--texts", default=None, help="文字清單 JSON（[文字, ...]）或每行一句的文字檔")
+    parser.add_argument("--sampler", default=None, help="SamplerConfig 參數（JSON）")
+    parser.add_argument("--workers", type=int, default=2, help="各自載入一份模型的引擎數")
+    parser.add_argument("--batched", action="store_true", help="只載入一份模型，所有請求交給 BatchScheduler")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--output", default=None, help="輸出目錄，預設為 outputs/eval/<時間>")
+    args = parser.parse_args()
+
+    texts = DEFAULT_TEXTS
+    if args.texts:
+        with open(args.texts, "r", encoding="utf-8-sig") as f:
+            content = f.read()
+        texts = json.loads(content) if args.texts.endswith(".json") else [l.strip() for l in content.splitlines() if l.strip()]
+    speakers = args.speaker or [None]
+    sampler = json.loads(args.sampler) if args.sampler else DEFAULT_SAMPLER
+    (adapter_name, adapter_path), = parse_adapter_args([args.adapter]).items()
+    if adapter_name == BASE:
+        raise SystemExit(f"❌ adapter 名稱不能是 '{BASE}'")
+
+    num_engines = 1 if args.batched else args.workers
+    print(f"🔄 載入 {num_engines} 個引擎: {args.model}")
+    start = time.perf_counter()
+    engines = []
+    for _ in range(num_engines):
+        engine = TTSEngine(args.model, tokenizer_path=args.tokenizer, device=args.device, speaker_dir=args.speaker_dir)
+        AdapterManager(engine).load(adapter_name, adapter_path)
+        engine.warm_speakers(speakers)
+        engines.append(engine)
+    load_seconds = time.perf_counter() - start
+    print(f"✅ 載入完成 ({load_seconds:.1f}s)")
+
+    if args.batched:
+        from batching import BatchScheduler
+        evaluator = ABEvaluator(adapter_name, scheduler=BatchScheduler(engines[0], max_batch_size=args.max_batch_size),
+                                sampler=sampler)
+    else:
+        evaluator = ABEvaluator(adapter_name, engines=engines, sampler=sampler)
+
+    output_dir = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"{datetime.now():%Y%m%d_%H%M%S}")
+    print(f"🎙️ {len(texts)} 句 × {len(speakers)} 個 speaker × 2 種設定")
+    start = time.perf_counter()
+    with AudioSink() as sink:
+        pairs = evaluator.run(texts, speakers, output_dir, sink)
+    total_seconds = time.perf_counter() - start
+    evaluator.close()
+
+    labels = [BASE, adapter_name]
+    summary = summarize(pairs, labels)
+    print_summary(summary, labels)
+    print(f"⏱️ 總耗時: {total_seconds:.1f}s")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "model": args.model,
+            "adapter": {"name": adapter_name, "path": adapter_path},
+            "speakers": speakers,
+            "sampler": sampler,
+            "engines": num_engines,
+            "batched": args.batched,
+            "load_seconds": load_seconds,
+            "total_seconds": total_seconds,
+        },
+        "summary": summary,
+        "pairs": pairs,
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    report_path = os.path.join(output_dir, "report.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 已保存: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+依文字長度決定生成上限，並在失控時提前結束
+OuteTTS-1.0 偶爾在文字念完後繼續輸出 audio token（長時間靜音或重複同一段），
+預設的 max_length=8192 會讓這種情況一路跑到上限，生成時間與輸出長度都失控，後面的音訊最後也只會被裁掉。
+
+- LengthBudget：以 speaker profile 中每個字的 duration 估計語速（秒 / 字元），
+  換算這段文字需要的 audio token 數（75 frames/s，每 frame 為 c1 + c2 兩個 token，加上每個字的標記 token），
+  乘上寬裕的倍數後作為這一段的生成上限
+- RunawayDetector：逐 token 檢查
+  - 靜音：連續 silence_frames 個 frame 的 c1 code 只有極少數幾種
+  - 單字過長：一個字超過 max_word_frames 個 frame 還沒結束
+  - 迴圈：最近的 token 以固定週期重複；只由 audio code（c1 / c2）組成的週期和靜音一樣，
+    至少要持續 silence_frames 個 frame 才算（短暫停頓解碼出來的常是同一組 code）
+  偵測到時停止生成，並把失控的尾巴從輸出中去掉，不會再送去 codec 解碼
+
+guard(interface) 在 outetts.Interface 實例上套用兩者（HF backend 透過 StoppingCriteria，llama.cpp 逐 token 檢查），
+TTSEngine 預設啟用；直接使用 Interface 的腳本：
+
+    interface = create_interface(...)
+    guard(interface)
+    output = interface.generate(config)
+"""
+import re
+import math
+import threading
+import dataclasses
+from collections import deque
+
+AUDIO_FRAME_RATE = 75  # DAC 24 kHz：每秒 75 個 frame
+DEFAULT_SECONDS_PER_CHAR = 0.075  # 沒有 speaker 時的語速（約每秒 13 個字元）
+# 中日韓文字每個字元算一個字；其他語言以空白分字
+CJK = "\u3040-\u30ff\u4e00-\u9fff\uac00-\ud7af"
+WORD_PATTERN = re.compile(f"[{CJK}]|[^\\s{CJK}]+")
+
+
+def split_words(text):
+    return WORD_PATTERN.findall(text or "")
+
+
+def speaker_rate(speaker):
+    """speaker profile 的語速（秒 / 字元）；沒有可用的逐字時間時回傳 None"""
+    if not speaker or not speaker.get("words"):
+        return None
+    seconds = sum(float(w.get("duration", 0.0)) for w in speaker["words"])
+    chars = sum(len(w.get("word", "").strip()) for w in speaker["words"])
+    if seconds <= 0 or chars <= 0:
+        return None
+    return seconds / chars
+
+
+class LengthBudget:
+    """
+    估計一段文字最多需要多少個生成 token
+    slack：估計值的倍數（語速、停頓都有變化，寧可寬鬆）；min_tokens：很短的文字也至少保留這麼多
+    """
+
+    def __init__(self, slack=2.0, min_tokens=150, max_tokens=None, word_tokens=10):
+        self.slack = slack
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        # 每個字除了 audio code 之外的 token：word_start、時間、特徵、code、word_end 等（字的文字另計）
+        self.word_tokens = word_tokens
+
+    def estimate_seconds(self, text, speaker=None):
+        rate = speaker_rate(speaker) or DEFAULT_SECONDS_PER_CHAR
+        return sum(len(word) for word in split_words(text)) * rate
+
+    def max_new_tokens(self, text, speaker=None):
+        words = split_words(text)
+        frames = self.estimate_seconds(text, speaker) * AUDIO_FRAME_RATE
+        # 字的文字大約每 3 個字元一個 token
+        tokens = 2 * frames + sum(self.word_tokens + math.ceil(len(w) / 3) for w in words)
+        budget = int(tokens * self.slack) + self.min_tokens
+        return min(budget, self.max_tokens) if self.max_tokens else budget
+
+
+class RunawayDetector:
+    """
+    逐 token 檢查一條序列的生成結果；feed() 在判定失控時回傳原因（"silence" / "long_word" / "loop"），
+    keep 為應保留的輸出 token 數（失控開始之前）
+    """
+
+    def __init__(self, c1_ids, word_start_id, silence_frames=150, silence_unique=2, max_word_frames=300,
+                 loop_max_period=64, loop_repeats=4, loop_min_tokens=48, check_every=8, c2_ids=()):
+        self.c1_ids = c1_ids
+        self.audio_ids = frozenset(c1_ids) | frozenset(c2_ids)
+        self.word_start_id = word_start_id
+        self.silence_frames = silence_frames
+        self.silence_unique = silence_unique
+        self.max_word_frames = max_word_frames
+        self.loop_max_period = loop_max_period
+        self.loop_repeats = loop_repeats
+        self.loop_min_tokens = loop_min_tokens
+        self.check_every = check_every
+
+        self.tokens = []
+        self.keep = None
+        self.reason = None
+        # 最近的 (c1 token, 在輸出中的位置)
+        self._frames = deque(maxlen=silence_frames)
+        self._word_start = 0
+        self._word_frames = 0
+        # 只含 audio code 的週期至少要涵蓋 silence_frames 個 frame（每個 frame 為 c1 + c2 兩個 token）
+        self._audio_loop_tokens = 2 * silence_frames
+        self._history = max(loop_max_period * loop_repeats, loop_min_tokens * 2,
+                            self._audio_loop_tokens + loop_max_period)
+
+    def _stop(self, reason, keep):
+        self.reason = reason
+        self.keep = max(0, keep)
+        return reason
+
+    def feed(self, token):
+        if self.reason is not None:
+            return self.reason
+        position = len(self.tokens)
+        self.tokens.append(token)
+
+        if token == self.word_start_id:
+            self._word_start = position
+            self._word_frames = 0
+        elif token in self.c1_ids:
+            self._word_frames += 1
+            self._frames.append((token, position))
+            if self._word_frames > self.max_word_frames:
+                return self._stop("long_word", self._word_start)
+            if len(self._frames) == self.silence_frames and \
+                    len(set(t for t, _ in self._frames)) <= self.silence_unique:
+                return self._stop("silence", self._silence_start())
+
+        if len(self.tokens) % self.check_every == 0:
+            loop = self._loop_period()
+            if loop:
+                period, repeats = loop
+                # 保留第一次出現的那一段
+                return self._stop("loop", len(self.tokens) - period * (repeats - 1))
+        return None
+
+    def _silence_start(self):
+        """靜音開始的位置：以後半段出現的 code 為靜音 code，往前找到連續都是這些 code 的第一個 frame"""
+        frames = list(self._frames)
+        silent = set(t for t, _ in frames[len(frames) // 2:])
+        start = frames[-1][1]
+        for token, position in reversed(frames):
+            if token not in silent:
+                break
+            start = position
+        return start
+
+    def _loop_repeats(self, pattern):
+        """判定為迴圈所需的重複次數"""
+        period = len(pattern)
+        min_tokens = self.loop_min_tokens
+        if all(token in self.audio_ids for token in pattern):
+            min_tokens = max(min_tokens, self._audio_loop_tokens)
+        return max(self.loop_repeats, math.ceil(min_tokens / period))
+
+    def _loop_period(self):
+        """回傳 (週期, 重複次數)；沒有迴圈時回傳 None"""
+        recent = self.tokens[-self._history:]
+        for period in range(1, self.loop_max_period + 1):
+            if period > len(recent):
+                break
+            repeats = self._loop_repeats(recent[-period:])
+            span = period * repeats
+            if span > len(recent):
+                continue
+            window = recent[-span:]
+            if all(window[i] == window[i - period] for i in range(period, span)):
+                return period, repeats
+        return None
+
+    def trim(self, output):
+        """去掉失控的尾巴"""
+        return output if self.keep is None else output[:self.keep]
+
+
+class GenerationGuard:
+    """掛在 Interface 上的 LengthBudget + RunawayDetector；undo() 取消"""
+
+    def __init__(self, interface, budget=None, detector_options=None):
+        self.interface = interface
+        self.budget = budget if budget is not None else LengthBudget()
+        self.detector_options = detector_options or {}
+        prompt_processor = interface.prompt_processor
+        tokenizer = prompt_processor.tokenizer
+        self.c1_ids = frozenset(prompt_processor.c1)
+        self.c2_ids = frozenset(prompt_processor.c2)
+        self.word_start_id = tokenizer.encode(prompt_processor.special_tokens.word_start, add_special_tokens=False)[0]
+        # 最近一次 prepare_prompt 的 (文字, speaker)，供接著的 _generate 計算上限（每個執行緒各自一份）
+        self._last_prompt = threading.local()
+        self._patched = []
+        self._lock = threading.Lock()
+        self.stats = {"generations": 0, "stopped": {}}
+
+    def new_detector(self):
+        return RunawayDetector(self.c1_ids, self.word_start_id, c2_ids=self.c2_ids, **self.detector_options)
+
+    def max_new_tokens(self, text, speaker=None):
+        return self.budget.max_new_tokens(text, speaker)
+
+    def _record(self, detector):
+        with self._lock:
+            self.stats["generations"] += 1
+            if detector.reason:
+                self.stats["stopped"][detector.reason] = self.stats["stopped"].get(detector.reason, 0) + 1
+
+    def _patch(self, name, wrapper):
+        original = getattr(self.interface, name)
+        self._patched.append((name, original if name in vars(self.interface) else None))
+        setattr(self.interface, name, wrapper(original))
+
+    def install(self):
+        import outetts
+
+        interface = self.interface
+        backend = interface.config.backend
+
+        def prepare_wrapper(original):
+            def call(text, speaker=None, *args, **kwargs):
+                self._last_prompt.value = (text, speaker)
+                return original(text, speaker, *args, **kwargs)
+            return call
+
+        def generate_wrapper(original):
+            def call(input_ids, config, *args, **kwargs):
+                if config.generation_type == outetts.GenerationType.STREAM:
+                    return original(input_ids, config, *args, **kwargs)
+                prompt_length = input_ids.shape[-1] if hasattr(input_ids, "shape") else len(input_ids)
+                last = getattr(self._last_prompt, "value", None)
+                self._last_prompt.value = None
+                changes = {}
+                if last is not None:
+                    changes["max_length"] = min(config.max_length, prompt_length + self.max_new_tokens(*last))
+
+                detector = self.new_detector()
+                if backend == outetts.Backend.HF:
+                    from transformers import StoppingCriteriaList
+
+                    extra = dict(config.additional_gen_config)
+                    criteria = StoppingCriteriaList(extra.get("stopping_criteria") or [])
+                    criteria.append(runaway_stopping_criteria(detector, prompt_length))
+                    extra["stopping_criteria"] = criteria
+                    changes["additional_gen_config"] = extra
+                    output = original(input_ids, dataclasses.replace(config, **changes), *args, **kwargs)
+                elif hasattr(interface.model, "_generate_stream"):
+                    # llama.cpp：自己逐 token 取出，失控時直接中斷
+                    output = []
+                    for token in interface.model._generate_stream(input_ids, dataclasses.replace(config, **changes)):
+                        output.append(token)
+                        if detector.feed(token):
+                            break
+                else:
+                    output = original(input_ids, dataclasses.replace(config, **changes), *args, **kwargs)
+                    for token in output:
+                        if detector.feed(token):
+                            break
+                self._record(detector)
+                return detector.trim(output)
+            return call
+
+        self._patch("prepare_prompt", prepare_wrapper)
+        self._patch("_generate", generate_wrapper)
+        return self
+
+    def undo(self):
+        for name, original in reversed(self._patched):
+            if original is None:
+                delattr(self.interface, name)
+            else:
+                setattr(self.interface, name, original)
+        self._patched = []
+
+
+def runaway_stopping_criteria(detector, prompt_length):
+    """HF generate 用的 StoppingCriteria：把每一步新產生的 token 交給 detector（batch 大小為 1）"""
+    import torch
+    from transformers import StoppingCriteria
+
+    class RunawayCriteria(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            generated = input_ids[0, prompt_length + len(detector.tokens):].tolist()
+            stop = False
+            for token in generated:
+                if detector.feed(token):
+                    stop = True
+                    break
+            return torch.full((input_ids.shape[0],), stop, dtype=torch.bool, device=input_ids.device)
+
+    return RunawayCriteria()
+
+
+def guard(interface, budget=None, **detector_options):
+    """在 interface 上套用長度上限與失控偵測，回傳 GenerationGuard（可呼叫 undo() 取消）"""
+    return GenerationGuard(interface, budget, detector_options).install()
@@ -1,21 +1,29 @@
 """
 合併LoRA adapter到base model的腳本
 將訓練好的LoRA權重合併到原始模型中，創建一個新的完整模型
+
+--streaming 模式不載入整個模型：逐一讀取 base model 的 safetensors shard，
+只對 adapter 有修改的 tensor 加上 LoRA delta 後寫出，沒有被修改的 shard 直接複製，
+峰值記憶體約等於最大的一個 shard。
 """
 import os
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from peft import PeftModel
+import re
+import json
+import math
+import time
 import shutil
+import argparse
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASE_MODEL = os.path.join(base_dir, "models", "Llama-OuteTTS-1.0-1B")
+DEFAULT_LORA = os.path.join(base_dir, "outputs", "lora_model")
+DEFAULT_OUTPUT = os.path.join(base_dir, "models", "Llama-OuteTTS-1.0-1B-Finetuned")
 
-def merge_lora_to_base():
+def merge_lora_to_base(base_model_path=DEFAULT_BASE_MODEL, lora_path=DEFAULT_LORA, merged_model_path=DEFAULT_OUTPUT):
     """將LoRA adapter合併到base model"""
-    
-    # 路徑設定
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    base_model_path = os.path.join(base_dir, "models", "Llama-OuteTTS-1.0-1B")
-    lora_path = os.path.join(base_dir, "outputs", "lora_model")
-    merged_model_path = os.path.join(base_dir, "models", "Llama-OuteTTS-1.0-1B-Finetuned")
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from peft import PeftModel
     
     print(f"Base model: {base_model_path}")
     print(f"LoRA adapter: {lora_path}")
@@ -80,12 +88,170 @@ def merge_lora_to_base():
         print(f"❌ 合併過程中發生錯誤: {e}")
         return False
 
-if __name__ == "__main__":
+# ========== 串流合併 ==========
+
+def _load_adapter_weights(lora_path):
+    """adapter 本身很小，直接整個載入"""
+    import torch
+    from safetensors.torch import load_file
+
+    path = os.path.join(lora_path, "adapter_model.safetensors")
+    if os.path.exists(path):
+        return load_file(path)
+    return torch.load(os.path.join(lora_path, "adapter_model.bin"), map_location="cpu")
+
+def _module_scale(module, config):
+    """依 rank_pattern / alpha_pattern 取得該模組的 r 與 alpha，回傳 LoRA 的縮放係數"""
+    r, alpha = config["r"], config["lora_alpha"]
+    for pattern, value in (config.get("rank_pattern") or {}).items():
+        if re.search(rf"(^|\.){pattern}$", module):
+            r = value
+    for pattern, value in (config.get("alpha_pattern") or {}).items():
+        if re.search(rf"(^|\.){pattern}$", module):
+            alpha = value
+    return alpha / math.sqrt(r) if config.get("use_rslora") else alpha / r
+
+def build_lora_deltas(lora_path):
+    """
+    整理 adapter 權重
+    回傳 (lora, replaced)：
+      lora:     {base tensor 名稱: (A, B, scale, kind)}，kind 為 "linear" 或 "embedding"
+      replaced: {base tensor 名稱: tensor}，modules_to_save 或一併保存的 embedding 等完整權重，
+                直接取代原本的 tensor（之後若有 LoRA delta 再疊加上去）
+    """
+    with open(os.path.join(lora_path, "adapter_config.json"), "r", encoding="utf-8") as f:
+        config = json.load(f)
+    if config.get("peft_type", "LORA") != "LORA":
+        raise ValueError(f"只支援 LoRA adapter，收到: {config.get('peft_type')}")
+
+    weights = _load_adapter_weights(lora_path)
+    parts, replaced = {}, {}
+    for key, tensor in weights.items():
+        name = key
+        if name.startswith("base_model.model."):
+            name = name[len("base_model.model."):]
+        match = re.match(r"(.+)\.(lora_A|lora_B|lora_embedding_A|lora_embedding_B)(?:\.[^.]+)?(?:\.weight)?$", name)
+        if match is None:
+            name = re.sub(r"\.modules_to_save(\.default)?\.", ".", name).replace(".base_layer.", ".")
+            replaced[name] = tensor
+            continue
+        module, kind = match.groups()
+        parts.setdefault(module, {})[kind] = tensor
+
+    lora = {}
+    for module, pair in parts.items():
+        scale = _module_scale(module, config)
+        if "lora_A" in pair:
+            lora[f"{module}.weight"] = (pair["lora_A"], pair["lora_B"], scale, "linear")
+        else:
+            lora[f"{module}.weight"] = (pair["lora_embedding_A"], pair["lora_embedding_B"], scale, "embedding")
+    return lora, replaced, config.get("fan_in_fan_out", False)
+
+def _apply_delta(weight, a, b, scale, kind, fan_in_fan_out):
+    delta = b.float() @ a.float()
+    if kind == "embedding" or fan_in_fan_out:
+        delta = delta.T
+    return (weight.float() + scale * delta).to(weight.dtype)
+
+def _base_shards(base_model_path):
+    """回傳 {shard 檔名: [tensor 名稱]}；未分片的模型視為單一 shard"""
+    from safetensors import safe_open
+
+    index_path = os.path.join(base_model_path, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            weight_map = json.load(f)["weight_map"]
+        shards = {}
+        for name, shard in weight_map.items():
+            shards.setdefault(shard, []).append(name)
+        return shards
+
+    single = os.path.join(base_model_path, "model.safetensors")
+    if not os.path.exists(single):
+        raise FileNotFoundError("串流合併需要 safetensors 格式的 base model（model.safetensors 或分片 + index）")
+    with safe_open(single, framework="pt") as f:
+        return {"model.safetensors": list(f.keys())}
+
+def streaming_merge(base_model_path=DEFAULT_BASE_MODEL, lora_path=DEFAULT_LORA, merged_model_path=DEFAULT_OUTPUT):
+    """逐 shard 合併 LoRA，只改寫被 adapter 修改到的 shard"""
+    from safetensors import safe_open
+    from safetensors.torch import save_file
+
+    print(f"Base model: {base_model_path}")
+    print(f"LoRA adapter: {lora_path}")
+    print(f"Output path: {merged_model_path}")
+
+    if not os.path.exists(lora_path):
+        print("❌ LoRA模型不存在")
+        return False
+
+    try:
+        start = time.perf_counter()
+        lora, replaced, fan_in_fan_out = build_lora_deltas(lora_path)
+        print(f"🔄 adapter 共修改 {len(lora)} 個 LoRA 模組、{len(replaced)} 個完整取代的 tensor")
+
+        os.makedirs(merged_model_path, exist_ok=True)
+        shards = _base_shards(base_model_path)
+        remaining = set(lora) | set(replaced)
+
+        for shard, names in sorted(shards.items()):
+            src = os.path.join(base_model_path, shard)
+            dst = os.path.join(merged_model_path, shard)
+            touched = [n for n in names if n in remaining]
+            if not touched:
+                shutil.copy2(src, dst)
+                print(f"  📋 複製: {shard}")
+                continue
+
+            tensors = {}
+            with safe_open(src, framework="pt") as f:
+                metadata = f.metadata() or {"format": "pt"}
+                for name in names:
+                    tensor = f.get_tensor(name)
+                    if name in replaced:
+                        tensor = replaced[name].to(tensor.dtype)
+                    if name in lora:
+                        a, b, scale, kind = lora[name]
+                        tensor = _apply_delta(tensor, a, b, scale, kind, fan_in_fan_out)
+                    tensors[name] = tensor.contiguous()
+            save_file(tensors, dst, metadata=metadata)
+            remaining.difference_update(touched)
+            del tensors
+            print(f"  ✅ 合併: {shard} ({len(touched)} 個 tensor)")
+
+        if remaining:
+            raise KeyError(f"base model 中找不到以下 tensor: {sorted(remaining)[:5]} ...")
+
+        # 設定檔、tokenizer 等非權重檔案原樣複製
+        for name in os.listdir(base_model_path):
+            src = os.path.join(base_model_path, name)
+            if name in shards or not os.path.isfile(src):
+                continue
+            shutil.copy2(src, os.path.join(merged_model_path, name))
+
+        print(f"🎉 合併完成！新模型保存在: {merged_model_path} ({time.perf_counter() - start:.1f}s)")
+        return True
+
+    except Exception as e:
+        print(f"❌ 合併過程中發生錯誤: {e}")
+        return False
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LoRA到Base Model合併工具")
+    parser.add_argument("--base", default=DEFAULT_BASE_MODEL, help="base model 目錄")
+    parser.add_argument("--lora", default=DEFAULT_LORA, help="LoRA adapter 目錄")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="合併後模型的輸出目錄")
+    parser.add_argument("--streaming", action="store_true", help="逐 shard 合併，不載入整個模型")
+    args = parser.parse_args(argv)
+
     print("=" * 50)
     print("LoRA到Base Model合併工具")
     print("=" * 50)
     
-    success = merge_lora_to_base()
+    if args.streaming:
+        success = streaming_merge(args.base, args.lora, args.output)
+    else:
+        success = merge_lora_to_base(args.base, args.lora, args.output)
     
     if success:
         print("\n✨ 成功！現在你可以:")
@@ -97,3 +263,7 @@ if __name__ == "__main__":
         print("1. 檢查LoRA模型是否正確保存")
         print("2. 確認PEFT版本相容性")
         print("3. 直接使用當前的base model")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+句子層級的平行合成
+GenerationType.CHUNKED 會把長文字切段後依序生成，總時間是各段相加。
+這裡先把文字切成句子 / 子句，同時交給多個引擎（各自載入一份模型）或共用的 BatchScheduler 生成，
+完成後依原順序排回，並在段落交界做 crossfade，整段的時間約等於最長的那一句。
+
+用法:
+    python src/parallel_pipeline.py --text "Hello there. How are you today?" --workers 2 --output out.wav
+"""
+import os
+import re
+import sys
+import time
+import queue
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|(?<=[。！？])")
+CLAUSE_END = re.compile(r"(?<=[,;:，；：、])\s*")
+
+
+def _split_long(sentence, max_chars):
+    """超過 max_chars 的句子先依子句切，仍過長時再依空白切"""
+    parts = []
+    for clause in CLAUSE_END.split(sentence):
+        clause = clause.strip()
+        if not clause:
+            continue
+        if len(clause) <= max_chars:
+            parts.append(clause)
+            continue
+        current = ""
+        for word in clause.split():
+            if current and len(current) + 1 + len(word) > max_chars:
+                parts.append(current)
+                current = word
+            else:
+                current = f"{current} {word}" if current else word
+        if current:
+            parts.append(current)
+    return parts
+
+
+def _join(a, b):
+    if re.search(r"[。！？，；：、]$", a):
+        return a + b
+    return f"{a} {b}"
+
+
+def split_sentences(text, max_chars=200, min_chars=20):
+    """
+    把文字切成可獨立生成的句子
+    過長的句子依子句切開；太短的片段（例如 "Wow!"）併到下一句，避免單獨生成時語氣不連貫
+    """
+    pieces = []
+    for sentence in SENTENCE_END.split(text.strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(sentence) > max_chars:
+            pieces.extend(_split_long(sentence, max_chars))
+        else:
+            pieces.append(sentence)
+
+    merged = []
+    for piece in pieces:
+        if merged and len(merged[-1]) < min_chars and len(merged[-1]) + 1 + len(piece) <= max_chars:
+            merged[-1] = _join(merged[-1], piece)
+        else:
+            merged.append(piece)
+    # 最後一段太短時往前併
+    if len(merged) > 1 and len(merged[-1]) < min_chars and len(merged[-2]) + 1 + len(merged[-1]) <= max_chars:
+        merged[-2:] = [_join(merged[-2], merged[-1])]
+    return merged
+
+
+def crossfade_concat(segments, sample_rate, crossfade_ms=30):
+    """依序串接多段 float32 波形，交界處以 equal-power crossfade 重疊"""
+    segments = [np.asarray(s, dtype=np.float32).reshape(-1) for s in segments if s is not None and len(s)]
+    if not segments:
+        return np.zeros(0, dtype=np.float32)
+
+    fade = int(sample_rate * crossfade_ms / 1000)
+    result = segments[0]
+    for segment in segments[1:]:
+        n = min(fade, len(result), len(segment))
+        if n <= 0:
+            result = np.concatenate([result, segment])
+            continue
+        t = np.linspace(0.0, np.pi / 2, n, dtype=np.float32)
+        overlap = result[-n:] * np.cos(t) + segment[:n] * np.sin(t)
+        result = np.concatenate([result[:-n], overlap, segment[n:]])
+    return result
+
+
+class SentencePipeline:
+    """
+    平行合成長文字
+    engines: TTSEngine 的 list，每個引擎同時只處理一句
+    scheduler: batching.BatchScheduler，所有句子一次送入，由排程器合併成 batch
+    兩者擇一
+    """
+
+    def __init__(self, engines=None, scheduler=None, crossfade_ms=30, max_chars=200, min_chars=20):
+        if bool(engines) == (scheduler is not None):
+            raise ValueError("engines 與 scheduler 必須擇一指定")
+
+        self.scheduler = scheduler
+        self.engines = list(engines or [])
+        self.crossfade_ms = crossfade_ms
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+
+        self._idle = queue.Queue()
+        for engine in self.engines:
+            self._idle.put(engine)
+        self._pool = ThreadPoolExecutor(len(self.engines), "tts-sentence") if self.engines else None
+
+    def _generate_on_engine(self, sentence, speaker, sampler, max_length, adapter):
+        engine = self._idle.get()
+        try:
+            return engine.generate(sentence, speaker, "regular", sampler, max_length, adapter)
+        finally:
+            self._idle.put(engine)
+
+    def submit_all(self, sentences, speaker=None, sampler=None, max_length=8192, adapter=None):
+        """每句一個 Future，結果為 outetts 的 ModelOutput"""
+        if self.scheduler is not None:
+            futures = []
+            try:
+                for sentence in sentences:
+                    futures.append(self.scheduler.submit(sentence, speaker, "regular", sampler, max_length,
+                                                         adapter).future)
+            except BaseException:
+                # 佇列滿等錯誤：已送出的句子也不必再生成
+                for future in futures:
+                    future.cancel()
+                raise
+            return futures
+        return [
+            self._pool.submit(self._generate_on_engine, sentence, speaker, sampler, max_length, adapter)
+            for sentence in sentences
+        ]
+
+    def synthesize(self, text, speaker=None, sampler=None, max_length=8192, timeout=None, adapter=None):
+        """
+        回傳串接完成的 ModelOutput
+        timeout 為整段文字的時間上限；任一句失敗或逾時，尚未開始生成的其他句子會被取消
+        """
+        import torch
+        from outetts.version.playback import ModelOutput
+
+        sentences = split_sentences(text, self.max_chars, self.min_chars)
+        if not sentences:
+            raise ValueError("text can not be empty!")
+
+        # 整段文字的語音快取（各句另外經由 engine.generate / BatchScheduler.submit 查詢）
+        engine = self.scheduler.engine if self.scheduler is not None else self.engines[0]
+        key, cached = engine.cache_lookup(text, speaker, f"sentences-{self.crossfade_ms:g}ms", sampler, adapter)
+        if cached is not None:
+            return cached
+
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        futures = self.submit_all(sentences, speaker, sampler, max_length, adapter)
+        outputs = []
+        try:
+            for future in futures:
+                remaining = None if deadline is None else max(0.0, deadline - time.perf_counter())
+                outputs.append(future.result(remaining))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        for sentence, output in zip(sentences, outputs):
+            if output.audio is None:
+                raise RuntimeError(f"No audio tokens found in the output: {sentence!r}")
+
+        sample_rate = outputs[0].sr
+        samples = crossfade_concat(
+            [o.audio.detach().flatten().float().cpu().numpy() for o in outputs],
+            sample_rate,
+            self.crossfade_ms,
+        )
+        output = ModelOutput(torch.from_numpy(samples).view(1, 1, -1), sample_rate)
+        engine.cache_store(key, output)
+        return output
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+
+def main():
+    from tts_engine import TTSEngine, DEFAULT_MODEL_DIR, DEFAULT_SPEAKER_DIR
+
+    parser = argparse.ArgumentParser(description="句子層級的平行合成")
+    parser.add_argument("--text", required=True)
+    parser.add_argument("--model", default=DEFAULT_MODEL_DIR)
+    parser.add_argument("--speaker-dir", default=DEFAULT_SPEAKER_DIR)
+    parser.add_argument("--speaker", default=None)
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--backend", default="hf", help="hf / hf-int8 / llamacpp")
+    parser.add_argument("--tokenizer", default=None)
+    parser.add_argument("--workers", type=int, default=2, help="各自載入一份模型的引擎數")
+    parser.add_argument("--batched", action="store_true", help="只載入一份模型，所有句子交給 BatchScheduler")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--crossfade-ms", type=float, default=30)
+    parser.add_argument("--output", default="parallel_output.wav")
+    args = parser.parse_args()
+
+    num_engines = 1 if args.batched else args.workers
+    print(f"🔄 載入 {num_engines} 個引擎: {args.model}")
+    engines = [
+        TTSEngine(args.model, tokenizer_path=args.tokenizer, backend=args.backend,
+                  device=args.device, speaker_dir=args.speaker_dir)
+        for _ in range(num_engines)
+    ]
+
+    if args.batched:
+        from batching import BatchScheduler
+        pipeline = SentencePipeline(
+            scheduler=BatchScheduler(engines[0], max_batch_size=args.max_batch_size),
+            crossfade_ms=args.crossfade_ms,
+        )
+    else:
+        pipeline = SentencePipeline(engines=engines, crossfade_ms=args.crossfade_ms)
+
+    sentences = split_sentences(args.text, pipeline.max_chars, pipeline.min_chars)
+    print(f"✂️ 切成 {len(sentences)} 句")
+    for i, sentence in enumerate(sentences):
+        print(f"   {i + 1}. {sentence}")
+
+    start = time.perf_counter()
+    output = pipeline.synthesize(args.text, speaker=args.speaker)
+    elapsed = time.perf_counter() - start
+    output.save(args.output)
+    duration = output.audio.shape[-1] / output.sr
+    print(f"✅ 完成: {args.output} ({duration:.1f}s 音訊，耗時 {elapsed:.1f}s，RTF {elapsed / duration:.2f})")
+    pipeline.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+speaker prompt 的 KV cache 重用
+以 (模型, speaker) 為鍵保存 prompt 共同前綴的 attention KV 狀態，LRU 淘汰並限制總記憶體，
+之後的請求直接從快取的 KV 接續，跳過這段前綴的 prefill。
+
+注意：OuteTTS v3 的 prompt 是
+    <|im_start|>\\n<|text_start|>{speaker 文字}{本次文字}<|text_end|>\\n<|audio_start|>\\n{speaker codes}...
+本次文字位於 speaker 文字與 speaker codebook token 之間，
+所以真正跨請求不變的前綴只有 speaker 文字為止；codes 段的 KV 取決於前面的本次文字，無法共用。
+"""
+import copy
+import hashlib
+import threading
+import dataclasses
+from collections import OrderedDict
+
+import torch
+
+
+def cache_nbytes(past):
+    """估算 KV cache 佔用的位元組數（相容新舊版 transformers 的 cache 結構）"""
+    if hasattr(past, "layers"):
+        tensors = [t for layer in past.layers for t in (layer.keys, layer.values) if t is not None]
+    elif hasattr(past, "key_cache"):
+        tensors = list(past.key_cache) + list(past.value_cache)
+    else:
+        tensors = [t for layer in past for t in layer]
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def crop_cache(past, length):
+    """只保留前 length 個位置的 KV"""
+    if hasattr(past, "crop"):
+        past.crop(length)
+        return past
+    return tuple(tuple(t[..., :length, :] for t in layer) for layer in past)
+
+
+def common_prefix_length(a, b):
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class PrefixEntry:
+    def __init__(self, ids, past):
+        self.ids = ids
+        self.past = past
+        self.nbytes = cache_nbytes(past)
+
+
+class PrefixKVCache:
+    """LRU 的 prefix KV cache，總大小不超過 max_bytes"""
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    @property
+    def nbytes(self):
+        return sum(e.nbytes for e in self._entries.values())
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reused_tokens": self.reused_tokens,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def key(model_id, speaker, adapter=None):
+        # 前綴內只含 speaker 文字，因此以文字雜湊識別 speaker
+        return (model_id, adapter, hashlib.sha1(speaker["text"].strip().encode("utf-8")).hexdigest())
+
+    @staticmethod
+    def prefix_ids(interface, speaker):
+        """speaker 的共同前綴 token；最後一個 token 可能與本次文字合併成不同的 BPE，先去掉"""
+        special = interface.prompt_processor.special_tokens
+        prefix = special.bos + "\n" + special.text_start + speaker["text"].strip()
+        ids = interface.prompt_processor.tokenizer.encode(prefix, add_special_tokens=False)
+        return ids[:-1]
+
+    @torch.no_grad()
+    def _prefill(self, model, ids):
+        input_ids = torch.tensor([ids], dtype=torch.long, device=model.device)
+        return model(input_ids=input_ids, use_cache=True).past_key_values
+
+    def _store(self, key, entry):
+        if entry.nbytes > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while self.nbytes > self.max_bytes:
+            self._entries.popitem(last=False)
+
+    def lookup(self, engine, input_ids, speaker, adapter=None):
+        """
+        回傳 (可直接交給 generate 的 KV cache 副本, 重用的 token 數)
+        呼叫端需持有 engine.lock，且 adapter 已經生效
+        """
+        if speaker is None:
+            return None, 0
+
+        key = self.key(engine.model_path, speaker, adapter)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None:
+            self.misses += 1
+            ids = self.prefix_ids(engine.interface, speaker)
+            if not ids:
+                return None, 0
+            entry = PrefixEntry(ids, self._prefill(engine.interface.model.model, ids))
+            with self._lock:
+                self._store(key, entry)
+        else:
+            self.hits += 1
+
+        prompt = input_ids[0].tolist()
+        # generate 至少需要一個未快取的 token
+        reuse = min(common_prefix_length(entry.ids, prompt), len(prompt) - 1)
+        if reuse <= 0:
+            return None, 0
+
+        # generate 會原地擴充 cache，因此每次都交出副本
+        past = copy.deepcopy(entry.past)
+        if reuse < len(entry.ids):
+            past = crop_cache(past, reuse)
+        self.reused_tokens += reuse
+        return past, reuse
+
+    def attach(self, engine, input_ids, config, adapter=None):
+        """回傳帶有 past_key_values 的 GenerationConfig 副本；沒有可重用前綴時回傳原 config"""
+        past, reused = self.lookup(engine, input_ids, config.speaker, adapter)
+        if past is None:
+            return config
+        extra = dict(config.additional_gen_config, past_key_values=past)
+        return dataclasses.replace(config, additional_gen_config=extra)
@@ -1,5 +1,168 @@
-from datasets import load_dataset, Audio
+"""
+離線資料準備
+把 data/dataset.json 中的每個 wav 一次性編碼成 codec token 與逐字對齊，
+寫入 data/token_store，之後訓練直接讀取，不必每次重新解碼與重採樣音訊。
+只有新增或內容有變動的音檔才會重新編碼。
+"""
+import os
+import time
+import argparse
 
-ds = load_dataset("json", data_files="data/dataset.json")
-ds = ds.cast_column("audio", Audio(sampling_rate=24000))
-ds.save_to_disk("data/hf_dataset")
+from token_store import TokenStore
+from dataset_stream import iter_records
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DATASET = os.path.join(base_dir, "data", "dataset.json")
+DEFAULT_STORE = os.path.join(base_dir, "data", "token_store")
+DEFAULT_MODEL_DIR = os.path.join(base_dir, "models", "Llama-OuteTTS-1.0-1B")
+
+
+class ClipEncoder:
+    """載入一次 whisper 與 DAC codec，逐檔產生 token 與逐字對齊"""
+
+    def __init__(self, model_dir=DEFAULT_MODEL_DIR, whisper_model="turbo", device=None):
+        import whisper
+        import outetts
+        from outetts.version.v3.audio_processor import AudioProcessor
+
+        config = outetts.ModelConfig(
+            model_path=model_dir,
+            tokenizer_path=model_dir,
+            interface_version=outetts.InterfaceVersion.V3,
+            backend=outetts.Backend.HF,
+            device=device,
+        )
+        self.audio_processor = AudioProcessor(config)
+        self.whisper = whisper.load_model(whisper_model, device=device)
+
+    def align_words(self, audio_path, text):
+        """用 whisper 取得逐字時間；辨識不到時把整句視為一個字"""
+        result = self.whisper.transcribe(audio_path, word_timestamps=True)
+        words = []
+        for segment in result["segments"]:
+            for w in segment.get("words", []):
+                words.append({"word": w["word"].strip(), "start": float(w["start"]), "end": float(w["end"])})
+
+        if not words:
+            codec = self.audio_processor.audio_codec
+            seconds = codec.load_audio(audio_path).shape[-1] / codec.sr
+            words = [{"word": text.strip(), "start": 0.0, "end": seconds}]
+        return words
+
+    def encode(self, audio_path, text):
+        """回傳 (c1, c2, words, global_features)，words 的 start/end 為 token 索引"""
+        with open(audio_path, "rb") as f:
+            audio_bytes = f.read()
+
+        speaker = self.audio_processor.create_speaker_from_dict({
+            "audio": {"bytes": audio_bytes},
+            "text": text,
+            "words": self.align_words(audio_path, text),
+        })
+
+        c1, c2, words = [], [], []
+        for w in speaker["words"]:
+            start = len(c1)
+            c1.extend(w["c1"])
+            c2.extend(w["c2"])
+            words.append({
+                "word": w["word"],
+                "start": start,
+                "end": len(c1),
+                "duration": w["duration"],
+                "features": w["features"],
+            })
+        return c1, c2, words, speaker["global_features"]
+
+
+def prepare_token_store(dataset_path=DEFAULT_DATASET, store_dir=DEFAULT_STORE,
+                        whisper_model="turbo", device=None, force=False, save_every=50):
+    """
+    增量建立 token store，回傳 (新編碼數, 沿用數)
+    資料集以串流方式逐筆讀取、逐筆編碼，記憶體中只保留已處理過的檔案雜湊
+    """
+    store = TokenStore(store_dir)
+
+    encoder = None
+    live = set()
+    failed = set()
+    total = encoded = missing = 0
+    start_time = time.time()
+    for record in iter_records(dataset_path):
+        total += 1
+        if not os.path.exists(record["audio"]):
+            print(f"  ⚠️ 找不到音檔: {record['audio']}")
+            missing += 1
+            continue
+        digest = store.file_hash(record["audio"])
+        if digest in live or digest in failed:
+            continue
+        if digest in store and not force:
+            live.add(digest)
+            continue
+
+        if encoder is None:
+            print("🔄 載入 whisper 與 codec...")
+            encoder = ClipEncoder(whisper_model=whisper_model, device=device)
+        try:
+            c1, c2, words, global_features = encoder.encode(record["audio"], record["text"])
+            store.add(digest, record["text"], c1, c2, words, global_features)
+        except Exception as e:
+            print(f"  ❌ 編碼失敗 {record['audio']}: {e}")
+            failed.add(digest)
+            continue
+        live.add(digest)
+        encoded += 1
+        if encoded % save_every == 0:
+            store.save()
+            print(f"  ✅ 已編碼 {encoded} 筆 ({time.time() - start_time:.1f}s)")
+
+    reused = len(live) - encoded
+    print(f"📊 共 {total} 筆，沿用 {reused} 筆，新編碼 {encoded} 筆，失敗 {len(failed)} 筆，缺檔 {missing} 筆")
+
+    store.prune(live)
+    store.save()
+    print(f"💾 token store: {store_dir} ({len(store)} 筆)")
+    return encoded, reused
+
+
+def validate_dataset(dataset_path=DEFAULT_DATASET, store_dir=DEFAULT_STORE):
+    """
+    只檢查資料，不載入 whisper 或 codec：資料集筆數、缺少的音檔，以及 token store 已涵蓋多少筆
+    回傳 {"records", "missing", "encoded", "pending"}
+    """
+    store = TokenStore(store_dir)
+    stats = {"records": 0, "missing": 0, "encoded": 0, "pending": 0}
+    for record in iter_records(dataset_path):
+        stats["records"] += 1
+        if not os.path.exists(record["audio"]):
+            print(f"  ⚠️ 找不到音檔: {record['audio']}")
+            stats["missing"] += 1
+        elif store.file_hash(record["audio"]) in store:
+            stats["encoded"] += 1
+        else:
+            stats["pending"] += 1
+    print(f"📊 共 {stats['records']} 筆，已編碼 {stats['encoded']} 筆，待編碼 {stats['pending']} 筆，缺檔 {stats['missing']} 筆")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="預先編碼訓練音檔為 codec token")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="dataset.json 或 .jsonl 路徑")
+    parser.add_argument("--store", default=DEFAULT_STORE, help="token store 輸出目錄")
+    parser.add_argument("--whisper-model", default="turbo", help="用於逐字對齊的 whisper 模型")
+    parser.add_argument("--device", default=None, help="cuda / cpu，預設自動選擇")
+    parser.add_argument("--force", action="store_true", help="忽略快取，全部重新編碼")
+    parser.add_argument("--check", action="store_true", help="只檢查資料集與 token store，不進行編碼")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        stats = validate_dataset(args.dataset, args.store)
+        if stats["missing"]:
+            raise SystemExit(1)
+        return
+    prepare_token_store(args.dataset, args.store, args.whisper_model, args.device, args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""
+音訊前處理
+掃描 data/dataset.json 與 data/metadata.csv 引用的每個 wav，以多行程一次完成：
+- 檢查：缺檔、無法讀取、取樣率、破音（clipping）、長度過短 / 過長、近乎無聲
+- 去除頭尾靜音（保留少量 padding）
+- 響度正規化（有安裝 pyloudnorm 時以 LUFS 計算，否則以 RMS 近似）
+- 重採樣成 24 kHz mono 16-bit
+
+結果寫到 data/wavs_24k/，並產生：
+- manifest.json：每個音檔的長度與統計值，可作為長度分桶的 duration index
+- data/dataset_24k.jsonl：指向正規化後音檔的資料集，交給 prepare_data.py 使用，之後不必再重採樣
+
+    python src/preprocess_audio.py --workers 8
+    python src/prepare_data.py --dataset data/dataset_24k.jsonl
+
+來源檔的大小與修改時間沒變、且輸出檔仍存在時沿用上次的結果。
+"""
+import os
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from dataset_stream import iter_records
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DATASET = os.path.join(base_dir, "data", "dataset.json")
+DEFAULT_METADATA = os.path.join(base_dir, "data", "metadata.csv")
+DEFAULT_WAV_DIR = os.path.join(base_dir, "data", "wavs")
+DEFAULT_OUTPUT_DIR = os.path.join(base_dir, "data", "wavs_24k")
+DEFAULT_OUTPUT_DATASET = os.path.join(base_dir, "data", "dataset_24k.jsonl")
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+TARGET_SR = 24000
+
+DEFAULT_OPTIONS = {
+    "target_sr": TARGET_SR,
+    "target_lufs": -23.0,
+    "peak_db": -1.0,  # 正規化後的峰值上限
+    "trim_db": -40.0,  # 低於峰值此 dB 數的頭尾視為靜音
+    "trim_pad_ms": 50,
+    "frame_ms": 10,
+    "min_seconds": 0.2,
+    "max_seconds": 30.0,
+    "clip_ratio": 0.001,  # 超過此比例的樣本貼近滿刻度時視為破音
+    "silence_db": -60.0,  # 整體 RMS 低於此值視為無聲
+}
+
+
+def load_metadata(path=DEFAULT_METADATA, wav_dir=DEFAULT_WAV_DIR):
+    """讀取 LJSpeech 格式的 metadata.csv（id|text[|normalized_text]），格式不符的行略過"""
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.reader(f, delimiter="|", quoting=csv.QUOTE_NONE):
+            if len(row) < 2 or not row[0].strip():
+                continue
+            name = row[0].strip()
+            if not name.lower().endswith(".wav"):
+                name += ".wav"
+            text = (row[2] if len(row) > 2 and row[2].strip() else row[1]).strip()
+            records.append({"audio": os.path.normpath(os.path.join(wav_dir, name)), "text": text})
+    return records
+
+
+def collect_records(dataset_path=DEFAULT_DATASET, metadata_path=DEFAULT_METADATA, wav_dir=DEFAULT_WAV_DIR):
+    """合併兩個來源並以音檔路徑去重（dataset.json 優先）"""
+    records = {}
+    if dataset_path and os.path.exists(dataset_path):
+        for record in iter_records(dataset_path):
+            records.setdefault(record["audio"], record)
+    if metadata_path:
+        for record in load_metadata(metadata_path, wav_dir):
+            records.setdefault(record["audio"], record)
+    return list(records.values())
+
+
+def _db(value):
+    return 20 * np.log10(max(float(value), 1e-10))
+
+
+def trim_silence(audio, sr, trim_db, pad_ms, frame_ms):
+    """依每個 frame 的 RMS 去除頭尾靜音，回傳 (audio, 去掉的開頭秒數, 去掉的結尾秒數)"""
+    frame = max(1, int(sr * frame_ms / 1000))
+    num_frames = len(audio) // frame
+    if num_frames == 0:
+        return audio, 0.0, 0.0
+    rms = np.sqrt(np.mean(audio[:num_frames * frame].reshape(num_frames, frame) ** 2, axis=1))
+    threshold = np.max(np.abs(audio)) * 10 ** (trim_db / 20)
+    voiced = np.flatnonzero(rms > threshold)
+    if len(voiced) == 0:
+        return audio, 0.0, 0.0
+
+    pad = int(sr * pad_ms / 1000)
+    start = max(0, voiced[0] * frame - pad)
+    end = min(len(audio), (voiced[-1] + 1) * frame + pad)
+    return audio[start:end], start / sr, (len(audio) - end) / sr
+
+
+def measure_loudness(audio, sr):
+    """回傳 (響度, 單位)；有 pyloudnorm 時為 LUFS，否則為 RMS dBFS"""
+    try:
+        import pyloudnorm
+    except ImportError:
+        pyloudnorm = None
+
+    # BS.1770 至少需要一個 400ms 的區塊
+    if pyloudnorm is not None and len(audio) >= int(sr * 0.4):
+        loudness = pyloudnorm.Meter(sr).integrated_loudness(audio)
+        if np.isfinite(loudness):
+            return float(loudness), "LUFS"
+    return _db(np.sqrt(np.mean(audio ** 2))), "dBFS"
+
+
+def resample(audio, sr, target_sr):
+    if sr == target_sr:
+        return audio
+    import torch
+    import torchaudio
+
+    tensor = torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32))
+    return torchaudio.functional.resample(tensor, sr, target_sr).numpy()
+
+
+def output_name(source, wav_dir=DEFAULT_WAV_DIR):
+    """輸出檔名：wav_dir 底下的檔案保留相對路徑，其他來源以路徑雜湊避免撞名"""
+    import hashlib
+
+    source = os.path.normpath(source)
+    try:
+        relative = os.path.relpath(source, wav_dir)
+    except ValueError:  # Windows 上不同磁碟
+        relative = None
+    if relative is None or relative.startswith(".."):
+        stem = os.path.splitext(os.path.basename(source))[0]
+        relative = f"{stem}-{hashlib.sha1(source.encode('utf-8')).hexdigest()[:8]}.wav"
+    return os.path.splitext(relative)[0] + ".wav"
+
+
+def process_clip(source, output, options):
+    """檢查並正規化一個音檔，回傳 manifest 的一筆紀錄（在 worker 行程中執行）"""
+    import soundfile as sf
+
+    entry = {"source": source, "output": None, "status": "ok", "issues": []}
+    if not os.path.exists(source):
+        entry.update(status="missing", issues=["missing"])
+        return entry
+    stat = os.stat(source)
+    entry.update(size=stat.st_size, mtime=stat.st_mtime)
+
+    try:
+        audio, sr = sf.read(source, dtype="float32", always_2d=True)
+    except Exception as e:
+        entry.update(status="unreadable", issues=[f"unreadable: {e}"])
+        return entry
+
+    entry.update(source_sr=sr, channels=audio.shape[1], source_seconds=len(audio) / sr if sr else 0.0)
+    audio = audio.mean(axis=1)
+    if len(audio) == 0:
+        entry.update(status="empty", issues=["empty"])
+        return entry
+
+    issues = entry["issues"]
+    if sr != options["target_sr"]:
+        issues.append(f"sample_rate {sr}")
+    if entry["channels"] > 1:
+        issues.append(f"channels {entry['channels']}")
+
+    peak = float(np.max(np.abs(audio)))
+    clipped = float(np.mean(np.abs(audio) >= 0.999))
+    entry.update(source_peak_db=_db(peak), clipped_ratio=clipped)
+    if clipped > options["clip_ratio"]:
+        issues.append(f"clipping {clipped:.2%}")
+
+    rms_db = _db(np.sqrt(np.mean(audio ** 2)))
+    entry["source_rms_db"] = rms_db
+    if rms_db < options["silence_db"]:
+        entry["status"] = "silent"
+        issues.append(f"silent {rms_db:.1f} dBFS")
+        return entry
+
+    audio, trimmed_start, trimmed_end = trim_silence(
+        audio, sr, options["trim_db"], options["trim_pad_ms"], options["frame_ms"])
+    entry.update(trimmed_start=trimmed_start, trimmed_end=trimmed_end)
+
+    audio = resample(audio, sr, options["target_sr"])
+    sr = options["target_sr"]
+
+    loudness, unit = measure_loudness(audio, sr)
+    target = options["target_lufs"]
+    gain_db = target - loudness
+    audio = audio * 10 ** (gain_db / 20)
+    # 增益後超過峰值上限時整體壓回，不做硬截斷
+    peak_limit = 10 ** (options["peak_db"] / 20)
+    peak = float(np.max(np.abs(audio)))
+    if peak > peak_limit:
+        audio = audio * (peak_limit / peak)
+        issues.append("peak_limited")
+
+    duration = len(audio) / sr
+    entry.update(
+        seconds=duration,
+        sample_rate=sr,
+        loudness=loudness,
+        loudness_unit=unit,
+        gain_db=gain_db,
+        peak_db=_db(np.max(np.abs(audio))),
+    )
+    if duration < options["min_seconds"]:
+        entry["status"] = "too_short"
+        issues.append(f"too_short {duration:.2f}s")
+        return entry
+    if duration > options["max_seconds"]:
+        entry["status"] = "too_long"
+        issues.append(f"too_long {duration:.2f}s")
+        return entry
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp_path = output + ".tmp.wav"
+    sf.write(tmp_path, audio, sr, subtype="PCM_16")
+    os.replace(tmp_path, output)
+    entry["output"] = output
+    return entry
+
+
+def load_manifest(output_dir=DEFAULT_OUTPUT_DIR):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"version": MANIFEST_VERSION, "options": {}, "entries": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION, "options": {}, "entries": {}}
+    return manifest
+
+
+def save_manifest(manifest, output_dir=DEFAULT_OUTPUT_DIR):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_duration_index(output_dir=DEFAULT_OUTPUT_DIR):
+    """{正規化後的音檔路徑: 秒數}，供長度分桶使用"""
+    entries = load_manifest(output_dir)["entries"].values()
+    return {e["output"]: e["seconds"] for e in entries if e.get("output")}
+
+
+def _unchanged(entry, source, options, previous_options):
+    if not entry or previous_options != options or not os.path.exists(source):
+        return False
+    stat = os.stat(source)
+    if entry.get("size") != stat.st_size or entry.get("mtime") != stat.st_mtime:
+        return False
+    return entry["output"] is None or os.path.exists(entry["output"])
+
+
+def _placeholder(path):
+    """轉回 dataset.json 使用的 '...' 佔位符格式"""
+    root = os.path.normpath(base_dir)
+    path = os.path.normpath(path)
+    if path.startswith(root + os.sep):
+        return ".../" + os.path.relpath(path, root).replace(os.sep, "/")
+    return path.replace(os.sep, "/")
+
+
+def preprocess(records, output_dir=DEFAULT_OUTPUT_DIR, wav_dir=DEFAULT_WAV_DIR,
+               workers=None, options=None, force=False):
+    """平行處理所有音檔並更新 manifest，回傳 manifest"""
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    previous = manifest["entries"]
+
+    entries, jobs = {}, []
+    for record in records:
+        source = record["audio"]
+        if not force and _unchanged(previous.get(source), source, options, manifest["options"]):
+            entries[source] = previous[source]
+        else:
+            jobs.append((source, os.path.join(output_dir, output_name(source, wav_dir))))
+
+    print(f"📊 共 {len(records)} 個音檔，沿用 {len(entries)} 個，需處理 {len(jobs)} 個")
+    start_time = time.time()
+    workers = workers or os.cpu_count() or 1
+    if jobs:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            futures = {pool.submit(process_clip, source, output, options): source for source, output in jobs}
+            for i, future in enumerate(as_completed(futures), 1):
+                source = futures[future]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    entry = {"source": source, "output": None, "status": "error", "issues": [str(e)]}
+                entries[source] = entry
+                if entry["status"] != "ok":
+                    print(f"  ⚠️ {os.path.basename(source)}: {entry['status']} ({', '.join(entry['issues'])})")
+                if i % 100 == 0:
+                    print(f"  ✅ {i}/{len(jobs)} ({time.time() - start_time:.1f}s)")
+
+    # 保留 records 中的順序
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "options": options,
+        "entries": {r["audio"]: entries[r["audio"]] for r in records},
+    }
+    save_manifest(manifest, output_dir)
+    print(f"⏱️ 處理時間: {time.time() - start_time:.1f}s")
+    return manifest
+
+
+def write_dataset(records, manifest, path=DEFAULT_OUTPUT_DATASET):
+    """寫出只含通過檢查之音檔的 jsonl，audio 指向正規化後的副本"""
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            entry = manifest["entries"].get(record["audio"])
+            if not entry or entry["status"] != "ok":
+                continue
+            f.write(json.dumps({
+                "audio": _placeholder(entry["output"]),
+                "transcript": record["text"],
+                "duration": round(entry["seconds"], 3),
+            }, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def summarize(manifest):
+    entries = list(manifest["entries"].values())
+    statuses = {}
+    for e in entries:
+        statuses[e["status"]] = statuses.get(e["status"], 0) + 1
+    durations = [e["seconds"] for e in entries if e["status"] == "ok"]
+    resampled = sum(1 for e in entries if e.get("source_sr") not in (None, manifest["options"]["target_sr"]))
+    clipped = sum(1 for e in entries if any(i.startswith("clipping") for i in e["issues"]))
+
+    print("\n" + "=" * 60)
+    for status, count in sorted(statuses.items()):
+        print(f"{status:<12}{count:>8}")
+    if durations:
+        print(f"總長度        {sum(durations) / 60:.1f} 分鐘")
+        print(f"長度 min/中位/max  {min(durations):.2f} / {float(np.median(durations)):.2f} / {max(durations):.2f}s")
+    print(f"重採樣        {resampled}")
+    print(f"破音          {clipped}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="音訊檢查、去靜音、響度正規化並重採樣成 24 kHz")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="dataset.json 或 .jsonl 路徑")
+    parser.add_argument("--metadata", default=DEFAULT_METADATA, help="LJSpeech 格式的 metadata.csv")
+    parser.add_argument("--wav-dir", default=DEFAULT_WAV_DIR, help="metadata.csv 中 id 對應的音檔目錄")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument("--output-dataset", default=DEFAULT_OUTPUT_DATASET)
+    parser.add_argument("--workers", type=int, default=None, help="行程數，預設為 CPU 核心數")
+    parser.add_argument("--target-lufs", type=float, default=DEFAULT_OPTIONS["target_lufs"])
+    parser.add_argument("--trim-db", type=float, default=DEFAULT_OPTIONS["trim_db"])
+    parser.add_argument("--min-seconds", type=float, default=DEFAULT_OPTIONS["min_seconds"])
+    parser.add_argument("--max-seconds", type=float, default=DEFAULT_OPTIONS["max_seconds"])
+    parser.add_argument("--force", action="store_true", help="忽略上次的結果，全部重新處理")
+    args = parser.parse_args(argv)
+
+    records = collect_records(args.dataset, args.metadata, args.wav_dir)
+    options = {
+        "target_lufs": args.target_lufs,
+        "trim_db": args.trim_db,
+        "min_seconds": args.min_seconds,
+        "max_seconds": args.max_seconds,
+    }
+    manifest = preprocess(records, args.output_dir, args.wav_dir, args.workers, options, args.force)
+    summarize(manifest)
+
+    count = write_dataset(records, manifest, args.output_dataset)
+    print(f"💾 manifest: {os.path.join(args.output_dir, MANIFEST_FILE)}")
+    print(f"💾 資料集: {args.output_dataset} ({count} 筆)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+CPU 推論用的模型量化
+推論主機沒有 GPU，fp16 的 HF backend 在 CPU 上很慢，這裡提供兩條路：
+
+1. GGUF（llama.cpp backend）：把 merge_lora.py 合併後的模型轉成 GGUF 並量化（Q8_0 / Q4_K_M ...）
+       python src/quantize_model.py gguf --model models/Llama-OuteTTS-1.0-1B-Finetuned --quant Q4_K_M
+   需要 llama.cpp 原始碼（convert_hf_to_gguf.py）與編譯好的 llama-quantize，以 --llama-cpp 或環境變數 LLAMA_CPP_DIR 指定
+2. hf-int8：載入時以 PyTorch dynamic quantization 把 Linear 權重轉成 int8，不需要額外轉檔
+
+比較各 backend 的速度:
+    python src/quantize_model.py compare --config hf:models/Llama-OuteTTS-1.0-1B-Finetuned \
+        --config hf-int8:models/Llama-OuteTTS-1.0-1B-Finetuned --config llamacpp:models/uep-Q4_K_M.gguf
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MERGED_MODEL = os.path.join(base_dir, "models", "Llama-OuteTTS-1.0-1B-Finetuned")
+
+# convert_hf_to_gguf.py 可直接輸出的型別，其餘需要再經過 llama-quantize
+CONVERT_TYPES = {"F16": "f16", "BF16": "bf16", "Q8_0": "q8_0", "F32": "f32"}
+QUANT_TYPES = ("F16", "BF16", "Q8_0", "Q6_K", "Q5_K_M", "Q5_K_S", "Q5_0", "Q5_1",
+               "Q4_K_M", "Q4_K_S", "Q4_0", "Q4_1", "Q3_K_M", "Q3_K_S", "Q3_K_L", "Q2_K")
+
+COMPARE_TEXTS = [
+    "Wow! I see.",
+    "Hello there, how are you doing today?",
+    "Oh my gosh, stories are just the best! They whisk you away to different worlds and introduce you to amazing characters.",
+]
+
+
+def quantize_int8(model):
+    """CPU 上的 int8 dynamic quantization：Linear 權重存成 int8，activation 執行時動態量化"""
+    import torch
+
+    return torch.ao.quantization.quantize_dynamic(model.float(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _find_quantize_binary(llama_cpp_dir):
+    candidates = [
+        os.path.join(llama_cpp_dir, "build", "bin", "llama-quantize"),
+        os.path.join(llama_cpp_dir, "build", "bin", "Release", "llama-quantize.exe"),
+        os.path.join(llama_cpp_dir, "llama-quantize"),
+    ]
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return shutil.which("llama-quantize")
+
+
+def export_gguf(model_dir=DEFAULT_MERGED_MODEL, output_path=None, quant="Q8_0", llama_cpp_dir=None):
+    """把 HF 格式的模型轉成量化後的 GGUF，回傳輸出路徑"""
+    quant = quant.upper()
+    if quant not in QUANT_TYPES:
+        raise ValueError(f"不支援的量化型別: {quant}，可用: {', '.join(QUANT_TYPES)}")
+
+    llama_cpp_dir = llama_cpp_dir or os.environ.get("LLAMA_CPP_DIR")
+    if not llama_cpp_dir:
+        raise FileNotFoundError("請以 --llama-cpp 或環境變數 LLAMA_CPP_DIR 指定 llama.cpp 目錄")
+    convert_script = os.path.join(llama_cpp_dir, "convert_hf_to_gguf.py")
+    if not os.path.exists(convert_script):
+        raise FileNotFoundError(f"找不到 {convert_script}")
+
+    name = os.path.basename(os.path.normpath(model_dir))
+    output_path = output_path or os.path.join(os.path.dirname(os.path.normpath(model_dir)), f"{name}-{quant}.gguf")
+
+    if quant in CONVERT_TYPES:
+        print(f"🔄 轉換成 GGUF ({quant})...")
+        subprocess.run([sys.executable, convert_script, model_dir,
+                        "--outfile", output_path, "--outtype", CONVERT_TYPES[quant]], check=True)
+        return output_path
+
+    quantize_binary = _find_quantize_binary(llama_cpp_dir)
+    if quantize_binary is None:
+        raise FileNotFoundError("找不到 llama-quantize，請先編譯 llama.cpp")
+
+    f16_path = output_path[:-len(".gguf")] + ".f16.gguf"
+    print("🔄 轉換成 GGUF (F16)...")
+    subprocess.run([sys.executable, convert_script, model_dir,
+                    "--outfile", f16_path, "--outtype", "f16"], check=True)
+    try:
+        print(f"🔄 量化成 {quant}...")
+        subprocess.run([quantize_binary, f16_path, output_path, quant], check=True)
+    finally:
+        if os.path.exists(f16_path):
+            os.remove(f16_path)
+    return output_path
+
+
+def parse_config(value):
+    """backend:model_path[:tokenizer_path]"""
+    backend, _, rest = value.partition(":")
+    model_path, _, tokenizer_path = rest.partition(":")
+    return backend, model_path or None, tokenizer_path or None
+
+
+def compare_backends(configs, texts=COMPARE_TEXTS, speaker=None, repeats=1, n_threads=None):
+    """依序載入各 backend，量測載入時間與各句的生成時間 / real-time factor"""
+    import gc
+    from tts_engine import TTSEngine, DEFAULT_MODEL_DIR
+
+    if n_threads:
+        import torch
+        torch.set_num_threads(n_threads)
+
+    results = []
+    for backend, model_path, tokenizer_path in configs:
+        print(f"\n🔄 載入 {backend}: {model_path}")
+        start = time.perf_counter()
+        engine = TTSEngine(model_path or DEFAULT_MODEL_DIR, tokenizer_path=tokenizer_path,
+                           backend=backend, device="cpu" if backend.startswith("hf") else None)
+        load_seconds = time.perf_counter() - start
+
+        # 第一次生成包含各種 lazy 初始化，不列入統計
+        engine.generate(texts[0], speaker=speaker)
+
+        total_seconds, total_audio = 0.0, 0.0
+        for text in texts:
+            for _ in range(repeats):
+                start = time.perf_counter()
+                output = engine.generate(text, speaker=speaker)
+                seconds = time.perf_counter() - start
+                total_seconds += seconds
+                total_audio += output.audio.shape[-1] / output.sr
+
+        result = {
+            "backend": backend,
+            "model": model_path,
+            "load_seconds": round(load_seconds, 2),
+            "generate_seconds": round(total_seconds, 2),
+            "audio_seconds": round(total_audio, 2),
+            "rtf": round(total_seconds / total_audio, 3) if total_audio else None,
+        }
+        results.append(result)
+        print(f"✅ {backend}: 載入 {load_seconds:.1f}s，RTF {result['rtf']}")
+
+        del engine
+        gc.collect()
+
+    print("\n" + "=" * 60)
+    print(f"{'backend':<12}{'載入(s)':>10}{'生成(s)':>10}{'音訊(s)':>10}{'RTF':>10}")
+    for r in results:
+        print(f"{r['backend']:<12}{r['load_seconds']:>10}{r['generate_seconds']:>10}{r['audio_seconds']:>10}{r['rtf']:>10}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU 推論用的模型量化與速度比較")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("gguf", help="轉成量化後的 GGUF（llama.cpp backend）")
+    p.add_argument("--model", default=DEFAULT_MERGED_MODEL, help="HF 格式的模型目錄（merge_lora.py 的輸出）")
+    p.add_argument("--output", default=None)
+    p.add_argument("--quant", default="Q8_0", help=f"量化型別: {', '.join(QUANT_TYPES)}")
+    p.add_argument("--llama-cpp", default=None, help="llama.cpp 目錄，預設讀取 LLAMA_CPP_DIR")
+
+    p = sub.add_parser("compare", help="比較各 backend 的生成速度")
+    p.add_argument("--config", action="append", required=True,
+                   help="backend:model_path[:tokenizer_path]，例如 hf-int8:models/xxx 或 llamacpp:models/xxx.gguf")
+    p.add_argument("--speaker", default=None)
+    p.add_argument("--repeats", type=int, default=1)
+    p.add_argument("--threads", type=int, default=None, help="PyTorch CPU 執行緒數")
+    p.add_argument("--output", default=None, help="結果寫成 JSON")
+
+    args = parser.parse_args()
+
+    if args.command == "gguf":
+        path = export_gguf(args.model, args.output, args.quant, args.llama_cpp)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        print(f"🎉 完成: {path} ({size_mb:.0f} MB)")
+        print(f"💡 使用: --backend llamacpp --model {path} --tokenizer {args.model}")
+    else:
+        results = compare_backends([parse_config(c) for c in args.config],
+                                   speaker=args.speaker, repeats=args.repeats, n_threads=args.threads)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"💾 已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
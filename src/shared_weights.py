@@ -0,0 +1,169 @@
+"""
+多個推論行程共用同一份模型權重
+原本要用多個核心合成就得同時跑好幾個腳本，每個都各自載入一份 1B fp16 權重與 codec，記憶體隨行程數倍增。
+這裡由父行程載入模型一次，之後 fork 出 N 個 worker：權重頁面以 copy-on-write 共用
+（或以 share_memory=True 搬進共享記憶體），每個 worker 只有自己的 KV cache 與運算中的 activation。
+
+    engine = TTSEngine(device="cpu")
+    prepare_for_fork(engine)
+    with WorkerProcesses(serve, workers=4) as processes:   # serve(index) 在每個 worker 中執行
+        processes.supervise()
+
+限制：
+- 只適用於 CPU（CUDA 無法在 fork 出來的行程中使用），也只能在支援 fork 的系統上執行（Linux / macOS）
+- 父行程在 fork 之前不要執行推論，避免 torch 的執行緒池處於使用中的狀態被複製
+- fork 之後才載入的 adapter 只存在於該 worker 中
+"""
+import gc
+import os
+import time
+import multiprocessing
+from multiprocessing.connection import wait
+
+
+def iter_modules(engine):
+    """引擎持有的 torch 模組：LM 與 codec"""
+    import torch
+
+    interface = engine.interface
+    candidates = [getattr(interface.model, "model", None), getattr(interface.audio_codec, "model", None)]
+    return [m for m in candidates if isinstance(m, torch.nn.Module)]
+
+
+def prepare_for_fork(engine, share_memory=False):
+    """
+    讓權重在 fork 之後保持共用：
+    - 關閉梯度、切到 eval，推論時不會寫入任何權重
+    - share_memory=True 時把權重搬進共享記憶體（/dev/shm 需容得下整個模型，Docker 預設只有 64MB）
+    - gc.freeze() 讓之後的垃圾回收不再碰觸既有物件，避免 copy-on-write 因 GC 標記而複製頁面
+    回傳 {"tensors": 數量, "weight_mb": 大小, "shared_memory": bool}
+    """
+    tensors = 0
+    size = 0
+    for module in iter_modules(engine):
+        module.eval()
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            tensor.requires_grad_(False)
+            if tensor.device.type != "cpu":
+                raise ValueError(f"多行程推論只支援 CPU 上的權重（目前在 {tensor.device}）")
+            if share_memory:
+                tensor.share_memory_()
+            tensors += 1
+            size += tensor.numel() * tensor.element_size()
+    gc.collect()
+    gc.freeze()
+    return {"tensors": tensors, "weight_mb": size / 1024 / 1024, "shared_memory": share_memory}
+
+
+def memory_usage(pid=None):
+    """
+    行程的記憶體用量（MB），讀取 /proc/<pid>/smaps_rollup
+    rss 包含共用的頁面；pss 把共用頁面平均分攤到各行程，加總即為實際佔用；private 為該行程獨有的部分
+    不支援的系統回傳 None
+    """
+    path = f"/proc/{pid or os.getpid()}/smaps_rollup"
+    try:
+        with open(path) as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) / 1024
+    except OSError:
+        return None
+    return {
+        "rss": round(fields.get("Rss", 0.0), 1),
+        "pss": round(fields.get("Pss", 0.0), 1),
+        "shared": round(fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0), 1),
+        "private": round(fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0), 1),
+    }
+
+
+def _run_worker(target, index, num_threads):
+    import torch
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    try:
+        target(index)
+    except KeyboardInterrupt:
+        pass
+
+
+class WorkerProcesses:
+    """
+    以 fork 啟動 workers 個行程執行 target(index)，繼承父行程已載入的模型
+    每個行程的 torch 執行緒數預設為「CPU 核心數 / 行程數」；supervise() 會重新啟動意外結束的 worker
+    """
+
+    def __init__(self, target, workers, threads_per_worker=None):
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("共用權重的多行程推論需要 fork（Linux / macOS）")
+        self.target = target
+        self.workers = workers
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+        self.threads_per_worker = threads_per_worker
+        self._context = multiprocessing.get_context("fork")
+        self.processes = [None] * workers
+        self._stopping = False
+
+    def _spawn(self, index):
+        process = self._context.Process(
+            target=_run_worker,
+            args=(self.target, index, self.threads_per_worker),
+            name=f"tts-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+        return process
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        return self
+
+    def pids(self):
+        return [p.pid for p in self.processes if p is not None]
+
+    def memory_report(self):
+        """每個 worker 的記憶體用量，以及所有 worker 的 PSS 總和"""
+        usage = {pid: memory_usage(pid) for pid in self.pids()}
+        if any(u is None for u in usage.values()):
+            return None
+        return {"workers": usage, "total_pss": round(sum(u["pss"] for u in usage.values()), 1)}
+
+    def supervise(self, restart_delay=1.0):
+        """阻塞直到 stop() 或所有 worker 都正常結束；worker 意外結束時重新 fork 一個"""
+        while not self._stopping:
+            alive = [p for p in self.processes if p is not None]
+            if not alive:
+                return
+            wait([p.sentinel for p in alive])
+            for index, process in enumerate(self.processes):
+                if process is None or process.is_alive() or self._stopping:
+                    continue
+                process.join()
+                if process.exitcode == 0:
+                    # 正常結束（例如 Ctrl+C）不重新啟動
+                    self.processes[index] = None
+                    continue
+                print(f"⚠️ worker {index}（pid {process.pid}）結束，exit code {process.exitcode}，重新啟動")
+                time.sleep(restart_delay)
+                self._spawn(index)
+
+    def stop(self, timeout=10):
+        self._stopping = True
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,257 @@
+"""
+二進位 speaker profile 格式 (.uepspk)
+把 speaker JSON 中逐行列出的 c1/c2 codebook token 打包成連續的 int16 陣列，
+載入時以 mmap 直接讀取，不會為每個 token 建立 Python 物件。
+
+檔案佈局（little-endian）:
+    header      固定長度，記錄各區段位置
+    word table  每個字一筆: 字串位置、token 範圍、duration、features
+    strings     UTF-8 字串池（speaker 文字 + 每個字）
+    c1 / c2     兩段連續的 int16 codebook 陣列
+"""
+import os
+import sys
+import json
+import mmap
+import struct
+import argparse
+
+MAGIC = b"UEPSPK\x00\x00"
+FORMAT_VERSION = 1
+BINARY_EXT = ".uepspk"
+
+# magic, format_version, interface_version, n_words, n_tokens,
+# text_len, strings_offset, strings_size, c1_offset, c2_offset, energy, spectral_centroid, pitch
+HEADER = struct.Struct("<8sHHIIIIIIIBBBx")
+# str_offset, str_len, token_start, token_count, duration, energy, spectral_centroid, pitch
+WORD = struct.Struct("<IIIIfBBBx")
+FEATURE_KEYS = ("energy", "spectral_centroid", "pitch")
+
+if sys.byteorder != "little":
+    raise ImportError("speaker_format 目前只支援 little-endian 平台")
+
+
+def _features(values):
+    return dict(zip(FEATURE_KEYS, values))
+
+
+def _pack_features(features):
+    features = features or {}
+    return tuple(int(features.get(k, 0)) for k in FEATURE_KEYS)
+
+
+def write_binary(speaker, path):
+    """把 speaker dict 寫成 .uepspk"""
+    words = speaker["words"]
+    strings = bytearray(speaker["text"].encode("utf-8"))
+    text_len = len(strings)
+
+    word_records = []
+    c1, c2 = [], []
+    for w in words:
+        if len(w["c1"]) != len(w["c2"]):
+            raise ValueError(f"字 {w['word']!r} 的 c1/c2 長度不一致")
+        encoded = w["word"].encode("utf-8")
+        word_records.append(WORD.pack(
+            len(strings), len(encoded), len(c1), len(w["c1"]),
+            float(w["duration"]), *_pack_features(w.get("features"))
+        ))
+        strings.extend(encoded)
+        c1.extend(w["c1"])
+        c2.extend(w["c2"])
+
+    if any(not -32768 <= t <= 32767 for t in c1 + c2):
+        raise ValueError("codebook token 超出 int16 範圍")
+
+    strings_offset = HEADER.size + WORD.size * len(words)
+    # codebook 陣列對齊到 2 bytes
+    c1_offset = strings_offset + len(strings) + (strings_offset + len(strings)) % 2
+    c2_offset = c1_offset + 2 * len(c1)
+
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, int(speaker.get("interface_version", 3)),
+        len(words), len(c1), text_len, strings_offset, len(strings),
+        c1_offset, c2_offset, *_pack_features(speaker.get("global_features"))
+    )
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(b"".join(word_records))
+        f.write(strings)
+        f.write(b"\x00" * (c1_offset - strings_offset - len(strings)))
+        f.write(struct.pack(f"<{len(c1)}h", *c1))
+        f.write(struct.pack(f"<{len(c2)}h", *c2))
+    os.replace(tmp_path, path)
+
+
+class BinarySpeaker:
+    """以 mmap 開啟的 .uepspk；字表在第一次使用時才解析"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+        fields = HEADER.unpack_from(self._view, 0)
+        magic, version = fields[0], fields[1]
+        if magic != MAGIC:
+            raise ValueError(f"不是 .uepspk 檔案: {path}")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"不支援的 .uepspk 版本: {version}")
+
+        (_, _, self.interface_version, self.num_words, self.num_tokens,
+         self._text_len, self._strings_offset, self._strings_size,
+         c1_offset, c2_offset) = fields[:10]
+        self.global_features = _features(fields[10:13])
+
+        self.c1 = self._view[c1_offset:c1_offset + 2 * self.num_tokens].cast("h")
+        self.c2 = self._view[c2_offset:c2_offset + 2 * self.num_tokens].cast("h")
+        self._words = None
+
+    def _string(self, offset, length):
+        start = self._strings_offset + offset
+        return bytes(self._view[start:start + length]).decode("utf-8")
+
+    @property
+    def text(self):
+        return self._string(0, self._text_len)
+
+    @property
+    def words(self):
+        """[(word, token_start, token_count, duration, features)]"""
+        if self._words is None:
+            table = self._view[HEADER.size:HEADER.size + WORD.size * self.num_words]
+            self._words = []
+            for record in WORD.iter_unpack(table):
+                s_off, s_len, start, count, duration = record[:5]
+                self._words.append(
+                    (self._string(s_off, s_len), start, count, round(duration, 2), _features(record[5:8]))
+                )
+        return self._words
+
+    def to_dict(self):
+        """
+        回傳 outetts 可直接使用的 speaker dict
+        c1/c2 為 mmap 上的 memoryview 切片，每次呼叫都產生新的 words 列表，
+        因為 outetts 的 get_completion_prompt 會修改最後一個字
+        """
+        words = []
+        for word, start, count, duration, features in self.words:
+            words.append({
+                "word": word,
+                "duration": duration,
+                "c1": self.c1[start:start + count],
+                "c2": self.c2[start:start + count],
+                "features": dict(features),
+            })
+        return {
+            "text": self.text,
+            "words": words,
+            "global_features": dict(self.global_features),
+            "interface_version": self.interface_version,
+        }
+
+    def to_json_dict(self):
+        """轉回與原本 JSON 相同結構（token 轉成 int list）"""
+        speaker = self.to_dict()
+        for w in speaker["words"]:
+            w["c1"] = w["c1"].tolist()
+            w["c2"] = w["c2"].tolist()
+        return speaker
+
+    def close(self):
+        """釋放 mmap；若 to_dict() 產生的切片仍在使用，映射會在切片回收後才真正釋放"""
+        self._words = None
+        try:
+            self.c1.release()
+            self.c2.release()
+            self._view.release()
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_speaker(path, interface=None):
+    """依副檔名載入 JSON 或 .uepspk speaker，提供 interface 時檢查版本"""
+    if path.endswith(BINARY_EXT):
+        speaker = BinarySpeaker(path).to_dict()
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            speaker = json.load(f)
+
+    if interface is not None:
+        version = speaker.get("interface_version", 2)
+        current = interface.config.interface_version.value
+        if version != current and not (version == 2 and current <= 2):
+            raise ValueError(f"Speaker interface version mismatch: {version} != {current}")
+    return speaker
+
+
+class SpeakerLibrary:
+    """speaker 目錄；每個 .uepspk 只在第一次使用時 mmap，之後常駐"""
+
+    def __init__(self, speaker_dir):
+        self.speaker_dir = speaker_dir
+        self._speakers = {}
+
+    def names(self):
+        return sorted(
+            f[:-len(BINARY_EXT)] for f in os.listdir(self.speaker_dir) if f.endswith(BINARY_EXT)
+        )
+
+    def get(self, name):
+        speaker = self._speakers.get(name)
+        if speaker is None:
+            speaker = BinarySpeaker(os.path.join(self.speaker_dir, name + BINARY_EXT))
+            self._speakers[name] = speaker
+        return speaker.to_dict()
+
+    def close(self):
+        for speaker in self._speakers.values():
+            speaker.close()
+        self._speakers.clear()
+
+
+def json_to_binary(json_path, out_path=None):
+    out_path = out_path or os.path.splitext(json_path)[0] + BINARY_EXT
+    with open(json_path, "r", encoding="utf-8") as f:
+        speaker = json.load(f)
+    write_binary(speaker, out_path)
+    return out_path
+
+
+def binary_to_json(bin_path, out_path=None):
+    out_path = out_path or os.path.splitext(bin_path)[0] + ".json"
+    with BinarySpeaker(bin_path) as speaker:
+        data = speaker.to_json_dict()
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="speaker JSON 與 .uepspk 互轉")
+    parser.add_argument("mode", choices=["to-bin", "to-json"], help="轉換方向")
+    parser.add_argument("inputs", nargs="+", help="輸入檔案")
+    parser.add_argument("-o", "--output", default=None, help="輸出路徑（只在單一輸入時使用）")
+    args = parser.parse_args()
+
+    if args.output and len(args.inputs) > 1:
+        parser.error("--output 只能搭配單一輸入檔")
+
+    convert = json_to_binary if args.mode == "to-bin" else binary_to_json
+    for path in args.inputs:
+        out_path = convert(path, args.output)
+        print(f"✅ {path} -> {out_path} ({os.path.getsize(out_path)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
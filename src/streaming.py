@@ -0,0 +1,181 @@
+"""
+串流語音輸出
+長文字會先切段，每一段的 audio token 一解碼完就立即輸出 PCM，
+不必等整句生成完畢，以縮短第一段聲音出現的時間（time-to-first-audio）。
+提供同步 generator、async iterator，以及可逐步寫入 wav / raw PCM 的 sink。
+"""
+import time
+import struct
+import asyncio
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class AudioFrame:
+    """一段已解碼的音訊"""
+    index: int
+    samples: np.ndarray      # float32，單聲道，範圍 [-1, 1]
+    sample_rate: int
+    elapsed: float           # 從開始生成到這段可播放所經過的秒數
+    num_tokens: int          # 這段 LM 輸出的 token 數
+
+
+def to_pcm16(samples):
+    """float32 [-1, 1] -> int16 little-endian bytes"""
+    samples = np.clip(np.asarray(samples, dtype=np.float32), -1.0, 1.0)
+    return (samples * 32767.0).round().astype("<i2").tobytes()
+
+
+def stream_generate(engine, text, speaker=None, generation_type="chunked", sampler=None, max_length=8192,
+                    adapter=None):
+    """逐段生成並解碼，每段完成後 yield 一個 AudioFrame；語音快取命中時只 yield 一個完整的 AudioFrame"""
+    start = time.perf_counter()
+    config = engine.make_config(text, speaker, generation_type, sampler, max_length)
+    sample_rate = engine.interface.audio_codec.sr
+
+    key, cached = engine.cache_lookup(text, speaker, generation_type, sampler, adapter)
+    if cached is not None:
+        samples = cached.audio.detach().flatten().float().cpu().numpy()
+        yield AudioFrame(0, samples, cached.sr, time.perf_counter() - start, 0)
+        return
+
+    index = 0
+    parts = []
+    for tokens in engine.iter_chunk_tokens(config, adapter):
+        audio = engine.decode_tokens(tokens)
+        if audio is None:
+            continue
+        samples = audio.detach().flatten().float().cpu().numpy()
+        if key is not None:
+            parts.append(samples)
+        yield AudioFrame(index, samples, sample_rate, time.perf_counter() - start, len(tokens))
+        index += 1
+
+    # 完整生成後才存入快取（中途停止的串流不存）
+    if parts:
+        import torch
+        from outetts.version.playback import ModelOutput
+
+        engine.cache_store(key, ModelOutput(torch.from_numpy(np.concatenate(parts)).view(1, 1, -1), sample_rate))
+
+
+async def astream_generate(engine, text, speaker=None, generation_type="chunked", sampler=None, max_length=8192,
+                           adapter=None):
+    """
+    stream_generate 的 async 版本：生成在背景執行緒進行，不阻塞 event loop
+    取用端停止迭代或 task 被取消時，背景執行緒在目前這段生成完後就停止，不再佔用模型鎖
+    """
+    loop = asyncio.get_running_loop()
+    frames = asyncio.Queue()
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(frames.put_nowait, item)
+        except RuntimeError:
+            # event loop 已關閉：沒有人會再取用
+            stop.set()
+
+    def produce():
+        generator = stream_generate(engine, text, speaker, generation_type, sampler, max_length, adapter)
+        try:
+            for frame in generator:
+                if stop.is_set():
+                    break
+                put(frame)
+                # 要求下一段之前先確認取用端還在
+                if stop.is_set():
+                    break
+        except Exception as e:
+            put(e)
+        finally:
+            generator.close()
+            put(done)
+
+    threading.Thread(target=produce, name="tts-stream", daemon=True).start()
+    try:
+        while True:
+            item = await frames.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+class RawPCMWriter:
+    """把 16-bit PCM 逐段寫入 file-like 物件"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.frames_written = 0
+
+    def write(self, samples):
+        data = to_pcm16(samples)
+        self.fileobj.write(data)
+        self.frames_written += len(data) // 2
+        if hasattr(self.fileobj, "flush"):
+            self.fileobj.flush()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class WavStreamWriter(RawPCMWriter):
+    """
+    逐段寫入的 16-bit 單聲道 wav
+    先寫出長度未知的 header，可 seek 的檔案在 close() 時補上正確長度；
+    不可 seek 的串流（socket、pipe）則保留 0xFFFFFFFF，多數播放器會讀到串流結束為止
+    """
+
+    def __init__(self, fileobj, sample_rate):
+        super().__init__(fileobj)
+        self.sample_rate = sample_rate
+        self._header_pos = fileobj.tell() if self._seekable() else None
+        fileobj.write(self._header(0xFFFFFFFF))
+
+    def _seekable(self):
+        try:
+            return self.fileobj.seekable()
+        except (AttributeError, ValueError):
+            return False
+
+    def _header(self, data_size):
+        riff_size = 0xFFFFFFFF if data_size == 0xFFFFFFFF else 36 + data_size
+        return (
+            b"RIFF" + struct.pack("<I", riff_size) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, self.sample_rate, self.sample_rate * 2, 2, 16)
+            + b"data" + struct.pack("<I", data_size)
+        )
+
+    def close(self):
+        if self._header_pos is None:
+            return
+        end = self.fileobj.tell()
+        self.fileobj.seek(self._header_pos)
+        self.fileobj.write(self._header(self.frames_written * 2))
+        self.fileobj.seek(end)
+        self._header_pos = None
+
+
+def stream_to_sink(frames, sink):
+    """把 AudioFrame 依序寫入 sink，回傳第一段音訊的 elapsed 秒數（time-to-first-audio）"""
+    first_audio = None
+    with sink:
+        for frame in frames:
+            if first_audio is None:
+                first_audio = frame.elapsed
+            sink.write(frame.samples)
+    return first_audio
@@ -0,0 +1,313 @@
+"""
+合成流程的分段計時與記憶體量測（選用）
+instrument(interface, tracer) 在 outetts.Interface 實例上包裝各階段的方法，不修改 outetts 本身，
+TTSEngine（engine.interface）與直接使用 Interface.generate 的腳本都適用：
+
+- normalize：文字正規化
+- speaker_prompt：組出含 speaker 逐字 codes 的 prompt（內含 normalize）
+- tokenize：prompt 轉成 token id
+- generate：LM 生成，HF backend 再細分為 prefill（第一個 token 之前）與 decode（之後的逐 token 生成）
+- codec_decode：DAC 把音訊 token 解碼成波形
+- write：AudioSink 寫檔（在寫檔執行緒上）
+
+每個 span 記錄起訖時間、執行緒、常駐記憶體與 GPU 記憶體的變化，可存成 Chrome trace（.json，
+在 chrome://tracing 或 Perfetto 開啟）或每行一個 span 的結構化紀錄（.jsonl）。
+
+    tracer = Tracer()
+    undo = instrument(engine.interface, tracer)
+    with tracer.span("synthesize", text=text):
+        output = engine.generate(text)
+    tracer.print_summary()
+    tracer.save("outputs/traces/run.json")
+"""
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+import dataclasses
+
+import numpy as np
+
+# LM 與 codec 各自包含的階段，用來判斷瓶頸
+LM_STAGES = ("prefill", "decode")
+CODEC_STAGES = ("codec_decode",)
+STAGE_ORDER = ("synthesize", "normalize", "speaker_prompt", "tokenize", "generate", "prefill", "decode",
+               "codec_decode", "write")
+
+
+def rss_mb():
+    """目前行程的常駐記憶體（MB）；無法取得時回傳 None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def gpu_mb():
+    """目前配置的 GPU 記憶體（MB）；尚未載入 torch 或沒有 CUDA 時回傳 None"""
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return torch.cuda.memory_allocated() / 1024 / 1024
+
+
+def _delta(end, start):
+    return end - start if end is not None and start is not None else None
+
+
+class Tracer:
+    """
+    收集 span 與計數器（thread-safe）
+    cuda_sync：量測 LM 步驟時先同步 GPU，讓時間對應到實際的計算而不是 kernel 排程（會稍微拖慢生成）
+    per_token：另外記錄每個 decode 步驟的 span（長句會有上千個事件）
+    """
+
+    def __init__(self, cuda_sync=True, per_token=False):
+        self.cuda_sync = cuda_sync
+        self.per_token = per_token
+        self.spans = []
+        self.counters = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+
+    def _now_us(self, t=None):
+        return ((time.perf_counter() if t is None else t) - self._origin) * 1e6
+
+    def add_span(self, name, start, end, memory=None, **args):
+        """start / end 為 time.perf_counter() 的值"""
+        span = {
+            "name": name,
+            "ts": self._now_us(start),
+            "dur": (end - start) * 1e6,
+            "tid": threading.get_ident(),
+            "thread": threading.current_thread().name,
+            "args": args,
+        }
+        if memory:
+            span["args"].update(memory)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        """量測一段程式；可在 with 區塊內修改 yield 出來的 dict 以補上更多欄位"""
+        rss_start, gpu_start = rss_mb(), gpu_mb()
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            rss_end, gpu_end = rss_mb(), gpu_mb()
+            memory = {"rss_mb": rss_end, "rss_delta_mb": _delta(rss_end, rss_start)}
+            if gpu_end is not None:
+                memory.update(gpu_mb=gpu_end, gpu_delta_mb=_delta(gpu_end, gpu_start))
+            self.add_span(name, start, end, memory, **args)
+
+    def counter(self, name, value):
+        with self._lock:
+            self.counters.append({"name": name, "ts": self._now_us(), "value": value})
+
+    # ---------- 輸出 ----------
+
+    def chrome_trace(self):
+        """Chrome trace event format（complete event + counter event）"""
+        events = []
+        threads = {}
+        for span in self.spans:
+            threads[span["tid"]] = span["thread"]
+            events.append({"name": span["name"], "cat": "tts", "ph": "X", "ts": span["ts"], "dur": span["dur"],
+                           "pid": self._pid, "tid": span["tid"], "args": span["args"]})
+        for counter in self.counters:
+            events.append({"name": counter["name"], "ph": "C", "ts": counter["ts"], "pid": self._pid,
+                           "args": {counter["name"]: counter["value"]}})
+        for tid, name in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, path):
+        """.jsonl 寫成結構化紀錄，其他副檔名寫成 Chrome trace"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                for span in sorted(self.spans, key=lambda s: s["ts"]):
+                    record = {"name": span["name"], "start_ms": span["ts"] / 1000, "duration_ms": span["dur"] / 1000,
+                              "thread": span["thread"], **span["args"]}
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                for counter in self.counters:
+                    f.write(json.dumps({"counter": counter["name"], "value": counter["value"],
+                                        "at_ms": counter["ts"] / 1000}) + "\n")
+            else:
+                json.dump(self.chrome_trace(), f, ensure_ascii=False)
+        return path
+
+    def summary(self):
+        """各階段的次數與總時間，以及 audio token 速度與 LM / codec 的時間比例"""
+        stages = {}
+        for span in self.spans:
+            if span["name"] == "decode_token":
+                continue
+            stage = stages.setdefault(span["name"], {"count": 0, "seconds": 0.0, "rss_delta_mb": 0.0})
+            stage["count"] += 1
+            stage["seconds"] += span["dur"] / 1e6
+            stage["rss_delta_mb"] += span["args"].get("rss_delta_mb") or 0.0
+
+        def total(names):
+            return sum(stages.get(name, {}).get("seconds", 0.0) for name in names)
+
+        lm_seconds = total(LM_STAGES) or total(("generate",))
+        codec_seconds = total(CODEC_STAGES)
+        tokens = sum(s["args"].get("tokens", 0) for s in self.spans if s["name"] == "decode")
+        audio_seconds = sum(s["args"].get("audio_seconds", 0.0) for s in self.spans if s["name"] == "codec_decode")
+        decode_seconds = total(("decode",))
+        steps = [s["dur"] / 1000 for s in self.spans if s["name"] == "decode_token"]
+        return {
+            "stages": stages,
+            "lm_seconds": lm_seconds,
+            "codec_seconds": codec_seconds,
+            "bottleneck": None if not (lm_seconds or codec_seconds) else ("lm" if lm_seconds >= codec_seconds else "codec"),
+            "tokens": tokens,
+            "audio_tokens_per_second": tokens / decode_seconds if decode_seconds else None,
+            "audio_seconds": audio_seconds,
+            "codec_rtf": codec_seconds / audio_seconds if audio_seconds else None,
+            "decode_step_ms": {"p50": float(np.percentile(steps, 50)), "p95": float(np.percentile(steps, 95))} if steps else None,
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        stages = summary["stages"]
+        print("\n" + "=" * 60)
+        print(f"{'階段':<18}{'次數':>6}{'總時間(s)':>12}{'平均(ms)':>12}{'RSS 變化(MB)':>14}")
+        names = [n for n in STAGE_ORDER if n in stages] + sorted(n for n in stages if n not in STAGE_ORDER)
+        for name in names:
+            stage = stages[name]
+            print(f"{name:<18}{stage['count']:>6}{stage['seconds']:>12.3f}"
+                  f"{stage['seconds'] / stage['count'] * 1000:>12.1f}{stage['rss_delta_mb']:>14.1f}")
+        if summary["audio_tokens_per_second"] is not None:
+            print(f"audio tokens/sec: {summary['audio_tokens_per_second']:.1f}（{summary['tokens']} tokens）")
+        if summary["codec_rtf"] is not None:
+            print(f"codec RTF: {summary['codec_rtf']:.3f}（{summary['audio_seconds']:.1f}s 音訊）")
+        if summary["bottleneck"]:
+            print(f"LM {summary['lm_seconds']:.2f}s / codec {summary['codec_seconds']:.2f}s -> 瓶頸: {summary['bottleneck']}")
+        return summary
+
+
+# ---------- Interface 包裝 ----------
+
+def _step_timer(tracer, generate_start):
+    """HF generate 每一步呼叫一次的 logits processor，記錄 prefill 結束與每個 decode 步驟的時間"""
+    from transformers import LogitsProcessor
+
+    class StepTimer(LogitsProcessor):
+        def __init__(self):
+            self.times = []
+
+        def __call__(self, input_ids, scores):
+            if tracer.cuda_sync and scores.is_cuda:
+                sys.modules["torch"].cuda.synchronize(scores.device)
+            self.times.append(time.perf_counter())
+            return scores
+
+    timer = StepTimer()
+    timer.generate_start = generate_start
+    return timer
+
+
+def _record_steps(tracer, timer, end):
+    """把 StepTimer 的時間點轉成 prefill / decode span"""
+    if not timer.times:
+        return
+    first = timer.times[0]
+    tracer.add_span("prefill", timer.generate_start, first)
+    # 第 i 個 token 的 decode 時間為第 i-1 次到第 i 次呼叫之間；最後一個 token 取樣後到 generate 返回也算在 decode
+    points = timer.times + [end]
+    steps = np.diff(points) * 1000
+    tokens = len(timer.times)
+    tracer.add_span("decode", first, end, tokens=tokens,
+                    ms_per_token=float(steps.mean()) if len(steps) else None,
+                    p95_ms=float(np.percentile(steps, 95)) if len(steps) else None)
+    if tracer.per_token:
+        for i in range(len(points) - 1):
+            tracer.add_span("decode_token", points[i], points[i + 1], index=i + 1)
+    if end > first:
+        tracer.counter("audio_tokens_per_second", tokens / (end - first))
+
+
+def instrument(interface, tracer):
+    """在 interface 實例上掛上量測，回傳取消量測的函式"""
+    import outetts
+
+    patched = []
+
+    def patch(obj, name, wrapper):
+        original = getattr(obj, name)
+        patched.append((obj, name, original if name in vars(obj) else None))
+        setattr(obj, name, wrapper(original))
+
+    def timed(stage, describe=None):
+        def wrapper(original):
+            def call(*args, **kwargs):
+                with tracer.span(stage) as info:
+                    result = original(*args, **kwargs)
+                    if describe is not None:
+                        info.update(describe(result))
+                    return result
+            return call
+        return wrapper
+
+    prompt_processor = interface.prompt_processor
+    patch(prompt_processor, "text_normalizations", timed("normalize"))
+    patch(prompt_processor, "get_completion_prompt", timed("speaker_prompt"))
+    patch(interface, "_prepare_prompt", timed("tokenize", lambda ids: {"prompt_tokens": len(ids[0]) if hasattr(ids, "shape") else len(ids)}))
+
+    def codec_info(audio):
+        if audio is None:
+            return {"audio_seconds": 0.0}
+        return {"audio_seconds": audio.shape[-1] / interface.audio_codec.sr}
+
+    patch(interface, "get_audio", timed("codec_decode", codec_info))
+
+    is_hf = interface.config.backend == outetts.Backend.HF
+
+    def generate_wrapper(original):
+        def call(input_ids, config, *args, **kwargs):
+            with tracer.span("generate") as info:
+                timer = None
+                if is_hf and config.generation_type != outetts.GenerationType.STREAM:
+                    from transformers import LogitsProcessorList
+
+                    timer = _step_timer(tracer, time.perf_counter())
+                    extra = dict(config.additional_gen_config)
+                    processors = LogitsProcessorList(extra.get("logits_processor") or [])
+                    processors.append(timer)
+                    extra["logits_processor"] = processors
+                    config = dataclasses.replace(config, additional_gen_config=extra)
+                output = original(input_ids, config, *args, **kwargs)
+                if timer is not None:
+                    _record_steps(tracer, timer, time.perf_counter())
+                info["output_tokens"] = len(output)
+                return output
+        return call
+
+    patch(interface, "_generate", generate_wrapper)
+
+    def undo():
+        for obj, name, original in reversed(patched):
+            # 包裝是實例屬性，刪掉後就回到類別上的原方法
+            if original is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, original)
+
+    return undo
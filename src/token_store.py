@@ -0,0 +1,190 @@
+"""
+音訊 codec token 快取
+把每個 wav 編碼後的 c1/c2 codebook token 與逐字對齊結果存到磁碟，
+token 以 int16 連續存放並透過 memory-map 讀取，索引以音檔內容雜湊為鍵。
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+STORE_VERSION = 1
+TOKENS_FILE = "tokens.bin"
+INDEX_FILE = "index.json"
+
+# 每一列存 (c1, c2) 兩個 int16
+ROW_DTYPE = np.int16
+ROW_WIDTH = 2
+ROW_BYTES = np.dtype(ROW_DTYPE).itemsize * ROW_WIDTH
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """計算音檔內容的 sha1"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TokenStore:
+    """以音檔雜湊為索引的 codec token 儲存區"""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.tokens_path = os.path.join(store_dir, TOKENS_FILE)
+        self.index_path = os.path.join(store_dir, INDEX_FILE)
+        os.makedirs(store_dir, exist_ok=True)
+        self.index = self._load_index()
+        self._tokens = None
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {"version": STORE_VERSION, "entries": {}, "files": {}}
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") != STORE_VERSION:
+            raise ValueError(f"不支援的 token store 版本: {index.get('version')}")
+        return index
+
+    def save(self):
+        """寫回索引（先寫暫存檔再取代，避免中斷時損壞）"""
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    # ---------- 檔案雜湊 ----------
+
+    def file_hash(self, audio_path):
+        """取得音檔雜湊；大小與修改時間未變時沿用上次的結果"""
+        stat = os.stat(audio_path)
+        key = os.path.normpath(audio_path)
+        cached = self.index["files"].get(key)
+        if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime:
+            return cached["hash"]
+
+        digest = hash_file(audio_path)
+        self.index["files"][key] = {"hash": digest, "size": stat.st_size, "mtime": stat.st_mtime}
+        return digest
+
+    def __contains__(self, digest):
+        return digest in self.index["entries"]
+
+    def __len__(self):
+        return len(self.index["entries"])
+
+    def keys(self):
+        return list(self.index["entries"].keys())
+
+    def records(self):
+        """訓練用的輕量紀錄 [{"key", "text", "num_tokens"}]，不讀取 token 本身"""
+        return [
+            {"key": digest, "text": entry["text"], "num_tokens": entry["length"]}
+            for digest, entry in self.index["entries"].items()
+        ]
+
+    # ---------- 寫入 ----------
+
+    def add(self, digest, text, c1, c2, words, global_features=None):
+        """
+        新增一筆編碼結果
+        words: [{"word", "start", "end", "duration", "features"}]，start/end 為此筆資料內的 token 索引
+        """
+        if len(c1) != len(c2):
+            raise ValueError(f"c1/c2 長度不一致: {len(c1)} != {len(c2)}")
+
+        rows = np.stack([np.asarray(c1, dtype=ROW_DTYPE), np.asarray(c2, dtype=ROW_DTYPE)], axis=1)
+        offset = self._num_rows()
+        with open(self.tokens_path, "ab") as f:
+            f.write(np.ascontiguousarray(rows).tobytes())
+        self._tokens = None
+
+        self.index["entries"][digest] = {
+            "text": text,
+            "offset": offset,
+            "length": len(c1),
+            "words": words,
+            "global_features": global_features or {},
+        }
+
+    def _num_rows(self):
+        if not os.path.exists(self.tokens_path):
+            return 0
+        return os.path.getsize(self.tokens_path) // ROW_BYTES
+
+    # ---------- 讀取 ----------
+
+    @property
+    def tokens(self):
+        """整個 token 檔的 memory-map 視圖，形狀為 (rows, 2)"""
+        if self._tokens is None:
+            if self._num_rows() == 0:
+                return np.zeros((0, ROW_WIDTH), dtype=ROW_DTYPE)
+            self._tokens = np.memmap(self.tokens_path, dtype=ROW_DTYPE, mode="r").reshape(-1, ROW_WIDTH)
+        return self._tokens
+
+    def codes(self, digest):
+        """回傳 (c1, c2) 兩個 memory-map 視圖，不複製資料"""
+        entry = self.index["entries"][digest]
+        rows = self.tokens[entry["offset"]:entry["offset"] + entry["length"]]
+        return rows[:, 0], rows[:, 1]
+
+    def get(self, digest):
+        """組出與 speaker profile 相同結構的 dict（words 內含 c1/c2 list）"""
+        entry = self.index["entries"][digest]
+        c1, c2 = self.codes(digest)
+        words = []
+        for w in entry["words"]:
+            words.append({
+                "word": w["word"],
+                "duration": w["duration"],
+                "c1": c1[w["start"]:w["end"]].tolist(),
+                "c2": c2[w["start"]:w["end"]].tolist(),
+                "features": w["features"],
+            })
+        return {
+            "text": entry["text"],
+            "words": words,
+            "global_features": entry["global_features"],
+        }
+
+    # ---------- 維護 ----------
+
+    def prune(self, live_digests):
+        """移除不再被資料集引用的項目；廢棄資料過多時重新壓縮 token 檔"""
+        live_digests = set(live_digests)
+        entries = self.index["entries"]
+        for digest in [d for d in entries if d not in live_digests]:
+            del entries[digest]
+
+        live_hashes = set(entries)
+        self.index["files"] = {
+            path: info for path, info in self.index["files"].items() if info["hash"] in live_hashes
+        }
+
+        live_rows = sum(e["length"] for e in entries.values())
+        total_rows = self._num_rows()
+        if total_rows and live_rows < total_rows * 0.75:
+            self.compact()
+
+    def compact(self):
+        """只保留仍在索引中的 token 重寫 token 檔"""
+        tmp_path = self.tokens_path + ".tmp"
+        offset = 0
+        tokens = self.tokens
+        rows = None
+        with open(tmp_path, "wb") as f:
+            for entry in self.index["entries"].values():
+                rows = tokens[entry["offset"]:entry["offset"] + entry["length"]]
+                f.write(np.ascontiguousarray(rows).tobytes())
+                entry["offset"] = offset
+                offset += entry["length"]
+        # Windows 上必須先釋放 memmap 才能取代檔案
+        self._tokens = None
+        del tokens, rows
+        os.replace(tmp_path, self.tokens_path)
+        self.save()
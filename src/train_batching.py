@@ -0,0 +1,237 @@
+"""
+訓練用的長度分組與 token 預算批次
+資料集大多是 "Wow!" 這類一個字的短句，夾雜少數長句。固定 batch_size=1 時每一步都是幾個很小的 forward。
+這裡提供：
+- pack_examples：把多個短句接成一條序列（position_ids 在每句開頭歸零，注意力不跨句）
+- TokenBudgetBatchSampler：依長度分桶，每個 batch 的 (最長序列 × 條數) 不超過 max_tokens
+- PackedCollator：補齊長度，產生 labels、position_ids 與區塊對角的 4D causal mask
+- TokenBudgetTrainerMixin：讓 Trainer / SFTTrainer 改用上面的 sampler 與 collator
+  （IterableDataset 沒有長度資訊，改用一般的固定 batch，只保留 packing 與 collator）
+
+loss 仍是所有有效 token 的平均，與逐句訓練的學習訊號相同，只是每一步看到更多 token。
+"""
+import math
+import random
+
+import torch
+from torch.utils.data import Sampler, DataLoader
+
+
+def pack_examples(examples, max_length):
+    """
+    以 first-fit decreasing 把多個已 tokenize 的句子接成不超過 max_length 的序列
+    examples: {"input_ids": [[...], ...]}，可直接作為 datasets.map(batched=True) 的函式
+    回傳 {"input_ids", "seq_lens", "length"}；超過 max_length 的單句會被截斷
+    """
+    order = sorted(range(len(examples["input_ids"])), key=lambda i: len(examples["input_ids"][i]), reverse=True)
+    bins = []  # [[總長度, input_ids, seq_lens]]
+    for i in order:
+        ids = list(examples["input_ids"][i])[:max_length]
+        for b in bins:
+            if b[0] + len(ids) <= max_length:
+                b[0] += len(ids)
+                b[1].extend(ids)
+                b[2].append(len(ids))
+                break
+        else:
+            bins.append([len(ids), ids, [len(ids)]])
+    return {
+        "input_ids": [b[1] for b in bins],
+        "seq_lens": [b[2] for b in bins],
+        "length": [b[0] for b in bins],
+    }
+
+
+def pack_dataset(dataset, max_length, num_proc=None, window=2048):
+    """
+    對整個 datasets.Dataset 做 packing
+    每 window 筆一起打包（先依長度排序，讓同一個 window 內的短句彼此湊在一起）
+    IterableDataset 無法整體排序，直接以串流順序每 window 筆打包
+    """
+    from datasets import IterableDataset
+
+    if isinstance(dataset, IterableDataset):
+        return dataset.map(
+            pack_examples,
+            fn_kwargs={"max_length": max_length},
+            batched=True,
+            batch_size=window,
+            remove_columns=list(dataset.column_names or ["input_ids"]),
+        )
+
+    if "length" not in dataset.column_names:
+        dataset = dataset.map(lambda e: {"length": len(e["input_ids"])}, num_proc=num_proc, desc="Measuring")
+    dataset = dataset.sort("length")
+    return dataset.map(
+        pack_examples,
+        fn_kwargs={"max_length": max_length},
+        batched=True,
+        batch_size=window,
+        remove_columns=dataset.column_names,
+        num_proc=num_proc,
+        desc="Packing",
+    )
+
+
+class TokenBudgetBatchSampler(Sampler):
+    """
+    依長度分桶的 batch sampler
+    先把索引打散成數個 mega-bucket，桶內依長度排序後依 token 預算切成 batch。
+    切分結果（每個 batch 由哪些長度組成）只在建立時計算一次，batch 數因此每個 epoch 都相同，
+    Trainer 由 len() 算出的每 epoch 步數、LR schedule 與 --resume 的跳過位置才會正確；
+    每個 epoch（由 Trainer 呼叫 set_epoch）在長度相同的樣本之間重新分配，並打亂 batch 的順序
+    """
+
+    def __init__(self, lengths, max_tokens, max_batch_size=None, shuffle=True, seed=42, bucket_size=None):
+        self.lengths = list(lengths)
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.bucket_size = bucket_size or max(1, len(self.lengths) // 8) or 1
+        self.epoch = 0
+        if self.lengths and max(self.lengths) > max_tokens:
+            raise ValueError(f"最長的樣本 ({max(self.lengths)} tokens) 超過 max_tokens ({max_tokens})")
+        self._layout = self._build_layout()
+        # 長度 -> 該長度的所有索引，供每個 epoch 重新分配
+        self._by_length = {}
+        for i, length in enumerate(self.lengths):
+            self._by_length.setdefault(length, []).append(i)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _build_layout(self):
+        rng = random.Random(self.seed)
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(indices)
+
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = sorted(indices[start:start + self.bucket_size], key=lambda i: self.lengths[i])
+            batch, longest = [], 0
+            for i in bucket:
+                longest_if_added = max(longest, self.lengths[i])
+                full = self.max_batch_size is not None and len(batch) >= self.max_batch_size
+                if batch and (longest_if_added * (len(batch) + 1) > self.max_tokens or full):
+                    batches.append(batch)
+                    batch, longest_if_added = [], self.lengths[i]
+                batch.append(i)
+                longest = longest_if_added
+            if batch:
+                batches.append(batch)
+        return batches
+
+    def _batches(self, epoch):
+        if not self.shuffle:
+            return [list(batch) for batch in self._layout]
+
+        rng = random.Random(self.seed + epoch)
+        # 長度相同的樣本互換位置不影響任何 batch 的 token 數
+        mapping = {}
+        for group in self._by_length.values():
+            shuffled = list(group)
+            rng.shuffle(shuffled)
+            mapping.update(zip(group, shuffled))
+        batches = [[mapping[i] for i in batch] for batch in self._layout]
+        rng.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        return iter(self._batches(self.epoch))
+
+    def __len__(self):
+        return len(self._layout)
+
+
+class PackedCollator:
+    """
+    把 (可能含多句的) 序列補齊成 batch
+    - labels：padding 與每一句的第一個 token 設為 -100，不從前一句預測下一句的開頭
+    - position_ids：每句從 0 開始
+    - attention_mask：mask="4d" 時為區塊對角的加性 causal mask（eager / sdpa 適用）；
+      mask="position_ids" 時只回傳一般的 2D mask，交給 flash-attention 依 position_ids 切分
+    """
+
+    def __init__(self, pad_id, mask="4d", dtype=torch.float32, pad_to_multiple_of=8):
+        if mask not in ("4d", "position_ids"):
+            raise ValueError("mask 必須是 '4d' 或 'position_ids'")
+        self.pad_id = pad_id
+        self.mask = mask
+        self.dtype = dtype
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        longest = max(len(f["input_ids"]) for f in features)
+        if self.pad_to_multiple_of:
+            longest = math.ceil(longest / self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        batch_size = len(features)
+        input_ids = torch.full((batch_size, longest), self.pad_id, dtype=torch.long)
+        labels = torch.full((batch_size, longest), -100, dtype=torch.long)
+        position_ids = torch.zeros((batch_size, longest), dtype=torch.long)
+        segments = torch.full((batch_size, longest), -1, dtype=torch.long)
+        attention_mask = torch.zeros((batch_size, longest), dtype=torch.long)
+
+        for row, feature in enumerate(features):
+            ids = torch.as_tensor(feature["input_ids"], dtype=torch.long)
+            seq_lens = feature.get("seq_lens") or [len(ids)]
+            n = len(ids)
+            input_ids[row, :n] = ids
+            labels[row, :n] = ids
+            attention_mask[row, :n] = 1
+            offset = 0
+            for segment, seq_len in enumerate(seq_lens):
+                position_ids[row, offset:offset + seq_len] = torch.arange(seq_len)
+                segments[row, offset:offset + seq_len] = segment
+                if segment > 0:
+                    labels[row, offset] = -100
+                offset += seq_len
+
+        batch = {"input_ids": input_ids, "labels": labels, "position_ids": position_ids}
+        if self.mask == "position_ids":
+            batch["attention_mask"] = attention_mask
+            return batch
+
+        causal = torch.tril(torch.ones(longest, longest, dtype=torch.bool))
+        same_segment = segments[:, :, None] == segments[:, None, :]
+        allowed = same_segment & causal
+        mask = torch.zeros((batch_size, 1, longest, longest), dtype=self.dtype)
+        mask.masked_fill_(~allowed[:, None], torch.finfo(self.dtype).min)
+        batch["attention_mask"] = mask
+        return batch
+
+
+class TokenBudgetTrainerMixin:
+    """
+    放在 Trainer / SFTTrainer 前面的 mixin：訓練資料改用 TokenBudgetBatchSampler + PackedCollator
+    train_dataset 需有 input_ids 與 length 欄位（pack_dataset 的輸出）
+    """
+
+    def __init__(self, *args, max_tokens=4096, max_batch_size=None, packed_collator=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.packed_collator = packed_collator
+
+    def get_train_dataloader(self):
+        dataset = self.train_dataset
+        if not hasattr(dataset, "__len__"):
+            # 串流資料集：交給 Trainer 依 per_device_train_batch_size 組 batch（需傳入 data_collator 與 max_steps）
+            return super().get_train_dataloader()
+        batch_sampler = TokenBudgetBatchSampler(
+            dataset["length"],
+            max_tokens=self.max_tokens,
+            max_batch_size=self.max_batch_size,
+            seed=self.args.seed,
+        )
+        columns = [c for c in ("input_ids", "seq_lens") if c in dataset.column_names]
+        dataloader = DataLoader(
+            dataset.select_columns(columns),
+            batch_sampler=batch_sampler,
+            collate_fn=self.packed_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(dataloader)
@@ -0,0 +1,162 @@
+"""
+非同步的 adapter-only checkpoint
+Trainer 內建的 checkpoint 會在訓練迴圈中同步寫出整個 optimizer 狀態，步數很多時會拖慢訓練。
+AsyncCheckpointCallback 在存檔的那一步只把 LoRA 權重、optimizer / scheduler / GradScaler 與 RNG 狀態複製到 CPU，
+寫檔交給背景執行緒，訓練迴圈立即繼續。
+
+輸出的 checkpoint-<step>/ 與 Trainer 的格式相同（adapter_model.safetensors、optimizer.pt、scheduler.pt、
+rng_state.pth、trainer_state.json），可直接以 trainer.train(resume_from_checkpoint=...) 從該步續接。
+使用時需把 TrainingArguments 的 save_strategy 設為 "no"，避免 Trainer 再同步存一次。
+"""
+import os
+import copy
+import random
+import shutil
+import threading
+
+import numpy as np
+import torch
+from transformers import TrainerCallback
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR, get_last_checkpoint
+
+OPTIMIZER_NAME = "optimizer.pt"
+SCHEDULER_NAME = "scheduler.pt"
+SCALER_NAME = "scaler.pt"
+RNG_STATE_NAME = "rng_state.pth"
+TRAINER_STATE_NAME = "trainer_state.json"
+ADAPTER_WEIGHTS_NAME = "adapter_model.safetensors"
+
+
+def to_cpu(obj):
+    """遞迴地把 state_dict 內的 tensor 複製到 CPU（之後 GPU 上的原值繼續被更新也不受影響）"""
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+def rng_state():
+    """與 Trainer._save_rng_state 相同的格式"""
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "cpu": torch.random.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.random.get_rng_state_all()
+    return state
+
+
+def resolve_checkpoint(value, output_dir):
+    """--resume 的值：'latest' 取 output_dir 中步數最大的 checkpoint，否則視為路徑"""
+    if value in (None, "", "latest"):
+        checkpoint = get_last_checkpoint(output_dir) if os.path.isdir(output_dir) else None
+        if checkpoint is None and value == "latest":
+            raise FileNotFoundError(f"{output_dir} 中沒有 checkpoint")
+        return checkpoint
+    if not os.path.isdir(value):
+        raise FileNotFoundError(f"找不到 checkpoint: {value}")
+    return value
+
+
+class AsyncCheckpointCallback(TrainerCallback):
+    """
+    每 save_steps 步在背景寫出一次 adapter-only checkpoint
+    trainer 用來取得 accelerator 的 GradScaler（fp16）；同一時間最多只有一個寫檔工作，
+    上一個還沒寫完時會先等它完成，CPU 記憶體中最多保留兩份快照
+    """
+
+    def __init__(self, trainer, save_steps, save_total_limit=None, output_dir=None):
+        self.trainer = trainer
+        self.save_steps = save_steps
+        self.save_total_limit = save_total_limit
+        self.output_dir = output_dir
+        self._thread = None
+        self._error = None
+
+    def _snapshot(self, args, state, model, optimizer, lr_scheduler):
+        from peft import get_peft_model_state_dict
+
+        adapter_name = model.active_adapter
+        if isinstance(adapter_name, (list, tuple)):
+            adapter_name = adapter_name[0]
+        snapshot = {
+            "step": state.global_step,
+            "adapter": to_cpu(get_peft_model_state_dict(model, adapter_name=adapter_name)),
+            "peft_config": copy.deepcopy(model.peft_config[adapter_name]),
+            "optimizer": to_cpu(optimizer.state_dict()),
+            "scheduler": copy.deepcopy(lr_scheduler.state_dict()) if lr_scheduler is not None else None,
+            "rng": rng_state(),
+            "trainer_state": copy.deepcopy(state),
+        }
+        scaler = getattr(getattr(self.trainer, "accelerator", None), "scaler", None)
+        if scaler is not None:
+            snapshot["scaler"] = to_cpu(scaler.state_dict())
+        return snapshot
+
+    def _write(self, snapshot, output_dir):
+        from safetensors.torch import save_file
+
+        final_dir = os.path.join(output_dir, f"{PREFIX_CHECKPOINT_DIR}-{snapshot['step']}")
+        # 先寫到暫存目錄，完整寫完才改名，中斷時不會留下半個 checkpoint
+        tmp_dir = final_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        save_file(snapshot["adapter"], os.path.join(tmp_dir, ADAPTER_WEIGHTS_NAME), metadata={"format": "pt"})
+        snapshot["peft_config"].save_pretrained(tmp_dir)
+        torch.save(snapshot["optimizer"], os.path.join(tmp_dir, OPTIMIZER_NAME))
+        if snapshot["scheduler"] is not None:
+            torch.save(snapshot["scheduler"], os.path.join(tmp_dir, SCHEDULER_NAME))
+        if "scaler" in snapshot:
+            torch.save(snapshot["scaler"], os.path.join(tmp_dir, SCALER_NAME))
+        torch.save(snapshot["rng"], os.path.join(tmp_dir, RNG_STATE_NAME))
+        snapshot["trainer_state"].save_to_json(os.path.join(tmp_dir, TRAINER_STATE_NAME))
+
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+        self._rotate(output_dir)
+
+    def _rotate(self, output_dir):
+        if not self.save_total_limit:
+            return
+        prefix = PREFIX_CHECKPOINT_DIR + "-"
+        steps = sorted(
+            int(name[len(prefix):]) for name in os.listdir(output_dir)
+            if name.startswith(prefix) and name[len(prefix):].isdigit()
+        )
+        for step in steps[:-self.save_total_limit]:
+            shutil.rmtree(os.path.join(output_dir, f"{prefix}{step}"), ignore_errors=True)
+
+    def _run(self, snapshot, output_dir):
+        try:
+            self._write(snapshot, output_dir)
+        except Exception as e:
+            self._error = e
+
+    def wait(self):
+        """等待背景寫檔完成；寫檔失敗時在訓練執行緒拋出"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"checkpoint 寫入失敗: {error}") from error
+
+    def save(self, args, state, model, optimizer, lr_scheduler):
+        self.wait()
+        snapshot = self._snapshot(args, state, model, optimizer, lr_scheduler)
+        output_dir = self.output_dir or args.output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, args=(snapshot, output_dir), daemon=True)
+        self._thread.start()
+
+    def on_step_end(self, args, state, control, model=None, optimizer=None, lr_scheduler=None, **kwargs):
+        if self.save_steps and state.global_step % self.save_steps == 0 and state.is_world_process_zero:
+            self.save(args, state, model, optimizer, lr_scheduler)
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.wait()
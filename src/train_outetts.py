@@ -1,242 +1,386 @@
 # scripts/train_outetts.py
+"""
+OuteTTS LoRA 訓練
+訓練參數讀取自 training_configs/config_sft.yaml，LoRA 參數讀取自 training_configs/config_lora.json，
+命令列參數可再覆寫。torch / transformers / peft / trl / outetts 只在真正開始訓練時才 import，
+--help 與 --dry-run（只檢查設定與 token store）不需要載入任何框架。
+
+    python src/train_outetts.py                       # 或 python UEP_TTS.py train
+    python src/train_outetts.py --resume              # 從最新的 checkpoint 續接
+    python src/train_outetts.py --continue-from outputs/lora_model --output outputs/lora_model_v2
+"""
 import os
-import torch
-from datasets import load_dataset, Audio
-from transformers import AutoTokenizer, BitsAndBytesConfig, AutoModelForCausalLM, TrainingArguments
-from peft import LoraConfig, get_peft_model, PeftModel
-from trl import SFTTrainer
-from outetts import Interface, GenerationConfig, Backend, GenerationType, SamplerConfig
-import outetts
+import json
+import argparse
 
 # 設定本地模型路徑
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-model_dir = os.path.join(base_dir, "models", "Llama-OuteTTS-1.0-1B")
+CONFIG_DIR = os.path.join(base_dir, "training_configs")
+DEFAULT_SFT_CONFIG = os.path.join(CONFIG_DIR, "config_sft.yaml")
+DEFAULT_LORA_CONFIG = os.path.join(CONFIG_DIR, "config_lora.json")
 
-# ========== 續接訓練設定 ==========
-CONTINUE_TRAINING = False  # 設為 True 來續接之前的訓練
-ADAPTER_PATH = os.path.join(base_dir, "outputs", "lora_model")  # 之前訓練的adapter路徑
-NEW_OUTPUT_DIR = os.path.join(base_dir, "outputs", "lora_model_v2")  # 新的輸出目錄
+# config_sft.yaml 的預設值；路徑為相對於專案根目錄
+DEFAULT_TRAINING_CONFIG = {
+    "model_dir": "models/Llama-OuteTTS-1.0-1B",
+    "token_store": "data/token_store",
+    "dataset": "data/dataset.json",
+    "output_dir": "outputs/lora_model",
+    # 以之前訓練完成的 adapter 為起點（中斷後續接請用 --resume）
+    "continue_from": None,
 
-print(f"Loading model from local path: {model_dir}")
-if CONTINUE_TRAINING and os.path.exists(ADAPTER_PATH):
-    print(f"Continuing training from adapter: {ADAPTER_PATH}")
-else:
-    print("Starting fresh training")
+    "learning_rate": 5e-6,
+    "num_train_epochs": 10,
+    "gradient_accumulation_steps": None,  # None：token 預算模式為 1，否則為 4
+    "warmup_steps": 100,
+    "logging_steps": 100,
+    "save_steps": 500,  # 由 AsyncCheckpointCallback 在背景寫出 checkpoint
+    "save_total_limit": 2,  # 只保留最新的 2 個 checkpoint
+    "fp16": True,
+    "dataloader_num_workers": 0,  # Windows 建議設為 0
+    "seed": 42,
 
-# 1. 載入和處理 dataset
-print("Loading and processing dataset...")
+    # 依長度分桶並以 token 預算組 batch，短句會被打包成一條序列
+    "use_token_budget": True,
+    "max_tokens_per_batch": 4096,
+    "pack_max_length": 2048,  # 約 13 秒的音訊 token
+    "prompt_num_proc": None,  # None 為 CPU 核心數的一半
+
+    # 資料量很大時改用 IterableDataset，訓練時才逐筆組 prompt；沒有長度，需以步數指定訓練長度
+    "streaming": False,
+    "streaming_max_steps": 20000,
+
+    # 訓練完成後以 adapter 生成一段測試語音
+    "sample_text": "Oh my gosh, stories are just the best! They whisk you away to different worlds and "
+                   "introduce you to amazing characters. The emotions, the adventures... I just love getting lost in them!",
+    "sample_speaker": "uep_speaker",
+    "sample_output": "outputs/samples/test.wav",
+}
+
+DEFAULT_LORA_SETTINGS = {
+    "r": 32,
+    "lora_alpha": 32,
+    "target_modules": ["q_proj", "v_proj", "k_proj", "o_proj"],
+    "lora_dropout": 0.1,
+    "bias": "none",
+    "task_type": "CAUSAL_LM",
+}
+
+PATH_KEYS = ("model_dir", "token_store", "dataset", "output_dir", "continue_from", "sample_output")
+
+
+def resolve_path(path):
+    """設定檔中的相對路徑以專案根目錄為基準"""
+    if path is None or os.path.isabs(path):
+        return path
+    return os.path.normpath(os.path.join(base_dir, path))
+
+
+def load_training_config(sft_path=DEFAULT_SFT_CONFIG, lora_path=DEFAULT_LORA_CONFIG, overrides=None):
+    """讀取兩個設定檔並套用覆寫值，回傳 (訓練設定, LoRA 設定)；未知的鍵視為錯誤，避免打錯字被默默忽略"""
+    config = dict(DEFAULT_TRAINING_CONFIG)
+    if sft_path and os.path.exists(sft_path):
+        import yaml
+
+        with open(sft_path, "r", encoding="utf-8") as f:
+            loaded = yaml.safe_load(f) or {}
+        unknown = set(loaded) - set(config)
+        if unknown:
+            raise ValueError(f"{sft_path} 中有未知的設定: {', '.join(sorted(unknown))}")
+        config.update(loaded)
+    config.update({k: v for k, v in (overrides or {}).items() if v is not None})
+    for key in PATH_KEYS:
+        config[key] = resolve_path(config[key])
+
+    lora = dict(DEFAULT_LORA_SETTINGS)
+    if lora_path and os.path.exists(lora_path):
+        with open(lora_path, "r", encoding="utf-8") as f:
+            lora.update(json.load(f))
+    return config, lora
+
+
+def check_token_store(config):
+    """1. 檢查 token store；音訊已由 src/prepare_data.py 預先編碼，這裡不再解碼或重採樣 wav"""
+    from token_store import TokenStore
+
+    store = TokenStore(config["token_store"]) if os.path.isdir(config["token_store"]) else None
+    if not store:
+        raise SystemExit(f"❌ token store 是空的: {config['token_store']}\n請先執行: python UEP_TTS.py prepare")
+    print(f"Token store: {len(store)} samples")
+    return store
 
-# 先創建正確格式的數據集
-import json
 
-# 讀取原始JSON數組
-with open(os.path.join(base_dir, "data", "dataset.json"), "r", encoding="utf-8-sig") as f:
-    original_data = json.load(f)
-
-# 轉換為正確格式並修正路徑
-processed_data = []
-for item in original_data:
-    # 修正音頻路徑
-    audio_path = item["audio"].replace("...", base_dir.replace("\\", "/"))
-    audio_path = os.path.normpath(audio_path)
-    
-    processed_item = {
-        "audio": audio_path,
-        "text": item["transcript"]  # 改為 'text' 欄位，更符合標準
-    }
-    processed_data.append(processed_item)
-
-# 創建臨時的JSONL格式文件
-temp_dataset_path = os.path.join(base_dir, "data", "temp_dataset.jsonl")
-with open(temp_dataset_path, "w", encoding="utf-8") as f:
-    for item in processed_data:
-        f.write(json.dumps(item, ensure_ascii=False) + "\n")
-
-print(f"Processed {len(processed_data)} samples")
-
-# 載入處理後的數據集
-ds = load_dataset("json", data_files=temp_dataset_path, split="train")
-ds = ds.cast_column("audio", Audio(sampling_rate=24000))
-
-# 2. 從本地載入 Tokenizer & Base Model 與量化設置
-bnb_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_use_double_quant=True,
-    bnb_4bit_compute_dtype=torch.float16  # 使用 torch.float16 而不是字串
-)
-
-# 從本地載入
-tokenizer = AutoTokenizer.from_pretrained(
-    model_dir, 
-    trust_remote_code=True,
-    local_files_only=True  # 確保只使用本地文件
-)
-model = AutoModelForCausalLM.from_pretrained(
-    model_dir,
-    quantization_config=bnb_config,
-    device_map="auto",
-    trust_remote_code=True,
-    local_files_only=True,  # 確保只使用本地文件
-    torch_dtype=torch.float16
-)
-
-# 確保模型有 pad_token
-if tokenizer.pad_token is None:
-    tokenizer.pad_token = tokenizer.eos_token
-
-# 3. LoRA Adapter 設定和載入
-if CONTINUE_TRAINING and os.path.exists(ADAPTER_PATH):
-    print("Loading existing adapter for continued training...")
-    # 載入已訓練的adapter
-    model = PeftModel.from_pretrained(model, ADAPTER_PATH)
-    # 獲取當前的LoRA配置
-    lora_config = model.peft_config['default']
-    print(f"Loaded adapter with r={lora_config.r}, alpha={lora_config.lora_alpha}")
-else:
-    print("Creating new LoRA adapter...")
-    # 創建新的LoRA配置
-    lora_config = LoraConfig(
-        r=32, # 增加 r 值提升效果
-        lora_alpha=32,  # 增加 alpha 值提升效果
-        target_modules=["q_proj", "v_proj", "k_proj", "o_proj"],  # 增加更多目標模組
-        lora_dropout=0.1,
-        bias="none",
-        task_type="CAUSAL_LM"
+def load_model(config, lora_settings):
+    """2~3. 從本地載入 Tokenizer & 4-bit Base Model，並建立或載入 LoRA adapter"""
+    import torch
+    from transformers import AutoTokenizer, BitsAndBytesConfig, AutoModelForCausalLM
+    from peft import LoraConfig, get_peft_model, PeftModel
+
+    model_dir = config["model_dir"]
+    print(f"Loading model from local path: {model_dir}")
+    bnb_config = BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_use_double_quant=True,
+        bnb_4bit_compute_dtype=torch.float16  # 使用 torch.float16 而不是字串
     )
-    model = get_peft_model(model, lora_config)
-
-# 4. 訓練參數設定 - 使用 TrainingArguments
-training_args = TrainingArguments(
-    output_dir=os.path.join(base_dir, "outputs", "lora_model"),  # 使用絕對路徑
-    learning_rate=5e-6,
-    per_device_train_batch_size=1,
-    gradient_accumulation_steps=4,  # 增加有效 batch size
-    num_train_epochs=10,
-    save_steps=500,
-    logging_steps=100,
-    warmup_steps=100,
-    dataloader_num_workers=0,  # Windows 建議設為 0
-    fp16=True,  # 啟用混合精度
-    report_to=None,  # 關閉 wandb 等報告
-    save_total_limit=2,  # 只保留最新的 2 個 checkpoint
-    remove_unused_columns=False,  # 保留音頻欄位
-    max_steps=-1,  # 使用 epochs 而不是 steps
-)
-
-# 數據預處理 - 為SFTTrainer準備文本格式
-def format_dataset(examples):
-    """將數據格式化為SFTTrainer期望的格式"""
-    texts = examples['text']
-    # 為OuteTTS格式化文本
-    formatted_texts = []
-    for text in texts:
-        # 簡單的格式化，實際可能需要更複雜的處理
-        formatted_text = f"<|text|>{text}<|audio|>"
-        formatted_texts.append(formatted_text)
-    
-    return {"text": formatted_texts}
-
-# 格式化數據集
-print("Formatting dataset for training...")
-formatted_ds = ds.map(
-    format_dataset, 
-    batched=True, 
-    remove_columns=[col for col in ds.column_names if col != 'text'],  # 只保留audio和處理後的text
-    desc="Formatting"
-)
-
-# 5. 建立 Trainer 並訓練
-trainer = SFTTrainer(
-    model=model,
-    train_dataset=formatted_ds,  # 使用格式化的數據集
-    args=training_args,
-    processing_class=tokenizer,  # 使用 processing_class 而不是 tokenizer
-    peft_config=lora_config,  # 添加 peft_config
-)
-
-print("Starting training...")
-trainer.train()
-
-# 儲存模型
-print("Saving model...")
-output_path = os.path.join(base_dir, "outputs", "lora_model")
-os.makedirs(output_path, exist_ok=True)
-
-try:
-    # 使用trainer的save_model方法
-    trainer.save_model(output_path)
-    print(f"✅ Trainer model saved to: {output_path}")
-except Exception as e:
-    print(f"❌ Trainer save failed: {e}")
-
-try:
-    # 單獨保存adapter權重
-    if hasattr(model, 'save_pretrained'):
-        model.save_pretrained(output_path)
-        print(f"✅ PEFT adapter saved to: {output_path}")
-except Exception as e:
-    print(f"❌ PEFT save failed: {e}")
-
-try:
-    # 保存tokenizer
-    tokenizer.save_pretrained(output_path)
-    print(f"✅ Tokenizer saved to: {output_path}")
-except Exception as e:
-    print(f"❌ Tokenizer save failed: {e}")
-
-# 檢查保存的文件
-saved_files = [f for f in os.listdir(output_path) if f.endswith(('.bin', '.safetensors', '.json'))]
-print(f"📁 Saved files: {saved_files}")
-
-print(f"Training completed! Check: {output_path}")
-
-# 6. 測試生成（可選）
-try:
-    print("Testing generation with trained adapter...")
-    
-    # 確保輸出目錄存在
-    os.makedirs("../outputs/samples", exist_ok=True)
-    
-    # 使用本地模型和訓練好的 adapter
-    interface = Interface(
-        config=outetts.ModelConfig(
-            model_path=model_dir,
-            tokenizer_path=model_dir,
-            interface_version=outetts.InterfaceVersion.V3,
-            backend=outetts.Backend.HF,
-            # adapter_path="outputs/lora_model"  # 如果 OuteTTS 支援 adapter 載入
-        )
+
+    # 從本地載入
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_dir,
+        trust_remote_code=True,
+        local_files_only=True  # 確保只使用本地文件
+    )
+    model = AutoModelForCausalLM.from_pretrained(
+        model_dir,
+        quantization_config=bnb_config,
+        device_map="auto",
+        trust_remote_code=True,
+        local_files_only=True,  # 確保只使用本地文件
+        torch_dtype=torch.float16
     )
-    
-    # 載入說話者
-    if os.path.exists("../speaker/uep_speaker.json"):
-        speaker = interface.load_speaker("../speaker/uep_speaker.json")
+
+    # 確保模型有 pad_token
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    adapter_path = config["continue_from"]
+    if adapter_path and os.path.exists(adapter_path):
+        print(f"Loading existing adapter for continued training: {adapter_path}")
+        # 載入已訓練的adapter
+        model = PeftModel.from_pretrained(model, adapter_path, is_trainable=True)
+        # 獲取當前的LoRA配置
+        lora_config = model.peft_config['default']
+        print(f"Loaded adapter with r={lora_config.r}, alpha={lora_config.lora_alpha}")
     else:
-        # 使用預設說話者
-        speaker = interface.load_default_speaker("EN-FEMALE-1-NEUTRAL")
-    
-    # 生成測試語音
-    output = interface.generate(
-        config=GenerationConfig(
-        text="Oh my gosh, stories are just the best! They whisk you away to different worlds and introduce you to amazing characters. The emotions, the adventures... I just love getting lost in them!",
-        generation_type=GenerationType.CHUNKED,
-        speaker=speaker,
-        sampler_config=SamplerConfig(
-            temperature=0.4,
-            repetition_penalty=1.1,
-            # 重要 Sampling 設定，OuteTTS‑1.0 要限制在 64-token recent window 才能避免破音 :contentReference[oaicite:1]{index=1}
-            repetition_range=64,
-            top_k=40,
-            top_p=0.9,
-            min_p=0.05
-        ),
+        print("Creating new LoRA adapter...")
+        lora_config = LoraConfig(**lora_settings)
+        model = get_peft_model(model, lora_config)
+    return tokenizer, model, lora_config
+
+
+def build_training_args(config):
+    """4. 訓練參數設定 - 使用 TrainingArguments"""
+    from transformers import TrainingArguments
+
+    streaming = config["streaming"]
+    accumulation = config["gradient_accumulation_steps"]
+    if accumulation is None:
+        # token 預算模式下一個 batch 已包含許多句子，不需要再累積梯度
+        accumulation = 1 if config["use_token_budget"] else 4
+    return TrainingArguments(
+        output_dir=config["output_dir"],
+        learning_rate=config["learning_rate"],
+        # 串流時無法依長度分桶，固定每個 batch 放 max_tokens_per_batch // pack_max_length 條打包後的序列
+        per_device_train_batch_size=max(1, config["max_tokens_per_batch"] // config["pack_max_length"]) if streaming else 1,
+        gradient_accumulation_steps=accumulation,
+        num_train_epochs=config["num_train_epochs"],
+        save_steps=config["save_steps"],
+        save_strategy="no",  # checkpoint 由 AsyncCheckpointCallback 負責
+        logging_steps=config["logging_steps"],
+        warmup_steps=config["warmup_steps"],
+        dataloader_num_workers=config["dataloader_num_workers"],
+        fp16=config["fp16"],  # 啟用混合精度
+        report_to=None,  # 關閉 wandb 等報告
+        save_total_limit=config["save_total_limit"],
+        remove_unused_columns=False,
+        seed=config["seed"],
+        max_steps=config["streaming_max_steps"] if streaming else -1,  # 非串流時使用 epochs 而不是 steps
     )
+
+
+def build_trainer(config, model, tokenizer, lora_config, training_args):
+    """數據預處理與 5. 建立 Trainer"""
+    import torch
+    from training_prompts import prepare_training_dataset
+
+    # 組出完整的 OuteTTS v3 訓練 prompt（文字 + 逐字時間 / 特徵 + c1/c2 codebook token）
+    # 結果快取在 data/prompt_cache/，token store 沒有變動時直接讀取
+    print("Building v3 training prompts...")
+    streaming = config["streaming"]
+    if streaming:
+        from training_prompts import stream_training_dataset
+
+        formatted_ds = stream_training_dataset(config["token_store"], tokenizer_path=config["model_dir"])
+        formatted_ds = formatted_ds.shuffle(seed=training_args.seed, buffer_size=10000)
+    else:
+        formatted_ds = prepare_training_dataset(
+            config["token_store"],
+            tokenizer_path=config["model_dir"] if config["use_token_budget"] else None,
+            num_proc=config["prompt_num_proc"],
+        )
+        print(f"Loaded {len(formatted_ds)} samples")
+
+    if config["use_token_budget"] or streaming:
+        from transformers import Trainer
+        from train_batching import pack_dataset, PackedCollator, TokenBudgetTrainerMixin
+
+        # 資料已經 tokenize 並打包，model 也已套用 LoRA，直接使用 Trainer（避免 SFTTrainer 再次截斷序列）
+        class TokenBudgetTrainer(TokenBudgetTrainerMixin, Trainer):
+            pass
+
+        print("Packing dataset...")
+        tokenized_ds = formatted_ds.select_columns(["input_ids"])
+        packed_ds = pack_dataset(tokenized_ds, config["pack_max_length"])
+        if not streaming:
+            print(f"Packed {len(tokenized_ds)} samples into {len(packed_ds)} sequences")
+
+        collator = PackedCollator(tokenizer.pad_token_id, dtype=torch.float16)
+        return TokenBudgetTrainer(
+            model=model,
+            train_dataset=packed_ds,
+            args=training_args,
+            processing_class=tokenizer,
+            data_collator=collator,
+            max_tokens=config["max_tokens_per_batch"],
+            packed_collator=collator,
+        )
+
+    from trl import SFTTrainer
+
+    return SFTTrainer(
+        model=model,
+        train_dataset=formatted_ds.select_columns(["text"]),  # 使用格式化的數據集
+        args=training_args,
+        processing_class=tokenizer,  # 使用 processing_class 而不是 tokenizer
+        peft_config=lora_config,  # 添加 peft_config
     )
-    
-    output.save("../outputs/samples/test.wav")
-    print("Sample output saved to outputs/samples/test.wav")
-    
-except Exception as e:
-    print(f"Generation test failed: {e}")
-    print("Training completed successfully, but generation test skipped.")
+
+
+def save_outputs(trainer, model, tokenizer, output_path):
+    """儲存 adapter 與 tokenizer"""
+    print("Saving model...")
+    os.makedirs(output_path, exist_ok=True)
+
+    try:
+        # 使用trainer的save_model方法
+        trainer.save_model(output_path)
+        print(f"✅ Trainer model saved to: {output_path}")
+    except Exception as e:
+        print(f"❌ Trainer save failed: {e}")
+
+    try:
+        # 單獨保存adapter權重
+        if hasattr(model, 'save_pretrained'):
+            model.save_pretrained(output_path)
+            print(f"✅ PEFT adapter saved to: {output_path}")
+    except Exception as e:
+        print(f"❌ PEFT save failed: {e}")
+
+    try:
+        # 保存tokenizer
+        tokenizer.save_pretrained(output_path)
+        print(f"✅ Tokenizer saved to: {output_path}")
+    except Exception as e:
+        print(f"❌ Tokenizer save failed: {e}")
+
+    # 檢查保存的文件
+    saved_files = [f for f in os.listdir(output_path) if f.endswith(('.bin', '.safetensors', '.json'))]
+    print(f"📁 Saved files: {saved_files}")
+
+
+def generate_sample(config):
+    """6. 以剛訓練好的 adapter 生成測試語音（可選）"""
+    try:
+        print("Testing generation with trained adapter...")
+        from tts_engine import TTSEngine
+        from adapters import AdapterManager
+
+        engine = TTSEngine(config["model_dir"])
+        AdapterManager(engine).load("trained", config["output_dir"])
+        speaker = config["sample_speaker"] if engine._resolve_speaker_path(config["sample_speaker"]) else "EN-FEMALE-1-NEUTRAL"
+        output = engine.generate(
+            config["sample_text"],
+            speaker=speaker,
+            sampler={
+                "temperature": 0.4,
+                "repetition_penalty": 1.1,
+                # 重要 Sampling 設定，OuteTTS‑1.0 要限制在 64-token recent window 才能避免破音
+                "repetition_range": 64,
+                "top_k": 40,
+                "top_p": 0.9,
+                "min_p": 0.05,
+            },
+            adapter="trained",
+        )
+        os.makedirs(os.path.dirname(config["sample_output"]), exist_ok=True)
+        output.save(config["sample_output"])
+        print(f"Sample output saved to {config['sample_output']}")
+    except Exception as e:
+        print(f"Generation test failed: {e}")
+        print("Training completed successfully, but generation test skipped.")
+
+
+def train(config, lora_settings, resume=None, sample=True):
+    """完整的訓練流程；resume 為 checkpoint 目錄或 'latest'"""
+    from train_checkpoints import AsyncCheckpointCallback, resolve_checkpoint
+
+    check_token_store(config)
+    # 先確認 checkpoint 存在，再花時間載入模型
+    resume_checkpoint = resolve_checkpoint(resume, config["output_dir"]) if resume else None
+
+    tokenizer, model, lora_config = load_model(config, lora_settings)
+    training_args = build_training_args(config)
+    trainer = build_trainer(config, model, tokenizer, lora_config, training_args)
+
+    # adapter-only checkpoint 在背景執行緒寫出，不阻塞訓練迴圈
+    trainer.add_callback(AsyncCheckpointCallback(
+        trainer,
+        save_steps=training_args.save_steps,
+        save_total_limit=training_args.save_total_limit,
+    ))
+    if resume_checkpoint:
+        print(f"Resuming from checkpoint: {resume_checkpoint}")
+
+    print("Starting training...")
+    trainer.train(resume_from_checkpoint=resume_checkpoint)
+
+    save_outputs(trainer, model, tokenizer, config["output_dir"])
+    print(f"Training completed! Check: {config['output_dir']}")
+
+    if sample:
+        generate_sample(config)
+    return config["output_dir"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OuteTTS LoRA 訓練")
+    parser.add_argument("--config", default=DEFAULT_SFT_CONFIG, help="訓練設定（YAML）")
+    parser.add_argument("--lora-config", default=DEFAULT_LORA_CONFIG, help="LoRA 設定（JSON）")
+    # --resume：從 checkpoint 的那一步續接（LoRA 權重、optimizer、scheduler、RNG 都會還原）
+    # --continue-from：以訓練完成的 adapter 為起點開始新的訓練（步數與 optimizer 從頭開始）
+    parser.add_argument("--resume", nargs="?", const="latest", default=None,
+                        help="續接的 checkpoint 目錄，不指定路徑時使用 output_dir 中最新的 checkpoint")
+    parser.add_argument("--continue-from", default=None, help="作為起點的 adapter 目錄")
+    parser.add_argument("--output", default=None, help="覆寫設定檔中的 output_dir")
+    parser.add_argument("--epochs", type=float, default=None, help="覆寫設定檔中的 num_train_epochs")
+    parser.add_argument("--learning-rate", type=float, default=None, help="覆寫設定檔中的 learning_rate")
+    parser.add_argument("--streaming", action="store_true", default=None, help="改用 IterableDataset 串流訓練")
+    parser.add_argument("--no-sample", action="store_true", help="訓練完成後不生成測試語音")
+    parser.add_argument("--dry-run", action="store_true", help="只印出合併後的設定並檢查 token store，不載入模型")
+    args = parser.parse_args(argv)
+
+    config, lora_settings = load_training_config(args.config, args.lora_config, {
+        "continue_from": args.continue_from,
+        "output_dir": args.output,
+        "num_train_epochs": args.epochs,
+        "learning_rate": args.learning_rate,
+        "streaming": args.streaming,
+    })
+
+    if args.dry_run:
+        print(json.dumps({"training": config, "lora": lora_settings}, ensure_ascii=False, indent=2))
+        check_token_store(config)
+        if args.resume:
+            from train_checkpoints import resolve_checkpoint
+            print(f"Resume checkpoint: {resolve_checkpoint(args.resume, config['output_dir'])}")
+        return
+
+    if config["continue_from"]:
+        print(f"Continuing training from adapter: {config['continue_from']}")
+    else:
+        print("Starting fresh training")
+    train(config, lora_settings, resume=args.resume, sample=not args.no_sample)
+
+
+if __name__ == "__main__":
+    main()
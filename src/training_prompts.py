@@ -0,0 +1,126 @@
+"""
+OuteTTS v3 訓練 prompt
+從 token store 讀出每筆資料的文字、逐字時間、特徵與 c1/c2 codebook token，
+組成與 speaker/uep_speaker.json 相同結構的 dict，再以 PromptProcessor.get_training_prompt 產生完整 prompt：
+
+    <|im_start|>\\n<|text_start|>{text}<|text_end|>\\n<|audio_start|>\\n<|global_features_start|>...
+    <|word_start|>{word}<|features|><|t_0.32|>...<|code|><|c1_..|><|c2_..|>...<|word_end|>
+    ...
+    <|audio_end|>\\n<|im_end|>\\n
+
+以 datasets.map(batched=True, num_proc=N) 平行處理，結果依 token store 內容的雜湊快取在磁碟上，
+token store 沒有變動時直接讀取快取。
+資料量大到不適合整份寫成快取時，stream_training_dataset 改以 IterableDataset 逐筆產生 prompt。
+"""
+import os
+import hashlib
+
+from token_store import TokenStore
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_DIR = os.path.join(base_dir, "data", "prompt_cache")
+
+# prompt 格式改變時遞增，讓舊快取失效
+PROMPT_VERSION = 1
+
+# 每個 worker process 各自開啟一次 token store / tokenizer
+_worker_state = {}
+
+
+def _state(store_dir, tokenizer_path):
+    key = (store_dir, tokenizer_path)
+    if key not in _worker_state:
+        from outetts.version.v3.prompt_processor import PromptProcessor
+
+        # 只用到字串組裝，不需要載入 tokenizer
+        processor = PromptProcessor(None)
+        tokenizer = None
+        if tokenizer_path:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+        _worker_state[key] = (TokenStore(store_dir), processor, tokenizer)
+    return _worker_state[key]
+
+
+def build_training_prompts(examples, store_dir, tokenizer_path=None):
+    """datasets.map(batched=True) 用：examples["key"] -> {"text": prompt, ("input_ids")}"""
+    store, processor, tokenizer = _state(store_dir, tokenizer_path)
+    prompts = [processor.get_training_prompt(store.get(key)) for key in examples["key"]]
+    output = {"text": prompts}
+    if tokenizer is not None:
+        output["input_ids"] = tokenizer(prompts, add_special_tokens=False)["input_ids"]
+    return output
+
+
+def store_fingerprint(store_dir, tokenizer_path=None):
+    """token store 的 index 內容 + tokenizer 路徑 + prompt 版本"""
+    digest = hashlib.sha1(f"v{PROMPT_VERSION}:{tokenizer_path}".encode("utf-8"))
+    with open(os.path.join(store_dir, "index.json"), "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def prepare_training_dataset(store_dir, tokenizer_path=None, num_proc=None, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    回傳含 "text"（完整 v3 prompt）的 datasets.Dataset；指定 tokenizer_path 時另含 "input_ids"
+    num_proc 預設為 CPU 核心數的一半（Windows 上 datasets 的多行程需要 spawn，仍可正常運作）
+    """
+    from datasets import Dataset
+
+    store = TokenStore(store_dir)
+    if len(store) == 0:
+        raise ValueError(f"token store 是空的: {store_dir}")
+
+    if num_proc is None:
+        num_proc = max(1, (os.cpu_count() or 2) // 2)
+    records = store.records()
+    num_proc = max(1, min(num_proc, len(records) // 64 or 1))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, f"prompts-{store_fingerprint(store_dir, tokenizer_path)}.arrow")
+
+    ds = Dataset.from_list(records)
+    return ds.map(
+        build_training_prompts,
+        batched=True,
+        batch_size=256,
+        num_proc=num_proc,
+        fn_kwargs={"store_dir": store_dir, "tokenizer_path": tokenizer_path},
+        cache_file_name=cache_file,
+        load_from_cache_file=True,
+        desc="Building v3 prompts",
+    )
+
+
+def iter_training_prompts(store_dir, tokenizer_path=None, keys=None, shards=None):
+    """
+    逐筆 yield {"text", ("input_ids")}，供 IterableDataset.from_generator 使用
+    shards：key 分片的 list（datasets 會把 list 型態的 gen_kwargs 分給各個分片，每次呼叫拿到其中幾份）
+    """
+    store, processor, tokenizer = _state(store_dir, tokenizer_path)
+    if shards is not None:
+        keys = [key for shard in shards for key in shard]
+    for key in keys if keys is not None else store.keys():
+        prompt = processor.get_training_prompt(store.get(key))
+        example = {"text": prompt}
+        if tokenizer is not None:
+            example["input_ids"] = tokenizer(prompt, add_special_tokens=False)["input_ids"]
+        yield example
+
+
+def stream_training_dataset(store_dir, tokenizer_path=None, num_shards=None):
+    """
+    回傳 datasets.IterableDataset，訓練時才逐筆組 prompt，不寫入磁碟快取
+    keys 切成 num_shards 份，讓 .shuffle() 能打亂分片順序、DataLoader 的多個 worker 各讀一份
+    """
+    from datasets import IterableDataset
+
+    keys = TokenStore(store_dir).keys()
+    if not keys:
+        raise ValueError(f"token store 是空的: {store_dir}")
+    num_shards = max(1, min(num_shards or os.cpu_count() or 1, len(keys)))
+    shards = [keys[i::num_shards] for i in range(num_shards)]
+    return IterableDataset.from_generator(
+        iter_training_prompts,
+        gen_kwargs={"store_dir": store_dir, "tokenizer_path": tokenizer_path, "shards": shards},
+    )
@@ -0,0 +1,289 @@
+"""
+常駐 TTS 引擎
+模型只載入一次，speaker 載入後保留在記憶體中，供伺服器與各測試腳本重複使用。
+"""
+import os
+import io
+import wave
+import threading
+import contextlib
+
+from speaker_format import load_speaker, BINARY_EXT
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL_DIR = os.path.join(base_dir, "models", "Llama-OuteTTS-1.0-1B")
+DEFAULT_SPEAKER_DIR = os.path.join(base_dir, "speaker")
+DEFAULT_SPEAKER = "EN-FEMALE-1-NEUTRAL"
+
+# hf-int8: HF 模型在 CPU 上做 int8 dynamic quantization；llamacpp: GGUF 模型（見 quantize_model.py）
+BACKENDS = ("hf", "hf-int8", "llamacpp")
+
+
+def prompt_safe_speaker(speaker):
+    """
+    outetts 的 get_completion_prompt 會直接在最後一個字後面加上分隔符，
+    重複使用同一個 speaker dict 會讓分隔符越疊越多，因此每次生成都給一份淺拷貝
+    """
+    if speaker is None:
+        return None
+    words = list(speaker["words"])
+    if words:
+        words[-1] = dict(words[-1])
+    return dict(speaker, words=words)
+
+
+def audio_to_pcm16(audio):
+    """把 [-1, 1] 的 float tensor 轉成 16-bit PCM bytes"""
+    import torch
+
+    samples = audio.detach().flatten().float().clamp(-1.0, 1.0)
+    return (samples * 32767.0).round().to(torch.int16).cpu().numpy().tobytes()
+
+
+def to_wav_bytes(output):
+    """把 outetts 的 ModelOutput 編碼成記憶體中的 wav"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(output.sr)
+        wav.writeframes(audio_to_pcm16(output.audio))
+    return buffer.getvalue()
+
+
+def create_interface(model_path=DEFAULT_MODEL_DIR, tokenizer_path=None, backend="hf", device=None, n_gpu_layers=0):
+    """依 backend 建立 outetts.Interface"""
+    import outetts
+
+    int8 = backend == "hf-int8"
+    dtype = None
+    if int8:
+        import torch
+        backend, device, dtype = "hf", "cpu", torch.float32
+
+    # GGUF 檔案本身不含 HF tokenizer，未指定時使用 base model 的 tokenizer
+    if tokenizer_path is None:
+        tokenizer_path = model_path if os.path.isdir(model_path) else DEFAULT_MODEL_DIR
+
+    interface = outetts.Interface(
+        config=outetts.ModelConfig(
+            model_path=model_path,
+            tokenizer_path=tokenizer_path,
+            interface_version=outetts.InterfaceVersion.V3,
+            backend=outetts.Backend(backend),
+            device=device,
+            dtype=dtype,
+            n_gpu_layers=n_gpu_layers,
+        )
+    )
+    if int8:
+        from quantize_model import quantize_int8
+        interface.model.model = quantize_int8(interface.model.model)
+    return interface
+
+
+class TTSEngine:
+    """包裝 outetts.Interface，模型只載入一次"""
+
+    def __init__(self, model_path=DEFAULT_MODEL_DIR, tokenizer_path=None, backend="hf",
+                 device=None, n_gpu_layers=0, speaker_dir=DEFAULT_SPEAKER_DIR, prefix_cache_mb=0,
+                 utterance_cache=None, length_guard=True):
+        import outetts
+
+        self.model_path = model_path
+        self.backend = backend
+        self.speaker_dir = speaker_dir
+        self.interface = create_interface(model_path, tokenizer_path, backend, device, n_gpu_layers)
+        self._speakers = {}
+        self._speaker_ids = {}
+        self._model_ids = {}
+        # HF 模型不是 thread-safe，同一時間只允許一個生成
+        self.lock = threading.Lock()
+
+        # speaker 前綴的 KV cache，只適用於 HF backend
+        self.prefix_cache = None
+        if prefix_cache_mb > 0 and self.interface.config.backend == outetts.Backend.HF:
+            from prefix_cache import PrefixKVCache
+            self.prefix_cache = PrefixKVCache(int(prefix_cache_mb * 1024 * 1024))
+
+        # 重複短句的語音快取（utterance_cache.UtteranceCache）
+        self.utterance_cache = utterance_cache
+
+        # 記憶體中的 LoRA adapter（adapters.AdapterManager 建立時會設定）
+        self.adapters = None
+
+        # 依文字長度限制生成 token 數，並在靜音 / 重複迴圈失控時提前結束（generation_budget.GenerationGuard）
+        self.guard = None
+        if length_guard:
+            from generation_budget import guard
+            self.guard = guard(self.interface)
+
+    # ---------- speaker ----------
+
+    def _resolve_speaker_path(self, name):
+        if os.path.exists(name):
+            return name
+        for ext in (BINARY_EXT, ".json"):
+            path = os.path.join(self.speaker_dir, name + ext)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def get_speaker(self, name=None):
+        """
+        依名稱取得 speaker：speaker 目錄中的檔名（不含副檔名）、檔案路徑或 outetts 預設 speaker
+        第一次載入後會快取
+        """
+        name = name or DEFAULT_SPEAKER
+        speaker = self._speakers.get(name)
+        if speaker is None:
+            path = self._resolve_speaker_path(name)
+            if path is not None:
+                speaker = load_speaker(path, self.interface)
+            else:
+                speaker = self.interface.load_default_speaker(name)
+            self._speakers[name] = speaker
+        return speaker
+
+    def warm_speakers(self, names):
+        for name in names:
+            self.get_speaker(name)
+
+    def loaded_speakers(self):
+        return sorted(self._speakers)
+
+    def speaker_id(self, name=None):
+        """speaker 內容的雜湊，供快取鍵使用"""
+        from utterance_cache import speaker_fingerprint
+
+        name = name or DEFAULT_SPEAKER
+        if name not in self._speaker_ids:
+            self._speaker_ids[name] = speaker_fingerprint(self.get_speaker(name))
+        return self._speaker_ids[name]
+
+    def model_id(self, adapter=None):
+        """模型（含 adapter）的雜湊，供快取鍵使用"""
+        from utterance_cache import model_fingerprint
+
+        if adapter not in self._model_ids:
+            adapter_id = None
+            if adapter is not None:
+                adapter_id = model_fingerprint(self.adapters.path(adapter))
+            self._model_ids[adapter] = model_fingerprint(self.model_path, adapter_id, self.backend)
+        return self._model_ids[adapter]
+
+    def adapter_changed(self, adapter):
+        """adapter 載入或卸載後，丟棄與它相關的快取鍵與前綴 KV"""
+        self._model_ids.pop(adapter, None)
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
+
+    # ---------- adapter ----------
+
+    def use_adapter(self, adapter=None):
+        """讓指定 adapter 生效的 context manager，呼叫端需持有 self.lock"""
+        if self.adapters is None:
+            if adapter is not None:
+                raise ValueError(f"adapter 未載入: {adapter}")
+            return contextlib.nullcontext()
+        return self.adapters.activate(adapter)
+
+    # ---------- 生成 ----------
+
+    def make_config(self, text, speaker=None, generation_type="chunked", sampler=None, max_length=8192):
+        import outetts
+
+        if not text:
+            raise ValueError("text can not be empty!")
+
+        return outetts.GenerationConfig(
+            text=text,
+            generation_type=outetts.GenerationType(generation_type),
+            speaker=prompt_safe_speaker(self.get_speaker(speaker)),
+            sampler_config=outetts.SamplerConfig(**(sampler or {})),
+            max_length=max_length,
+        )
+
+    def generate(self, text, speaker=None, generation_type="chunked", sampler=None, max_length=8192, adapter=None):
+        """生成一段語音，回傳 outetts 的 ModelOutput"""
+        import outetts
+        from outetts.version.playback import ModelOutput
+
+        config = self.make_config(text, speaker, generation_type, sampler, max_length)
+
+        key, cached = self.cache_lookup(text, speaker, generation_type, sampler, adapter)
+        if cached is not None:
+            return cached
+
+        if config.generation_type in (outetts.GenerationType.CHUNKED, outetts.GenerationType.REGULAR):
+            tokens = []
+            for output in self.iter_chunk_tokens(config, adapter):
+                tokens.extend(output)
+            audio = self.decode_tokens(tokens)
+            if audio is None:
+                # 例如一開始就被 length_guard 判定為靜音，整段都被截掉
+                raise RuntimeError("No audio tokens found in the output")
+            output = ModelOutput(audio, self.interface.audio_codec.sr)
+        else:
+            with self.lock, self.use_adapter(adapter):
+                output = self.interface.generate(config=config)
+
+        self.cache_store(key, output)
+        return output
+
+    # ---------- 語音快取 ----------
+
+    def cache_lookup(self, text, speaker=None, generation_type="chunked", sampler=None, adapter=None):
+        """
+        查詢語音快取，回傳 (快取鍵, 命中時的 ModelOutput，否則 None)；未啟用快取時為 (None, None)
+        generate、BatchScheduler、stream_generate 與 SentencePipeline 共用，命中時都不經過模型
+        """
+        if self.utterance_cache is None:
+            return None, None
+        import torch
+        import outetts
+        from outetts.version.playback import ModelOutput
+        from utterance_cache import cache_key
+
+        key = cache_key(text, self.speaker_id(speaker), self.model_id(adapter),
+                        outetts.SamplerConfig(**(sampler or {})), getattr(generation_type, "value", generation_type))
+        cached = self.utterance_cache.get(key)
+        if cached is None:
+            return key, None
+        audio = torch.from_numpy(cached.pcm.astype("float32") / 32767.0).view(1, 1, -1)
+        return key, ModelOutput(audio, cached.sample_rate)
+
+    def cache_store(self, key, output):
+        """把生成結果存入快取（key 為 cache_lookup 回傳的鍵，None 時不做事）"""
+        if key is None or output.audio is None:
+            return
+        import numpy as np
+        from utterance_cache import CachedAudio
+
+        pcm = np.frombuffer(audio_to_pcm16(output.audio), dtype="<i2")
+        self.utterance_cache.put(key, CachedAudio(pcm, output.sr))
+
+    def split_text(self, config):
+        """依 generation_type 決定要逐段生成的文字"""
+        import outetts
+        from outetts.utils.chunking import chunk_text
+
+        if config.generation_type == outetts.GenerationType.CHUNKED:
+            return chunk_text(config.text)
+        return [config.text]
+
+    def iter_chunk_tokens(self, config, adapter=None):
+        """逐段生成，每段完成後立即 yield 該段的輸出 token（只在生成期間持有模型鎖）"""
+        self.interface.check_generation_max_length(config.max_length)
+        for chunk in self.split_text(config):
+            input_ids = self.interface.prepare_prompt(chunk, prompt_safe_speaker(config.speaker))
+            with self.lock, self.use_adapter(adapter):
+                chunk_config = config
+                if self.prefix_cache is not None:
+                    chunk_config = self.prefix_cache.attach(self, input_ids, config, adapter)
+                output = self.interface._generate(input_ids, chunk_config)
+            yield output
+
+    def decode_tokens(self, tokens):
+        """把 LM 輸出的 token 解碼成 codec 取樣率的波形 tensor；沒有音訊 token 時回傳 None"""
+        return self.interface.get_audio(tokens)
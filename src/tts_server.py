@@ -0,0 +1,526 @@
+"""
+常駐 TTS 推論伺服器
+啟動時載入一次模型（base 或合併後的模型），預先載入 speaker，
+之後以佇列依序處理 /generate 請求，避免每句話都重新載入 1B 模型。
+
+啟動:
+    python src/tts_server.py --model models/Llama-OuteTTS-1.0-1B --speaker uep_speaker
+
+呼叫:
+    curl -X POST localhost:8765/generate -d '{"text": "Hello!", "speaker": "uep_speaker"}' -o out.wav
+
+多行程（CPU）：模型只載入一次，--workers 個 fork 出來的行程共用權重並輪流接受連線（見 shared_weights.py）
+    python src/tts_server.py --workers 4
+"""
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import argparse
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    """一個排隊中的生成請求"""
+
+    def __init__(self, request):
+        self.request = request
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.enqueued_at = time.perf_counter()
+        self.started_at = None
+        # 呼叫端已逾時放棄（回傳 504）：還在佇列中的話就不再生成
+        self.cancelled = False
+
+
+class GenerationWorker:
+    """單一背景執行緒依序消化佇列中的請求"""
+
+    def __init__(self, engine, max_queue=32):
+        self.engine = engine
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="tts-worker", daemon=True)
+        self._thread.start()
+
+    def pending(self):
+        return self.jobs.qsize()
+
+    def submit(self, request, timeout=None):
+        job = Job(request)
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            raise QueueFullError("佇列已滿")
+        if not job.done.wait(timeout):
+            job.cancelled = True
+            raise TimeoutError("生成逾時")
+        if job.error is not None:
+            raise job.error
+        return job
+
+    def _run(self):
+        from tts_engine import to_wav_bytes
+
+        while True:
+            job = self.jobs.get()
+            if job.cancelled:
+                job.done.set()
+                self.jobs.task_done()
+                continue
+            job.started_at = time.perf_counter()
+            try:
+                req = job.request
+                output = self.engine.generate(
+                    text=req["text"],
+                    speaker=req.get("speaker"),
+                    generation_type=req.get("generation_type", "chunked"),
+                    sampler=req.get("sampler"),
+                    max_length=req.get("max_length", 8192),
+                    adapter=req.get("adapter"),
+                )
+                job.result = to_wav_bytes(output)
+            except Exception as e:
+                job.error = e
+            finally:
+                job.done.set()
+                self.jobs.task_done()
+
+
+class BatchedGenerationWorker:
+    """與 GenerationWorker 介面相同，但把請求交給 BatchScheduler 合併成批次生成"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    def pending(self):
+        return self.scheduler.pending()
+
+    def submit(self, request, timeout=None):
+        from concurrent.futures import TimeoutError as FutureTimeoutError
+        from tts_engine import to_wav_bytes
+
+        job = Job(request)
+        try:
+            synthesis = self.scheduler.submit(
+                text=request["text"],
+                speaker=request.get("speaker"),
+                generation_type=request.get("generation_type", "chunked"),
+                sampler=request.get("sampler"),
+                max_length=request.get("max_length", 8192),
+                adapter=request.get("adapter"),
+            )
+        except queue.Full:
+            raise QueueFullError("佇列已滿")
+        try:
+            output = synthesis.future.result(timeout)
+        except FutureTimeoutError:
+            # 只有還沒進入 batch 的請求能取消（排程器會略過）；已在生成中的會照常完成，結果直接丟棄
+            synthesis.future.cancel()
+            raise TimeoutError("生成逾時")
+        job.enqueued_at = synthesis.enqueued_at
+        job.started_at = synthesis.started_at
+        job.result = to_wav_bytes(output)
+        return job
+
+
+class SentencePipelineWorker:
+    """長文字依句子切開，所有句子一起送進 BatchScheduler 平行生成後再串接"""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def pending(self):
+        return self.pipeline.scheduler.pending()
+
+    def submit(self, request, timeout=None):
+        from concurrent.futures import TimeoutError as FutureTimeoutError
+        from tts_engine import to_wav_bytes
+
+        job = Job(request)
+        job.started_at = job.enqueued_at
+        try:
+            output = self.pipeline.synthesize(
+                text=request["text"],
+                speaker=request.get("speaker"),
+                sampler=request.get("sampler"),
+                max_length=request.get("max_length", 8192),
+                adapter=request.get("adapter"),
+                timeout=timeout,
+            )
+        except queue.Full:
+            raise QueueFullError("佇列已滿")
+        except FutureTimeoutError:
+            raise TimeoutError("生成逾時")
+        job.result = to_wav_bytes(output)
+        return job
+
+
+class TTSRequestHandler(BaseHTTPRequestHandler):
+    server_version = "UEP-TTS/1.0"
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        engine = self.server.engine
+        if self.path == "/health":
+            self._send_json(200, {
+                "status": "ok",
+                "model": engine.model_path,
+                "queued": self.server.worker.pending(),
+                "pid": os.getpid(),
+                "workers": self.server.workers,
+            })
+        elif self.path == "/speakers":
+            self._send_json(200, {"loaded": engine.loaded_speakers()})
+        elif self.path == "/adapters":
+            loaded = engine.adapters.loaded() if engine.adapters is not None else []
+            self._send_json(200, {"loaded": loaded})
+        elif self.path == "/stats":
+            stats = {}
+            if engine.prefix_cache is not None:
+                stats["prefix_cache"] = engine.prefix_cache.stats()
+            if engine.utterance_cache is not None:
+                stats["utterance_cache"] = engine.utterance_cache.stats()
+            self._send_json(200, stats)
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path in ("/adapters/load", "/adapters/unload"):
+            self._manage_adapter()
+            return
+        if self.path not in ("/generate", "/stream"):
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not request.get("text"):
+                raise ValueError("text can not be empty!")
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        if self.path == "/stream":
+            self._stream(request)
+            return
+
+        try:
+            job = self.server.worker.submit(request, timeout=self.server.request_timeout)
+        except QueueFullError as e:
+            self._send_json(503, {"error": str(e)})
+            return
+        except TimeoutError as e:
+            self._send_json(504, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+
+        finished = time.perf_counter()
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/wav")
+        self.send_header("Content-Length", str(len(job.result)))
+        self.send_header("X-Queue-Seconds", f"{job.started_at - job.enqueued_at:.3f}")
+        self.send_header("X-Generate-Seconds", f"{finished - job.started_at:.3f}")
+        self.end_headers()
+        self.wfile.write(job.result)
+
+    def _manage_adapter(self):
+        """
+        POST /adapters/load   {"name": "uep", "path": "outputs/lora_model"}
+        POST /adapters/unload {"name": "uep"}
+        """
+        adapters = self.server.engine.adapters
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if adapters is None:
+                raise ValueError("伺服器未啟用 adapter（需使用 HF backend 並以 --adapter 或 --enable-adapters 啟動）")
+            if self.server.workers > 1:
+                # 只會改到處理這個請求的 worker，其他 worker 不受影響
+                raise ValueError("多行程模式下無法在執行中載入 / 卸載 adapter，請以 --adapter 在啟動時載入")
+            if self.path == "/adapters/load":
+                seconds = adapters.load(request["name"], request["path"])
+                self._send_json(200, {"loaded": adapters.loaded(), "seconds": round(seconds, 3)})
+            else:
+                adapters.unload(request["name"])
+                self._send_json(200, {"loaded": adapters.loaded()})
+        except (KeyError, ValueError, FileNotFoundError, json.JSONDecodeError) as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+
+    def _stream(self, request):
+        """
+        邊生成邊回傳：每段文字解碼完成就寫出對應的 PCM
+        不經過生成佇列，各段生成時仍會取得引擎的模型鎖
+        format 為 "wav"（預設，長度未知的串流 wav）或 "pcm"（16-bit mono raw PCM）
+        """
+        from streaming import stream_generate, WavStreamWriter, RawPCMWriter
+
+        engine = self.server.engine
+        frames = stream_generate(
+            engine,
+            text=request["text"],
+            speaker=request.get("speaker"),
+            generation_type=request.get("generation_type", "chunked"),
+            sampler=request.get("sampler"),
+            max_length=request.get("max_length", 8192),
+            adapter=request.get("adapter"),
+        )
+        raw = request.get("format", "wav") == "pcm"
+        sample_rate = engine.interface.audio_codec.sr
+
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/L16" if raw else "audio/wav")
+        self.send_header("X-Sample-Rate", str(sample_rate))
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        sink = RawPCMWriter(self.wfile) if raw else WavStreamWriter(self.wfile, sample_rate)
+        try:
+            with sink:
+                for frame in frames:
+                    sink.write(frame.samples)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class TTSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, engine, max_queue=32, request_timeout=300, verbose=False, worker=None,
+                 listener=None, workers=1):
+        """listener：多行程模式下由父行程建立、各 worker 共用的監聽 socket"""
+        super().__init__(address, TTSRequestHandler, bind_and_activate=listener is None)
+        if listener is not None:
+            self.socket.close()
+            self.socket = listener
+            self.server_name = socket.getfqdn(address[0])
+            self.server_port = listener.getsockname()[1]
+        self.engine = engine
+        self.worker = worker or GenerationWorker(engine, max_queue)
+        self.request_timeout = request_timeout
+        self.verbose = verbose
+        self.workers = workers
+
+    def get_request(self):
+        # 共用的監聽 socket 為 non-blocking（其他 worker 可能先接走連線），接到的連線改回 blocking
+        conn, address = super().get_request()
+        conn.setblocking(True)
+        return conn, address
+
+
+class TTSClient:
+    """給 U.E.P's Core 等呼叫端使用的簡易 client（只用標準函式庫）"""
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=300):
+        self.base_url = f"http://{host}:{port}"
+        self.timeout = timeout
+
+    def generate(self, text, speaker=None, generation_type="chunked", sampler=None, adapter=None):
+        """回傳 wav bytes"""
+        payload = {"text": text, "generation_type": generation_type}
+        if speaker:
+            payload["speaker"] = speaker
+        if adapter:
+            payload["adapter"] = adapter
+        if sampler:
+            payload["sampler"] = sampler
+        req = urllib.request.Request(
+            self.base_url + "/generate",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return resp.read()
+
+    def health(self):
+        with urllib.request.urlopen(self.base_url + "/health", timeout=self.timeout) as resp:
+            return json.loads(resp.read())
+
+
+def build_worker(engine, args):
+    """依參數建立生成佇列（動態批次 / 句子平行）；None 表示使用預設的 GenerationWorker"""
+    worker = None
+    if args.batch_window_ms > 0:
+        from batching import BatchScheduler
+
+        scheduler = BatchScheduler(engine, args.max_batch_size, args.batch_window_ms, args.max_queue)
+        worker = BatchedGenerationWorker(scheduler)
+        if args.sentence_parallel:
+            from parallel_pipeline import SentencePipeline
+
+            worker = SentencePipelineWorker(SentencePipeline(scheduler=scheduler, crossfade_ms=args.crossfade_ms))
+    return worker
+
+
+def serve_workers(engine, args):
+    """
+    父行程已載入模型；fork 出 args.workers 個行程，各自以共用的監聽 socket 執行 TTSServer
+    生成佇列與背景執行緒在 fork 之後才於各 worker 中建立
+    """
+    from shared_weights import prepare_for_fork, WorkerProcesses
+
+    stats = prepare_for_fork(engine, share_memory=args.share_memory)
+    where = "共享記憶體" if stats["shared_memory"] else "copy-on-write"
+    print(f"🧊 {stats['weight_mb']:.0f}MB 權重由 {args.workers} 個行程以 {where} 共用")
+
+    listener = socket.create_server((args.host, args.port), backlog=128)
+    listener.setblocking(False)
+
+    def serve(index):
+        server = TTSServer((args.host, args.port), engine, args.max_queue, args.timeout, args.verbose,
+                           build_worker(engine, args), listener=listener, workers=args.workers)
+        server.serve_forever()
+
+    processes = WorkerProcesses(serve, args.workers, args.threads_per_worker)
+    print(f"🚀 伺服器啟動: http://{args.host}:{args.port}（{args.workers} 個 worker，"
+          f"每個 {processes.threads_per_worker} 個執行緒）")
+    try:
+        processes.start()
+        report = processes.memory_report()
+        if report is not None:
+            print(f"📊 worker PSS 合計 {report['total_pss']:.0f}MB（單一 worker RSS "
+                  f"{max(u['rss'] for u in report['workers'].values()):.0f}MB）")
+        processes.supervise()
+    except KeyboardInterrupt:
+        print("\n👋 伺服器關閉")
+    finally:
+        processes.stop()
+        listener.close()
+
+
+def main():
+    from tts_engine import DEFAULT_MODEL_DIR, DEFAULT_SPEAKER_DIR, BACKENDS
+
+    parser = argparse.ArgumentParser(description="常駐 TTS 推論伺服器")
+    parser.add_argument("--model", default=DEFAULT_MODEL_DIR, help="模型目錄（base 或合併後的模型）")
+    parser.add_argument("--tokenizer", default=None, help="tokenizer 目錄，預設與模型相同")
+    parser.add_argument("--backend", default="hf",
+                        help=f"{' / '.join(BACKENDS)}（hf-int8 為 CPU int8 量化，llamacpp 使用 GGUF，見 quantize_model.py）")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--speaker-dir", default=DEFAULT_SPEAKER_DIR)
+    parser.add_argument("--speaker", action="append", default=[], help="啟動時預先載入的 speaker，可重複指定")
+    parser.add_argument("--adapter", action="append", default=[],
+                        help="啟動時載入的 LoRA adapter（name=path），可重複指定；請求中以 \"adapter\" 欄位選用")
+    parser.add_argument("--enable-adapters", action="store_true", help="不預先載入 adapter，但允許之後經由 API 載入")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-queue", type=int, default=32, help="佇列上限，超過時回傳 503")
+    parser.add_argument("--timeout", type=float, default=300, help="單一請求等待上限（秒）")
+    parser.add_argument("--batch-window-ms", type=float, default=0,
+                        help="大於 0 時啟用動態批次：在此時間窗內到達的請求合併成一個 batch 生成")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="單一 batch 的最大序列數")
+    parser.add_argument("--sentence-parallel", action="store_true",
+                        help="搭配動態批次使用：長文字依句子切開後平行生成，再以 crossfade 串接")
+    parser.add_argument("--crossfade-ms", type=float, default=30, help="句子交界的 crossfade 長度")
+    parser.add_argument("--prefix-cache-mb", type=float, default=0,
+                        help="speaker 前綴 KV cache 的記憶體上限（MB），0 表示停用")
+    parser.add_argument("--utterance-cache-dir", default=None, help="語音快取的磁碟目錄，不指定則只用記憶體")
+    parser.add_argument("--utterance-cache-mb", type=float, default=0,
+                        help="語音快取的記憶體上限（MB），0 表示停用快取")
+    parser.add_argument("--utterance-cache-disk-mb", type=float, default=1024, help="語音快取的磁碟上限（MB）")
+    parser.add_argument("--utterance-variants", type=int, default=1, help="每句話最多保存幾個版本")
+    parser.add_argument("--utterance-playback", default="deterministic",
+                        choices=["deterministic", "round_robin", "random"], help="多版本時的播放方式")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="推論行程數：模型只載入一次，fork 出來的行程共用權重（僅限 CPU 與 Linux / macOS）")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="每個 worker 的 torch 執行緒數，預設為 CPU 核心數 / --workers")
+    parser.add_argument("--share-memory", action="store_true",
+                        help="搭配 --workers：把權重搬進共享記憶體，而非依賴 copy-on-write")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        if args.device not in (None, "cpu"):
+            parser.error("--workers 只支援 CPU（CUDA 無法在 fork 出來的行程中使用）")
+        args.device = "cpu"
+
+    from tts_engine import TTSEngine
+
+    utterance_cache = None
+    if args.utterance_cache_mb > 0:
+        from utterance_cache import UtteranceCache
+
+        utterance_cache = UtteranceCache(
+            cache_dir=args.utterance_cache_dir,
+            memory_mb=args.utterance_cache_mb,
+            disk_mb=args.utterance_cache_disk_mb,
+            max_variants=args.utterance_variants,
+            playback=args.utterance_playback,
+        )
+
+    print(f"🔄 載入模型: {args.model}")
+    start = time.perf_counter()
+    engine = TTSEngine(
+        model_path=args.model,
+        tokenizer_path=args.tokenizer,
+        backend=args.backend,
+        device=args.device,
+        speaker_dir=args.speaker_dir,
+        prefix_cache_mb=args.prefix_cache_mb,
+        utterance_cache=utterance_cache,
+    )
+    engine.warm_speakers(args.speaker)
+
+    if args.adapter or args.enable_adapters:
+        from adapters import AdapterManager, parse_adapter_args
+
+        manager = AdapterManager(engine)
+        for name, path in parse_adapter_args(args.adapter).items():
+            seconds = manager.load(name, path)
+            print(f"🔧 載入 adapter: {name} ({seconds:.1f}s)")
+    print(f"✅ 模型載入完成 ({time.perf_counter() - start:.1f}s)，speaker: {engine.loaded_speakers()}")
+
+    if args.batch_window_ms > 0:
+        print(f"📦 動態批次: 時間窗 {args.batch_window_ms}ms，batch 上限 {args.max_batch_size}")
+        if args.sentence_parallel:
+            print("✂️ 句子層級平行生成已啟用")
+    elif args.sentence_parallel:
+        print("⚠️ --sentence-parallel 需要搭配 --batch-window-ms，已忽略")
+
+    if args.workers > 1:
+        return serve_workers(engine, args)
+
+    worker = build_worker(engine, args)
+    server = TTSServer((args.host, args.port), engine, args.max_queue, args.timeout, args.verbose, worker)
+    print(f"🚀 伺服器啟動: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 伺服器關閉")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+合成語音快取
+"Wow!"、"I see."、"Okay!" 這類短句會一直重複出現，
+以 (正規化文字, speaker, 模型/adapter, sampler 設定) 的雜湊為鍵保存生成結果，命中時完全不經過模型。
+分成記憶體與磁碟兩層，各自有容量上限（LRU 淘汰）；每個鍵可保存數個版本，
+播放時可固定使用第一個版本，或在版本間輪流 / 隨機挑選。
+"""
+import os
+import io
+import re
+import json
+import wave
+import array
+import random
+import shutil
+import hashlib
+import threading
+import unicodedata
+import dataclasses
+from collections import OrderedDict
+
+import numpy as np
+
+PLAYBACK_MODES = ("deterministic", "round_robin", "random")
+
+
+def normalize_text(text):
+    """只做不影響發音的正規化：Unicode NFKC、引號統一、空白合併"""
+    text = unicodedata.normalize("NFKC", text)
+    text = re.sub(r"[“”„‟«»]", '"', text)
+    text = re.sub(r"[‘’‛`´]", "'", text)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip()
+
+
+def speaker_fingerprint(speaker):
+    """以 speaker 的文字與 codebook token 計算雜湊（同時支援 list 與 .uepspk 的 memoryview）"""
+    if speaker is None:
+        return "none"
+    digest = hashlib.sha1(speaker["text"].encode("utf-8"))
+    for w in speaker["words"]:
+        digest.update(w["word"].encode("utf-8"))
+        digest.update(array.array("h", w["c1"]).tobytes())
+        digest.update(array.array("h", w["c2"]).tobytes())
+    return digest.hexdigest()
+
+
+def model_fingerprint(model_path, adapter=None, backend=None):
+    """以模型目錄的設定檔內容與權重檔大小、修改時間計算雜湊，不讀取權重本身"""
+    digest = hashlib.sha1(os.path.realpath(model_path).encode("utf-8"))
+    if os.path.isfile(model_path):
+        stat = os.stat(model_path)
+        digest.update(f"{stat.st_size}:{stat.st_mtime}".encode("utf-8"))
+    elif os.path.isdir(model_path):
+        for name in sorted(os.listdir(model_path)):
+            path = os.path.join(model_path, name)
+            if name.endswith(".json"):
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+            elif name.endswith((".safetensors", ".bin", ".gguf")):
+                stat = os.stat(path)
+                digest.update(f"{name}:{stat.st_size}:{stat.st_mtime}".encode("utf-8"))
+    if adapter:
+        digest.update(str(adapter).encode("utf-8"))
+    if backend:
+        digest.update(str(backend).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def cache_key(text, speaker_id, model_id, sampler=None, generation_type="chunked"):
+    if dataclasses.is_dataclass(sampler):
+        sampler = dataclasses.asdict(sampler)
+    payload = json.dumps({
+        "text": normalize_text(text),
+        "speaker": speaker_id,
+        "model": model_id,
+        "sampler": sampler or {},
+        "generation_type": generation_type,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CachedAudio:
+    """16-bit PCM 單聲道音訊"""
+
+    def __init__(self, pcm, sample_rate):
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+
+    @property
+    def nbytes(self):
+        return self.pcm.nbytes
+
+    def to_wav_bytes(self):
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(self.pcm.astype("<i2").tobytes())
+        return buffer.getvalue()
+
+    @classmethod
+    def from_wav_bytes(cls, data):
+        with wave.open(io.BytesIO(data), "rb") as wav:
+            pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2")
+            return cls(pcm, wav.getframerate())
+
+
+class MemoryTier:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        variants = self._entries.get(key)
+        if variants is not None:
+            self._entries.move_to_end(key)
+        return variants
+
+    def put(self, key, variants):
+        size = sum(v.nbytes for v in variants)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= sum(v.nbytes for v in old)
+        self._entries[key] = variants
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= sum(v.nbytes for v in evicted)
+
+
+class DiskTier:
+    """
+    每個鍵一個目錄，版本存成 0.wav、1.wav ...；以目錄的修改時間做 LRU
+    同一個目錄可由多個行程共用（tts_server --workers）：暫存檔名各自獨立、
+    讀取時檔案已被其他行程淘汰視為未命中，容量每次寫入後重新掃描目錄計算，不依賴各行程自己的計數
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def nbytes(self):
+        return sum(size for _, _, size in self._scan())
+
+    def _key_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _scan(self):
+        """[(mtime, key_dir, size)]；掃描期間被其他行程刪除的目錄直接略過"""
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            try:
+                keys = os.listdir(prefix_dir)
+            except FileNotFoundError:
+                continue
+            for key in keys:
+                key_dir = os.path.join(prefix_dir, key)
+                try:
+                    size = sum(os.path.getsize(os.path.join(key_dir, f)) for f in os.listdir(key_dir))
+                    entries.append((os.path.getmtime(key_dir), key_dir, size))
+                except FileNotFoundError:
+                    continue
+        return entries
+
+    def get(self, key):
+        key_dir = self._key_dir(key)
+        try:
+            variants = []
+            names = [n for n in os.listdir(key_dir) if n.endswith(".wav")]
+            for name in sorted(names, key=lambda n: int(n.split(".")[0])):
+                with open(os.path.join(key_dir, name), "rb") as f:
+                    variants.append(CachedAudio.from_wav_bytes(f.read()))
+            os.utime(key_dir)
+        except (FileNotFoundError, NotADirectoryError):
+            # 不存在，或讀取途中被其他行程淘汰
+            return None
+        return variants or None
+
+    def add_variant(self, key, index, audio):
+        key_dir = self._key_dir(key)
+        path = os.path.join(key_dir, f"{index}.wav")
+        # 每個行程 / 執行緒各自的暫存檔，同時寫入同一個鍵時不會互相覆蓋
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(key_dir, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(audio.to_wav_bytes())
+            os.replace(tmp_path, path)
+        except (FileNotFoundError, FileExistsError):
+            # 寫入途中目錄被其他行程淘汰（makedirs 建立失敗後再檢查時目錄已被刪除也會是 FileExistsError）：這次不快取
+            return
+        self._evict()
+
+    def _evict(self):
+        entries = self._scan()
+        total = sum(size for _, _, size in entries)
+        for _, key_dir, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(key_dir, ignore_errors=True)
+            total -= size
+
+
+class UtteranceCache:
+    """
+    記憶體 + 磁碟兩層的語音快取
+    max_variants > 1 且 playback 不是 deterministic 時，前幾次請求仍會生成新版本，
+    湊滿 max_variants 後才完全由快取提供
+    """
+
+    def __init__(self, cache_dir=None, memory_mb=64, disk_mb=1024, max_variants=1, playback="deterministic"):
+        if playback not in PLAYBACK_MODES:
+            raise ValueError(f"playback 必須是 {PLAYBACK_MODES} 之一")
+        self.memory = MemoryTier(int(memory_mb * 1024 * 1024))
+        self.disk = DiskTier(cache_dir, int(disk_mb * 1024 * 1024)) if cache_dir else None
+        self.max_variants = max_variants
+        self.playback = playback
+        self._turns = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _variants(self, key):
+        variants = self.memory.get(key)
+        if variants is None and self.disk is not None:
+            variants = self.disk.get(key)
+            if variants is not None:
+                self.memory.put(key, variants)
+        return variants or []
+
+    def get(self, key):
+        """命中時回傳 CachedAudio，需要生成（未命中或版本尚未湊滿）時回傳 None"""
+        with self._lock:
+            variants = self._variants(key)
+            wants_more = self.playback != "deterministic" and len(variants) < self.max_variants
+            if not variants or wants_more:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            if self.playback == "random":
+                return random.choice(variants)
+            if self.playback == "round_robin":
+                turn = self._turns.get(key, 0)
+                self._turns[key] = turn + 1
+                return variants[turn % len(variants)]
+            return variants[0]
+
+    def put(self, key, audio):
+        with self._lock:
+            variants = list(self._variants(key))
+            if len(variants) >= self.max_variants:
+                return
+            variants.append(audio)
+            self.memory.put(key, variants)
+            if self.disk is not None:
+                self.disk.add_variant(key, len(variants) - 1, audio)
+
+    def stats(self):
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_bytes": self.memory.nbytes,
+        }
+        if self.disk is not None:
+            stats["disk_bytes"] = self.disk.nbytes
+        return stats
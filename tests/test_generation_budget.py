@@ -0,0 +1,112 @@
+"""
+generation_budget.RunawayDetector 的單元測試（以合成的 token 序列模擬 OuteTTS 的輸出）
+
+    python -m pytest tests
+"""
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from generation_budget import RunawayDetector
+
+WORD_START = 5
+WORD_END = 6
+C1 = range(1000, 2000)
+C2 = range(2000, 3000)
+
+
+def new_detector(**options):
+    return RunawayDetector(frozenset(C1), WORD_START, c2_ids=frozenset(C2), **options)
+
+
+def word(rng, frames, text_tokens=2):
+    """一個字：word_start、文字 token、frames 個 (c1, c2) frame、word_end"""
+    tokens = [WORD_START] + [rng.randrange(10, 100) for _ in range(text_tokens)]
+    for _ in range(frames):
+        tokens += [rng.choice(C1), rng.choice(C2)]
+    return tokens + [WORD_END]
+
+
+def pause(frames, c1=1500, c2=2500):
+    """停頓 / 靜音：同一組 code 重複 frames 次"""
+    return [c1, c2] * frames
+
+
+def feed_all(detector, tokens):
+    for token in tokens:
+        if detector.feed(token):
+            break
+    return detector.trim(tokens)
+
+
+def test_normal_speech_is_kept():
+    rng = random.Random(0)
+    tokens = [t for _ in range(30) for t in word(rng, rng.randint(8, 25))]
+    detector = new_detector()
+    assert feed_all(detector, tokens) == tokens
+    assert detector.reason is None
+
+
+def test_short_pause_is_not_a_loop():
+    rng = random.Random(1)
+    tokens = word(rng, 20) + [WORD_START, 50] + pause(25) + word(rng, 30)[1:] + word(rng, 20)
+    detector = new_detector()
+    assert feed_all(detector, tokens) == tokens
+    assert detector.reason is None
+
+
+def test_pause_below_silence_threshold_is_kept():
+    rng = random.Random(2)
+    tokens = word(rng, 20) + [WORD_START, 50] + pause(140) + [WORD_END] + word(rng, 20)
+    detector = new_detector()
+    assert feed_all(detector, tokens) == tokens
+    assert detector.reason is None
+
+
+def test_long_silence_is_trimmed():
+    rng = random.Random(3)
+    speech = word(rng, 20) + word(rng, 15)
+    tokens = speech + [WORD_START, 50] + pause(250)
+    detector = new_detector()
+    kept = feed_all(detector, tokens)
+    assert detector.reason == "silence"
+    # 靜音開始之前的內容都保留
+    assert kept == speech + [WORD_START, 50]
+
+
+def test_repeated_word_loop_is_trimmed():
+    rng = random.Random(4)
+    speech = word(rng, 20) + word(rng, 15)
+    repeated = word(rng, 6)
+    tokens = speech + repeated * 20
+    detector = new_detector()
+    kept = feed_all(detector, tokens)
+    assert detector.reason == "loop"
+    assert kept[:len(speech)] == speech
+    assert len(kept) < len(speech) + 2 * len(repeated)
+
+
+def test_audio_only_loop_needs_silence_frames():
+    # 只由 audio code 組成、週期為 3 個 frame 的迴圈：短時間不觸發，超過 silence_frames 才停止
+    pattern = [1001, 2001, 1002, 2002, 1003, 2003]
+    rng = random.Random(5)
+    speech = word(rng, 20)
+    detector = new_detector()
+    short = speech + [WORD_START, 50] + pattern * 20
+    assert feed_all(detector, short) == short
+
+    detector = new_detector()
+    kept = feed_all(detector, speech + [WORD_START, 50] + pattern * 80)
+    assert detector.reason == "loop"
+    assert kept[:len(speech)] == speech
+
+
+def test_long_word_is_trimmed():
+    rng = random.Random(6)
+    speech = word(rng, 20)
+    detector = new_detector()
+    kept = feed_all(detector, speech + word(rng, 400))
+    assert detector.reason == "long_word"
+    assert kept == speech
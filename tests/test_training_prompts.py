@@ -0,0 +1,52 @@
+"""
+training_prompts.stream_training_dataset 的測試：建立一個小型 token store，確認 IterableDataset 能實際取出資料
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+pytest.importorskip("datasets")
+
+import training_prompts
+from token_store import TokenStore
+
+
+class PromptProcessor:
+    """取代 outetts 的 PromptProcessor：只組出可辨識的字串"""
+
+    def get_training_prompt(self, speaker):
+        return f"<|text_start|>{speaker['text']}<|text_end|>"
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    store = TokenStore(str(tmp_path))
+    for i in range(10):
+        words = [{"word": f"w{i}", "start": 0, "end": 3, "duration": 0.04, "features": {}}]
+        store.add(f"key{i:02d}", f"sentence {i}", [1, 2, 3], [4, 5, 6], words)
+    store.save()
+    # 讓 _state 直接使用假的 processor，不需載入 outetts
+    training_prompts._worker_state[(str(tmp_path), None)] = (TokenStore(str(tmp_path)), PromptProcessor(), None)
+    yield str(tmp_path)
+    training_prompts._worker_state.pop((str(tmp_path), None), None)
+
+
+def test_stream_training_dataset_yields_every_record(store_dir):
+    dataset = training_prompts.stream_training_dataset(store_dir, num_shards=3)
+    assert dataset.num_shards == 3
+
+    first = next(iter(dataset))
+    assert first["text"].startswith("<|text_start|>sentence")
+
+    texts = sorted(example["text"] for example in dataset)
+    assert texts == sorted(f"<|text_start|>sentence {i}<|text_end|>" for i in range(10))
+
+
+def test_stream_training_dataset_shuffles_shards(store_dir):
+    dataset = training_prompts.stream_training_dataset(store_dir, num_shards=4).shuffle(seed=0, buffer_size=4)
+    assert len(list(dataset)) == 10
@@ -0,0 +1,67 @@
+"""
+utterance_cache.DiskTier 的測試：多個行程共用同一個快取目錄（tts_server --workers）
+
+    python -m pytest tests
+"""
+import os
+import sys
+import random
+import multiprocessing
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from utterance_cache import CachedAudio, DiskTier
+
+MAX_BYTES = 64 * 1024
+
+
+def audio(seed):
+    return CachedAudio(np.full(2000, seed, dtype="<i2"), 24000)
+
+
+def _hammer(cache_dir, seed, errors):
+    disk = DiskTier(cache_dir, MAX_BYTES)
+    rng = random.Random(seed)
+    try:
+        for _ in range(300):
+            key = f"{rng.randrange(40):064x}"
+            if rng.random() < 0.5:
+                disk.add_variant(key, 0, audio(rng.randrange(100)))
+            else:
+                variants = disk.get(key)
+                assert variants is None or variants[0].pcm.shape == (2000,)
+    except Exception as e:
+        errors.put(repr(e))
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="需要 fork")
+def test_disk_tier_shared_by_processes(tmp_path):
+    context = multiprocessing.get_context("fork")
+    errors = context.Queue()
+    processes = [context.Process(target=_hammer, args=(str(tmp_path), seed, errors)) for seed in range(4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+    assert errors.empty(), errors.get()
+    assert all(p.exitcode == 0 for p in processes)
+    disk = DiskTier(str(tmp_path), MAX_BYTES)
+    # 每次寫入後依實際目錄大小淘汰，最多超出同時寫入中的幾個項目
+    assert disk.nbytes <= MAX_BYTES + 4 * audio(0).nbytes * 2
+    leftovers = [name for _, _, names in os.walk(tmp_path) for name in names if name.endswith(".tmp")]
+    assert not leftovers
+
+
+def test_disk_tier_round_trip(tmp_path):
+    disk = DiskTier(str(tmp_path), MAX_BYTES)
+    key = "ab" * 32
+    assert disk.get(key) is None
+    disk.add_variant(key, 0, audio(7))
+    disk.add_variant(key, 1, audio(8))
+    variants = disk.get(key)
+    assert [int(v.pcm[0]) for v in variants] == [7, 8]
+    assert disk.nbytes > 0